@@ -1,16 +1,112 @@
 import logging
+import math
+import multiprocessing
 
+import numpy as np
 from tqdm import tqdm
 
+from CachedNNet import cacheNNet
+from MCTS import makeMCTS
+from utils import *
+
 log = logging.getLogger(__name__)
 
+# the Arena of a worker process, see Arena.playGames
+_arena = None
+
+
+def _initArenaWorker(player1, player2, game):
+    global _arena
+    _arena = Arena(player1, player2, game)
+
+
+def _playArenaGame(swapped):
+    """Plays one game in a worker and returns its result from player1's point of view."""
+    if swapped:
+        return -Arena(_arena.player2, _arena.player1, _arena.game).playGame()
+    return _arena.playGame()
+
+
+class MCTSPlayer():
+    """
+    An Arena player that plays the argmax of MCTS with a network loaded from
+    folder/filename. The network is only built on the first move, so the
+    player can be sent to worker processes and rebuilt there.
+    """
+
+    def __init__(self, game, nnetClass, folder, filename, args):
+        self.game = game
+        self.nnetClass = nnetClass
+        self.nnetArgs = dict(getNNetArgs(nnetClass) or {})
+        self.folder = folder
+        self.filename = filename
+        self.args = dict(args)
+        self.mcts = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['mcts'] = None
+        return state
+
+    def __call__(self, board):
+        if self.mcts is None:
+            args = dotdict(self.args)
+            nnet = cacheNNet(buildNNet(self.game, self.nnetClass, self.nnetArgs, self.folder, self.filename), args)
+            self.mcts = makeMCTS(self.game, nnet, args)
+        return np.argmax(self.mcts.getActionProb(board, temp=0))
+
+
+class SPRT():
+    """
+    Sequential probability ratio test for Arena gating. It tests the score of
+    one player over the decisive games (draws are ignored) with
+
+        H0: p = threshold - margin  (reject)
+        H1: p = threshold + margin  (accept)
+
+    and error rates alpha (accepting under H0) and beta (rejecting under H1).
+    """
+
+    ACCEPT = 1
+    REJECT = -1
+
+    def __init__(self, threshold, margin=0.1, alpha=0.05, beta=0.05):
+        self.p0 = max(threshold - margin, 1e-3)
+        self.p1 = min(threshold + margin, 1 - 1e-3)
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+        self.llr = 0.0
+        self.decision = 0
+
+    def update(self, result):
+        """
+        Adds the result of one game: 1 if the tested player won, -1 if it lost,
+        anything else is a draw.
+
+        Returns:
+            ACCEPT, REJECT, or 0 while undecided
+        """
+        if result == 1:
+            self.llr += math.log(self.p1 / self.p0)
+        elif result == -1:
+            self.llr += math.log((1 - self.p1) / (1 - self.p0))
+        if self.llr >= self.upper:
+            self.decision = self.ACCEPT
+        elif self.llr <= self.lower:
+            self.decision = self.REJECT
+        return self.decision
+
+    def describe(self):
+        outcome = {self.ACCEPT: 'accepted', self.REJECT: 'rejected', 0: 'undecided'}[self.decision]
+        return f'{outcome} (LLR {self.llr:.2f}, bounds {self.lower:.2f} / {self.upper:.2f})'
+
 
 class Arena():
     """
     An Arena class where any 2 agents can be pit against each other.
     """
 
-    def __init__(self, player1, player2, game, display=None):
+    def __init__(self, player1, player2, game, display=None, numWorkers=1):
         """
         Input:
             player 1,2: two functions that takes board as input, return action
@@ -18,6 +114,9 @@ class Arena():
             display: a function that takes board as input and prints it (e.g.
                      display in othello/OthelloGame). Is necessary for verbose
                      mode.
+            numWorkers: number of worker processes playGames distributes the
+                        games over. Players must be picklable (e.g.
+                        MCTSPlayer) when this is more than 1.
 
         see othello/OthelloPlayers.py for an example. See pit.py for pitting
         human players/other baselines with each other.
@@ -26,6 +125,7 @@ class Arena():
         self.player2 = player2
         self.game = game
         self.display = display
+        self.numWorkers = numWorkers
 
     def playGame(self, verbose=False):
         """
@@ -40,13 +140,14 @@ class Arena():
         players = [self.player2, None, self.player1]
         curPlayer = 1
         board = self.game.getInitBoard()
+        action = None
         it = 0
 
         for player in players[0], players[2]:
             if hasattr(player, "startGame"):
                 player.startGame()
 
-        while self.game.getGameEnded(board, curPlayer) == 0:
+        while self.game.getGameEndedAfterMove(board, curPlayer, action) == 0:
             it += 1
             if verbose:
                 assert self.display
@@ -78,11 +179,16 @@ class Arena():
             self.display(board)
         return curPlayer * self.game.getGameEnded(board, curPlayer)
 
-    def playGames(self, num, verbose=False):
+    def playGames(self, num, verbose=False, sprt=None):
         """
         Plays num games in which player1 starts num/2 games and player2 starts
         num/2 games.
 
+        With an SPRT given, the test is run on player2's results, the starting
+        player alternates from game to game and the match stops as soon as the
+        test reaches a decision; self.gamesSaved tells how many of the num
+        games were skipped.
+
         Returns:
             oneWon: games won by player1
             twoWon: games won by player2
@@ -90,27 +196,71 @@ class Arena():
         """
 
         num = int(num / 2)
+        if sprt is None:
+            schedule = [False] * num + [True] * num
+        else:
+            schedule = [False, True] * num
+        if self.numWorkers > 1 and not verbose:
+            results = self.playGamesParallel(schedule)
+        else:
+            results = self.playGamesSequential(schedule, verbose=verbose)
+
         oneWon = 0
         twoWon = 0
         draws = 0
-        for _ in tqdm(range(num), desc="Arena.playGames (1)"):
-            gameResult = self.playGame(verbose=verbose)
+        played = 0
+        # results come back from player1's point of view, whoever started
+        for gameResult in tqdm(results, total=len(schedule), desc="Arena.playGames"):
+            played += 1
             if gameResult == 1:
                 oneWon += 1
             elif gameResult == -1:
                 twoWon += 1
             else:
                 draws += 1
+            if sprt is not None and sprt.update(-gameResult) != 0:
+                break
+        results.close()
+
+        self.gamesSaved = len(schedule) - played
+        if sprt is not None:
+            log.info(f'SPRT {sprt.describe()} after {played} games, {self.gamesSaved} games saved')
 
+        # as after the second half of the games, player2 now starts
         self.player1, self.player2 = self.player2, self.player1
+        return oneWon, twoWon, draws
 
-        for _ in tqdm(range(num), desc="Arena.playGames (2)"):
-            gameResult = self.playGame(verbose=verbose)
-            if gameResult == -1:
-                oneWon += 1
-            elif gameResult == 1:
-                twoWon += 1
-            else:
-                draws += 1
+    def playGamesSequential(self, schedule, verbose=False):
+        """
+        Plays one game per entry of schedule in this process. An entry is True
+        if player2 starts that game.
 
-        return oneWon, twoWon, draws
+        Returns:
+            an iterator over the game results from player1's point of view, in
+            schedule order
+        """
+        for swapped in schedule:
+            if swapped:
+                self.player1, self.player2 = self.player2, self.player1
+            try:
+                gameResult = self.playGame(verbose=verbose)
+            finally:
+                if swapped:
+                    self.player1, self.player2 = self.player2, self.player1
+            yield -gameResult if swapped else gameResult
+
+    def playGamesParallel(self, schedule):
+        """
+        Plays one game per entry of schedule on numWorkers worker processes,
+        each of which holds its own copy of both players. An entry is True if
+        player2 starts that game.
+
+        Returns:
+            an iterator over the game results from player1's point of view, in
+            schedule order
+        """
+        # spawn, since TensorFlow does not survive a fork
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(self.numWorkers, initializer=_initArenaWorker,
+                      initargs=(self.player1, self.player2, self.game)) as pool:
+            yield from pool.imap(_playArenaGame, schedule)
@@ -0,0 +1,133 @@
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from NeuralNet import NeuralNet
+
+# rough per-entry cost of the OrderedDict slot, the (pi, v) tuple and the value
+ENTRY_OVERHEAD = 200
+
+
+class CachedNNet(NeuralNet):
+    """
+    Wraps a NeuralNet with a bounded cache of its evaluations, keyed by the
+    bytes of the canonical board. Every search tree is thrown away after its
+    episode, so without the cache the positions every episode goes through
+    (the openings above all) are evaluated again and again.
+
+    Entries are evicted least recently used first once they take more than
+    maxBytes. The cache is cleared whenever the weights change, i.e. on train
+    and load_checkpoint, which must therefore be called on the wrapper.
+    """
+
+    def __init__(self, nnet, maxBytes=256 << 20):
+        self.nnet = nnet
+        self.maxBytes = maxBytes
+        self.cache = OrderedDict()  # board bytes -> (pi, v)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.missTime = 0.0  # seconds spent in the wrapped network
+
+    def lookup(self, board):
+        key = np.ascontiguousarray(board).tobytes()
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+        return key, entry
+
+    def store(self, key, pi, v):
+        pi = np.array(pi)
+        pi.flags.writeable = False  # shared by every later hit
+        old = self.cache.pop(key, None)
+        if old is not None:
+            self.bytes -= sys.getsizeof(key) + old[0].nbytes + ENTRY_OVERHEAD
+        self.cache[key] = (pi, v)
+        self.bytes += sys.getsizeof(key) + pi.nbytes + ENTRY_OVERHEAD
+        while self.bytes > self.maxBytes and self.cache:
+            oldKey, (oldPi, _) = self.cache.popitem(last=False)
+            self.bytes -= sys.getsizeof(oldKey) + oldPi.nbytes + ENTRY_OVERHEAD
+        return pi, v
+
+    def predict(self, board):
+        key, entry = self.lookup(board)
+        if entry is not None:
+            return entry
+        start = time.perf_counter()
+        pi, v = self.nnet.predict(board)
+        self.missTime += time.perf_counter() - start
+        self.misses += 1
+        return self.store(key, pi, v)
+
+    def predict_batch(self, boards):
+        """
+        Only the boards that are not cached are sent to the network, in one
+        batch and once each; the repeats of a board within the batch count as
+        hits.
+        """
+        pis, vs = [None] * len(boards), [None] * len(boards)
+        missing = {}  # key -> indices of the board in the batch
+        for i, board in enumerate(boards):
+            key, entry = self.lookup(board)
+            if entry is not None:
+                pis[i], vs[i] = entry
+            elif key in missing:
+                missing[key].append(i)
+                self.hits += 1
+            else:
+                missing[key] = [i]
+        if missing:
+            start = time.perf_counter()
+            missingBoards = np.stack([boards[indices[0]] for indices in missing.values()])
+            if hasattr(self.nnet, 'predict_batch'):
+                newPis, newVs = self.nnet.predict_batch(missingBoards)
+            else:
+                newPis, newVs = zip(*[self.nnet.predict(board) for board in missingBoards])
+            self.missTime += time.perf_counter() - start
+            self.misses += len(missing)
+            for (key, indices), pi, v in zip(missing.items(), newPis, newVs):
+                pi, v = self.store(key, pi, v)
+                for i in indices:
+                    pis[i], vs[i] = pi, v
+        return np.asarray(pis), np.ravel(np.asarray(vs, dtype=float))
+
+    def clear(self):
+        self.cache.clear()
+        self.bytes = 0
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def timeSaved(self):
+        """Estimated seconds of network time the hits saved, at the average cost of a miss."""
+        return self.hits * self.missTime / self.misses if self.misses else 0.0
+
+    def describe(self):
+        return (f'hit rate {100 * self.hitRate():.1f}% ({self.hits}/{self.hits + self.misses}), '
+                f'~{self.timeSaved():.1f}s saved, {len(self.cache)} entries / {self.bytes / 2**20:.1f} MiB')
+
+    def train(self, examples):
+        self.clear()
+        return self.nnet.train(examples)
+
+    def save_checkpoint(self, folder, filename):
+        return self.nnet.save_checkpoint(folder=folder, filename=filename)
+
+    def load_checkpoint(self, folder, filename):
+        self.clear()
+        return self.nnet.load_checkpoint(folder=folder, filename=filename)
+
+
+def cacheNNet(nnet, args):
+    """
+    Returns nnet wrapped in a CachedNNet of args.evalCacheMB megabytes, or
+    nnet itself if the cache is disabled (evalCacheMB 0, the default).
+    """
+    cacheMB = args.get('evalCacheMB', 0)
+    if cacheMB <= 0:
+        return nnet
+    return CachedNNet(nnet, maxBytes=int(cacheMB * 2**20))
@@ -1,18 +1,118 @@
+import glob
 import logging
+import multiprocessing
 import os
+import random
+import queue
+import shutil
+import signal
 import sys
-from collections import deque
-from pickle import Pickler, Unpickler
-from random import shuffle
+import time
+from pickle import Unpickler
 
 import numpy as np
 from tqdm import tqdm
 
-from Arena import Arena
-from MCTS import MCTS
+from Arena import SPRT, Arena, MCTSPlayer
+from CachedNNet import CachedNNet, cacheNNet
+from ExampleStore import ExampleStore
+from MCTS import makeMCTS
+from ReplayBuffer import ReplayBuffer
+from utils import *
 
 log = logging.getLogger(__name__)
 
+# state of a self-play worker process, see Coach.selfPlay
+_worker = None
+_workerWeightsVersion = None
+
+
+def _initSelfPlayWorker(game, nnetClass, nnetArgs, args):
+    global _worker
+    _worker = Coach(game, buildNNet(game, nnetClass, nnetArgs), dotdict(args))
+
+
+def _selfPlayEpisode(task):
+    """Runs one episode in a worker, reloading the self-play weights when they changed."""
+    global _workerWeightsVersion
+    seed, weightsVersion = task
+    if _workerWeightsVersion != weightsVersion:
+        _worker.nnet.load_checkpoint(folder=_worker.args.checkpoint, filename='selfplay.pth.tar')
+        _workerWeightsVersion = weightsVersion
+    _worker.seedEpisode(seed)
+    _worker.mcts = makeMCTS(_worker.game, _worker.nnet, _worker.args)
+    return _worker.executeEpisode()
+
+
+def _asyncActor(game, nnetClass, nnetArgs, args, actor, bestVersion, examplesQueue, stop):
+    """
+    Self-play actor of Coach.learnAsync: plays episodes with the latest
+    accepted weights until stop is set and sends each episode's examples to
+    the learner.
+    """
+    coach = Coach(game, buildNNet(game, nnetClass, nnetArgs), dotdict(args))
+    version = None
+    episode = 0
+    while not stop.is_set():
+        if bestVersion.value != version:
+            version = bestVersion.value
+            coach.nnet.load_checkpoint(folder=coach.args.checkpoint, filename=coach.getCheckpointFile(version))
+        coach.seedEpisode(coach.getEpisodeSeed(actor, episode))
+        coach.mcts = makeMCTS(coach.game, coach.nnet, coach.args)
+        examplesQueue.put(coach.executeEpisode())
+        episode += 1
+
+
+def _asyncEvaluator(game, nnetClass, nnetArgs, args, bestVersion, candidates, results):
+    """
+    Evaluator of Coach.learnAsync: pits the newest candidate_<k> checkpoint
+    against the best one and, if it is accepted, saves it as checkpoint_<k>
+    and best and publishes k in bestVersion. Stops on a None candidate.
+
+    The candidate files are deleted once gated, or skipped for a newer one.
+    """
+    # learnAsync terminates the evaluator if the learner fails: exiting
+    # through SystemExit also shuts down the worker pool of a running Arena
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    coach = Coach(game, buildNNet(game, nnetClass, nnetArgs), dotdict(args))
+    folder = coach.args.checkpoint
+    finished = False
+    while not finished:
+        candidate = candidates.get()
+        finished = candidate is None
+        skipped = []
+        try:
+            while True:  # skip to the newest candidate
+                newer = candidates.get_nowait()
+                finished = finished or newer is None
+                if newer is not None:
+                    if candidate is not None:
+                        skipped.append(candidate)
+                    candidate = newer
+        except queue.Empty:
+            pass
+        for old in skipped:
+            _removeCandidate(folder, old)
+        if candidate is None:
+            continue
+        arena = Arena(MCTSPlayer(game, nnetClass, folder, coach.getCheckpointFile(bestVersion.value), coach.args),
+                      MCTSPlayer(game, nnetClass, folder, f'candidate_{candidate}.pth.tar', coach.args),
+                      game, numWorkers=coach.args.get('numArenaWorkers', 1))
+        pwins, nwins, draws, accepted = coach.pit(arena)
+        if accepted:
+            coach.nnet.load_checkpoint(folder=folder, filename=f'candidate_{candidate}.pth.tar')
+            coach.nnet.save_checkpoint(folder=folder, filename=coach.getCheckpointFile(candidate))
+            coach.nnet.save_checkpoint(folder=folder, filename='best.pth.tar')
+            bestVersion.value = candidate
+        _removeCandidate(folder, candidate)
+        results.put((candidate, pwins, nwins, draws, accepted))
+
+
+def _removeCandidate(folder, candidate):
+    """Deletes the checkpoint files of candidate_<candidate>, whatever extensions the network saved them with."""
+    for path in glob.glob(os.path.join(folder, f'candidate_{candidate}.*')):
+        os.remove(path)
+
 
 class Coach():
     """
@@ -22,12 +122,23 @@ class Coach():
 
     def __init__(self, game, nnet, args):
         self.game = game
-        self.nnet = nnet
-        self.pnet = self.nnet.__class__(self.game)  # the competitor network
+        self.nnetClass = nnet.__class__
+        self.nnet = cacheNNet(nnet, args)  # with args.evalCacheMB, evaluations are cached across episodes
+        self.pnet = None  # the competitor network, built on first use in learn()
         self.args = args
-        self.mcts = MCTS(self.game, self.nnet, self.args)
-        self.trainExamplesHistory = []  # history of examples from args.numItersForTrainExamplesHistory latest iterations
+        self.mcts = makeMCTS(self.game, self.nnet, self.args)
+        # examples of the args.numItersForTrainExamplesHistory latest iterations, one shard per iteration
+        self.replayBuffer = ReplayBuffer(os.path.join(args.checkpoint, 'replay'),
+                                         maxShards=args.get('numItersForTrainExamplesHistory'),
+                                         maxShardLength=args.get('maxlenOfQueue'))
+        # with args.storeSymmetries False, one example per position; the network must then train on
+        # random symmetries itself (its own augment arg)
+        self.storeSymmetries = args.get('storeSymmetries', True)
+        if (getNNetArgs(self.nnetClass) or {}).get('augment', False) == self.storeSymmetries:
+            raise ValueError(f'args.storeSymmetries is {self.storeSymmetries}, so the augment arg of '
+                             f'{self.nnetClass.__module__} must be {not self.storeSymmetries}')
         self.skipFirstSelfPlay = False  # can be overriden in loadTrainExamples()
+        self.selfPlayPool = None  # worker processes when args.numSelfPlayWorkers > 1
 
     def executeEpisode(self):
         """
@@ -38,10 +149,11 @@ class Coach():
         in trainExamples.
 
         It uses a temp=1 if episodeStep < tempThreshold, and thereafter
-        uses temp=0.
+        uses temp=0. Every position is added in each of its getSymmetries,
+        or only once without args.storeSymmetries.
 
         Returns:
-            trainExamples: a list of examples of the form (canonicalBoard, currPlayer, pi,v)
+            trainExamples: an ExampleStore of examples (canonicalBoard, pi, v).
                            pi is the MCTS informed policy vector, v is +1 if
                            the player eventually won the game, else -1.
         """
@@ -56,17 +168,22 @@ class Coach():
             temp = int(episodeStep < self.args.tempThreshold)
 
             pi = self.mcts.getActionProb(canonicalBoard, temp=temp)
-            sym = self.game.getSymmetries(canonicalBoard, pi)
-            for b, p in sym:
-                trainExamples.append([b, self.curPlayer, p, None])
+            if self.storeSymmetries:
+                for b, p in self.game.getSymmetries(canonicalBoard, pi):
+                    trainExamples.append((b, self.curPlayer, p))
+            else:
+                trainExamples.append((canonicalBoard, self.curPlayer, pi))
 
             action = np.random.choice(len(pi), p=pi)
             board, self.curPlayer = self.game.getNextState(board, self.curPlayer, action)
 
-            r = self.game.getGameEnded(board, self.curPlayer)
+            r = self.game.getGameEndedAfterMove(board, self.curPlayer, action)
 
             if r != 0:
-                return [(x[0], x[2], r * ((-1) ** (x[1] != self.curPlayer))) for x in trainExamples]
+                boards, players, pis = zip(*trainExamples)
+                episode = ExampleStore.forGame(self.game, capacity=len(boards))
+                episode.append(boards, pis, r * np.where(np.asarray(players) == self.curPlayer, 1, -1))
+                return episode
 
     def learn(self):
         """
@@ -75,83 +192,312 @@ class Coach():
         examples in trainExamples (which has a maximum length of maxlenofQueue).
         It then pits the new neural network against the old one and accepts it
         only if it wins >= updateThreshold fraction of games.
+
+        With args.asyncPipeline, runs learnAsync instead.
         """
+        if not self.skipFirstSelfPlay:
+            self.clearReplayBuffer()
+        if self.args.get('asyncPipeline', False):
+            return self.learnAsync()
 
         for i in range(1, self.args.numIters + 1):
             # bookkeeping
             log.info(f'Starting Iter #{i} ...')
             # examples of the iteration
             if not self.skipFirstSelfPlay or i > 1:
-                iterationTrainExamples = deque([], maxlen=self.args.maxlenOfQueue)
-
-                for _ in tqdm(range(self.args.numEps), desc="Self Play"):
-                    self.mcts = MCTS(self.game, self.nnet, self.args)  # reset search tree
-                    iterationTrainExamples += self.executeEpisode()
+                # the examples of each episode are appended to the iteration's shard as they come in
+                self.replayBuffer.beginShard()
+                try:
+                    for episodeExamples in tqdm(self.selfPlay(i), total=self.args.numEps, desc="Self Play"):
+                        self.replayBuffer.add(episodeExamples)
+                finally:
+                    self.replayBuffer.endShard()
+                if isinstance(self.nnet, CachedNNet) and self.args.get('numSelfPlayWorkers', 1) <= 1:
+                    log.info(f'Evaluation cache: {self.nnet.describe()}')
 
-                # save the iteration examples to the history 
-                self.trainExamplesHistory.append(iterationTrainExamples)
-
-            if len(self.trainExamplesHistory) > self.args.numItersForTrainExamplesHistory:
-                log.warning(
-                    f"Removing the oldest entry in trainExamples. len(trainExamplesHistory) = {len(self.trainExamplesHistory)}")
-                self.trainExamplesHistory.pop(0)
-            # backup history to a file
-            # NB! the examples were collected using the model from the previous iteration, so (i-1)  
-            self.saveTrainExamples(i - 1)
+            removed = self.replayBuffer.trim()
+            if removed:
+                log.warning(f"Removed the {removed} oldest iteration(s) of trainExamples from the replay buffer")
 
             # shuffle examples before training
-            trainExamples = []
-            for e in self.trainExamplesHistory:
-                trainExamples.extend(e)
-            shuffle(trainExamples)
+            trainExamples = self.trainingExamples()
 
             # training new network, keeping a copy of the old one
+            if self.pnet is None:
+                self.pnet = cacheNNet(self.nnetClass(self.game), self.args)
             self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
             self.pnet.load_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
-            pmcts = MCTS(self.game, self.pnet, self.args)
+            pmcts = makeMCTS(self.game, self.pnet, self.args)
 
             self.nnet.train(trainExamples)
-            nmcts = MCTS(self.game, self.nnet, self.args)
-
-            log.info('PITTING AGAINST PREVIOUS VERSION')
-            arena = Arena(lambda x: np.argmax(pmcts.getActionProb(x, temp=0)),
-                          lambda x: np.argmax(nmcts.getActionProb(x, temp=0)), self.game)
-            pwins, nwins, draws = arena.playGames(self.args.arenaCompare)
+            nmcts = makeMCTS(self.game, self.nnet, self.args)
 
-            log.info('NEW/PREV WINS : %d / %d ; DRAWS : %d' % (nwins, pwins, draws))
-            if pwins + nwins == 0 or float(nwins) / (pwins + nwins) < self.args.updateThreshold:
-                log.info('REJECTING NEW MODEL')
+            numArenaWorkers = self.args.get('numArenaWorkers', 1)
+            if numArenaWorkers > 1:
+                # the workers rebuild both players from their checkpoints
+                self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='candidate.pth.tar')
+                arena = Arena(MCTSPlayer(self.game, self.nnetClass, self.args.checkpoint, 'temp.pth.tar', self.args),
+                              MCTSPlayer(self.game, self.nnetClass, self.args.checkpoint, 'candidate.pth.tar', self.args),
+                              self.game, numWorkers=numArenaWorkers)
+            else:
+                arena = Arena(lambda x: np.argmax(pmcts.getActionProb(x, temp=0)),
+                              lambda x: np.argmax(nmcts.getActionProb(x, temp=0)), self.game)
+            _, _, _, accepted = self.pit(arena)
+            if not accepted:
                 self.nnet.load_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
             else:
-                log.info('ACCEPTING NEW MODEL')
                 self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=self.getCheckpointFile(i))
                 self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='best.pth.tar')
 
-    def getCheckpointFile(self, iteration):
-        return 'checkpoint_' + str(iteration) + '.pth.tar'
+        self.closeSelfPlayPool()
+
+    def clearReplayBuffer(self):
+        """
+        Empties the replay buffer for a fresh run: the shards an earlier run
+        left in the checkpoint folder are only trained on again after
+        loadTrainExamples.
+        """
+        shards = self.replayBuffer.shards()
+        if shards:
+            log.warning(f'Deleting the {len(shards)} iteration(s) of examples of an earlier run '
+                        f'from "{self.replayBuffer.folder}"')
+        self.replayBuffer.clear()
+
+    def pit(self, arena):
+        """
+        Plays the arena games between the previous network (player1) and the
+        new one (player2), stopping early with args.arenaSPRT.
+
+        Returns:
+            pwins, nwins, draws: games won by the previous / new network, drawn
+            accepted: whether the new network is accepted
+        """
+        log.info('PITTING AGAINST PREVIOUS VERSION')
+        sprt = None
+        if self.args.get('arenaSPRT', False):
+            sprt = SPRT(self.args.updateThreshold, margin=self.args.get('sprtMargin', 0.1),
+                        alpha=self.args.get('sprtAlpha', 0.05), beta=self.args.get('sprtBeta', 0.05))
+        pwins, nwins, draws = arena.playGames(self.args.arenaCompare, sprt=sprt)
+
+        log.info('NEW/PREV WINS : %d / %d ; DRAWS : %d' % (nwins, pwins, draws))
+        if sprt is not None and sprt.decision != 0:
+            accepted = sprt.decision == SPRT.ACCEPT
+        else:
+            accepted = pwins + nwins > 0 and float(nwins) / (pwins + nwins) >= self.args.updateThreshold
+        log.info('ACCEPTING NEW MODEL' if accepted else 'REJECTING NEW MODEL')
+        return pwins, nwins, draws, accepted
+
+    def learnAsync(self):
+        """
+        Pipelined version of learn, in which self-play, training and gating
+        overlap instead of taking turns:
 
-    def saveTrainExamples(self, iteration):
+        - args.numSelfPlayWorkers actor processes keep playing episodes with
+          the latest accepted network (checkpoint_<k>) and queue their
+          examples.
+        - The learner (this process) appends the episodes to the replay
+          buffer and, after every args.asyncEpisodesPerUpdate of them
+          (default numEps), trains on the buffer and queues the result as
+          candidate_<k>. It keeps training its own network whatever the
+          gating decides.
+        - An evaluator process pits the newest candidate against the best
+          network and publishes it to the actors if it is accepted. It is not
+          a daemon, so that its Arena can have args.numArenaWorkers workers.
+
+        Stops after numIters model updates, once the last candidate is gated.
+        Raises RuntimeError if an actor or the evaluator dies.
+        """
         folder = self.args.checkpoint
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        filename = os.path.join(folder, self.getCheckpointFile(iteration) + ".examples")
-        with open(filename, "wb+") as f:
-            Pickler(f).dump(self.trainExamplesHistory)
-        f.closed
+        episodesPerUpdate = self.args.get('asyncEpisodesPerUpdate', self.args.numEps)
+        context = multiprocessing.get_context('spawn')
+        bestVersion = context.Value('i', 0)
+        examplesQueue, candidates, results = context.Queue(), context.Queue(), context.Queue()
+        stop = context.Event()
+        self.nnet.save_checkpoint(folder=folder, filename=self.getCheckpointFile(0))
+        self.nnet.save_checkpoint(folder=folder, filename='best.pth.tar')
+
+        nnetArgs = dict(getNNetArgs(self.nnetClass) or {})
+        actors = [context.Process(target=_asyncActor, daemon=True, name=f'actor {actor}',
+                                  args=(self.game, self.nnetClass, nnetArgs, dict(self.args), actor, bestVersion,
+                                        examplesQueue, stop))
+                  for actor in range(max(self.args.get('numSelfPlayWorkers', 1), 1))]
+        evaluator = context.Process(target=_asyncEvaluator, name='evaluator',
+                                    args=(self.game, self.nnetClass, nnetArgs, dict(self.args), bestVersion,
+                                          candidates, results))
+        for process in actors + [evaluator]:
+            process.start()
+
+        def nextEpisode():
+            """Waits for the examples of an episode, as long as every child process is alive."""
+            while True:
+                for process in actors + [evaluator]:
+                    if not process.is_alive():
+                        raise RuntimeError(f'The {process.name} process exited with code {process.exitcode}')
+                try:
+                    return examplesQueue.get(timeout=1)
+                except queue.Empty:
+                    pass
+
+        def logResults(block=False):
+            while True:
+                try:
+                    candidate, pwins, nwins, draws, accepted = results.get(block=block)
+                except queue.Empty:
+                    return
+                log.info(f'Candidate {candidate}: NEW/PREV WINS : {nwins} / {pwins} ; DRAWS : {draws} ; '
+                         + ('ACCEPTED' if accepted else 'REJECTED'))
+                if block:
+                    return
+
+        start = time.time()
+        examples = episodes = 0
+        update = 0
+        train = self.skipFirstSelfPlay  # the loaded examples are trained on before any new one
+        completed = False
+        try:
+            while update < self.args.numIters:
+                if not train:
+                    episode = nextEpisode()
+                    if episodes % episodesPerUpdate == 0:
+                        # a shard per update, opened by its first episode so that no shard stays empty
+                        self.replayBuffer.beginShard()
+                    self.replayBuffer.add(episode)
+                    examples += len(episode)
+                    episodes += 1
+                    train = episodes % episodesPerUpdate == 0
+                    logResults()
+                    continue
+                self.replayBuffer.endShard()
+                removed = self.replayBuffer.trim()
+                if removed:
+                    log.warning(f"Removed the {removed} oldest iteration(s) of trainExamples from the replay buffer")
+                trainExamples = self.trainingExamples()
+                update += 1
+                log.info(f'Update #{update}: training on {len(trainExamples)} examples '
+                         f'({episodes} episodes played so far)')
+                self.nnet.train(trainExamples)
+                self.nnet.save_checkpoint(folder=folder, filename=f'candidate_{update}.pth.tar')
+                candidates.put(update)
+                train = False
+            completed = True
+        finally:
+            stop.set()
+            candidates.put(None)
+            if not completed:
+                evaluator.terminate()  # instead of waiting for the gating of the last candidate
+            evaluator.join()
+            logResults()
+            for actor in actors:
+                actor.terminate()
+                actor.join()
+            self.replayBuffer.endShard()
+        if evaluator.exitcode != 0:
+            raise RuntimeError(f'The evaluator process exited with code {evaluator.exitcode}')
+
+        hours = (time.time() - start) / 3600
+        log.info(f'{examples / hours:.0f} examples/hour, {update / hours:.1f} model updates/hour, '
+                 f'best network: checkpoint_{bestVersion.value}')
+
+    def selfPlay(self, iteration):
+        """
+        Plays the numEps self-play episodes of an iteration, in this process or,
+        with args.numSelfPlayWorkers > 1, on a pool of worker processes. Every
+        worker loads the current weights from selfplay.pth.tar, so best.pth.tar
+        only ever holds accepted networks, and streams back the examples of
+        each episode as soon as it is finished. The pool is kept for the next
+        iteration, unless self-play fails or is abandoned.
+
+        With args.seed set, every episode is seeded from (seed, iteration,
+        episode), so the examples do not depend on the number of workers.
+
+        Returns:
+            an iterator over the examples of each episode, in episode order
+        """
+        seeds = [self.getEpisodeSeed(iteration, e) for e in range(self.args.numEps)]
+        numWorkers = self.args.get('numSelfPlayWorkers', 1)
+        if numWorkers <= 1:
+            for seed in seeds:
+                self.seedEpisode(seed)
+                self.mcts = makeMCTS(self.game, self.nnet, self.args)  # reset search tree
+                yield self.executeEpisode()
+            return
+
+        self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='selfplay.pth.tar')
+        try:
+            if self.selfPlayPool is None:
+                # spawn, since TensorFlow does not survive a fork
+                self.selfPlayPool = multiprocessing.get_context('spawn').Pool(
+                    numWorkers, initializer=_initSelfPlayWorker,
+                    initargs=(self.game, self.nnetClass, dict(getNNetArgs(self.nnetClass) or {}), dict(self.args)))
+            yield from self.selfPlayPool.imap(_selfPlayEpisode, [(seed, iteration) for seed in seeds])
+        except BaseException:  # including GeneratorExit: the pending episodes are not waited for
+            self.closeSelfPlayPool(terminate=True)
+            raise
+
+    def closeSelfPlayPool(self, terminate=False):
+        """Shuts the self-play workers down, after their current episodes or, with terminate, at once."""
+        if self.selfPlayPool is not None:
+            if terminate:
+                self.selfPlayPool.terminate()
+            else:
+                self.selfPlayPool.close()
+            self.selfPlayPool.join()
+            self.selfPlayPool = None
+
+    def getEpisodeSeed(self, iteration, episode):
+        if self.args.get('seed') is None:
+            return None
+        return int(np.random.SeedSequence([self.args.seed, iteration, episode]).generate_state(1)[0])
+
+    def seedEpisode(self, seed):
+        if seed is not None:
+            np.random.seed(seed)
+            random.seed(seed)
+
+    def trainingExamples(self):
+        """
+        Returns the examples to train on: the replay buffer itself with
+        args.streamExamples, for networks that stream batches from its shards,
+        else all of its examples shuffled in one ExampleStore.
+        """
+        if self.args.get('streamExamples', False):
+            return self.replayBuffer
+        trainExamples = self.replayBuffer.examples(piDtype=self.args.get('examplePolicyDtype', np.float32))
+        trainExamples.shuffle()
+        return trainExamples
+
+    def getCheckpointFile(self, iteration):
+        return 'checkpoint_' + str(iteration) + '.pth.tar'
 
     def loadTrainExamples(self):
-        modelFile = os.path.join(self.args.load_folder_file[0], self.args.load_folder_file[1])
-        examplesFile = modelFile + ".examples"
-        if not os.path.isfile(examplesFile):
-            log.warning(f'File "{examplesFile}" with trainExamples not found!')
+        """
+        Resumes from the replay buffer of the load_folder_file folder. It is
+        used in place if it is the checkpoint folder, copied into it
+        otherwise. A pickled <load_folder_file>.examples history of older
+        versions is imported into the replay buffer instead.
+        """
+        folder = self.args.load_folder_file[0]
+        source = ReplayBuffer(os.path.join(folder, 'replay'))
+        examplesFile = os.path.join(folder, self.args.load_folder_file[1]) + ".examples"
+        if source.shards():
+            if os.path.abspath(source.folder) != os.path.abspath(self.replayBuffer.folder):
+                log.info(f'Copying the replay buffer of "{folder}"...')
+                self.replayBuffer.clear()  # the copied shards would mix with those of the same ids
+                shutil.copytree(source.folder, self.replayBuffer.folder, dirs_exist_ok=True)
+                self.replayBuffer = ReplayBuffer(self.replayBuffer.folder, self.replayBuffer.maxShards,
+                                                 self.replayBuffer.maxShardLength)
+        elif os.path.isfile(examplesFile):
+            log.info("File with trainExamples found. Importing it into the replay buffer...")
+            self.replayBuffer.clear()
+            with open(examplesFile, "rb") as f:
+                self.replayBuffer.importHistory(Unpickler(f).load())
+        else:
+            log.warning(f'No replay buffer and no file "{examplesFile}" with trainExamples found!')
             r = input("Continue? [y|n]")
             if r != "y":
                 sys.exit()
-        else:
-            log.info("File with trainExamples found. Loading it...")
-            with open(examplesFile, "rb") as f:
-                self.trainExamplesHistory = Unpickler(f).load()
-            log.info('Loading done!')
+            return
+        log.info(f'Loading done! {len(self.replayBuffer)} examples in {len(self.replayBuffer.shards())} iterations')
 
-            # examples based on the model were already collected (loaded)
-            self.skipFirstSelfPlay = True
+        # examples based on the model were already collected (loaded)
+        self.skipFirstSelfPlay = True
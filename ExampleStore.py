@@ -0,0 +1,178 @@
+import numpy as np
+
+
+class ExampleStore():
+    """
+    Training examples (board, pi, v) in one preallocated structured array:
+    int8 boards, float32 (or float16) policies and float32 values, about
+    boardSize + 4 * actionSize bytes per example instead of a tuple of a
+    board array and a list of boxed floats.
+
+    The array grows by doubling. The boards, pis and vs properties are views
+    of its fields, so handing them to NNetWrapper.train copies nothing.
+    """
+
+    def __init__(self, boardShape, actionSize, capacity=1024, piDtype=np.float32):
+        self.dtype = np.dtype([('board', np.int8, tuple(boardShape)),
+                               ('pi', piDtype, (actionSize,)),
+                               ('v', np.float32)])
+        self.data = np.empty(capacity, self.dtype)
+        self.size = 0
+
+    @classmethod
+    def forGame(cls, game, capacity=1024, piDtype=np.float32):
+        return cls(game.getBoardSize(), game.getActionSize(), capacity=capacity, piDtype=piDtype)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def records(self):
+        return self.data[:self.size]
+
+    @property
+    def boards(self):
+        return self.records['board']
+
+    @property
+    def pis(self):
+        return self.records['pi']
+
+    @property
+    def vs(self):
+        return self.records['v']
+
+    def reserve(self, size):
+        if size > len(self.data):
+            data = np.empty(max(size, 2 * len(self.data)), self.dtype)
+            data[:self.size] = self.records
+            self.data = data
+
+    def append(self, boards, pis, vs):
+        """
+        Appends the examples given column by column.
+
+        Raises ValueError if a board does not fit into int8.
+        """
+        boards = np.asarray(boards)
+        count = len(boards)
+        if boards.dtype != np.int8 and not np.array_equal(boards.astype(np.int8), boards):
+            raise ValueError("ExampleStore boards must be integers in [-128, 127]")
+        self.reserve(self.size + count)
+        new = self.data[self.size:self.size + count]
+        new['board'], new['pi'], new['v'] = boards, pis, vs
+        self.size += count
+
+    def extend(self, examples):
+        """Appends examples: another ExampleStore, or a list of (board, pi, v)."""
+        if isinstance(examples, ExampleStore):
+            self.append(examples.boards, examples.pis, examples.vs)
+        elif len(examples):
+            self.append(*zip(*examples))
+
+    def shuffle(self, rng=np.random):
+        """Shuffles the examples in place with one gather by a random permutation."""
+        self.data[:self.size] = self.records[rng.permutation(self.size)]
+
+    def trimToSize(self):
+        """Drops the unused capacity."""
+        self.data = self.records.copy()
+
+
+def unpackExamples(examples):
+    """
+    Input:
+        examples: an ExampleStore, or a list of examples (board, pi, v)
+
+    Returns:
+        boards, pis, vs: arrays of the examples' boards, policies and values,
+                         views of an ExampleStore's fields
+    """
+    if isinstance(examples, ExampleStore):
+        return examples.boards, examples.pis, examples.vs
+    boards, pis, vs = list(zip(*examples))
+    return np.asarray(boards), np.asarray(pis), np.asarray(vs)
+
+
+class ExampleBatches():
+    """
+    Iterable over shuffled batches (boards, (pis, vs)) of examples given as
+    column chunks. Every iteration (epoch) draws a new permutation, and each
+    batch is gathered from the chunks by sorted indices, so memmapped shards
+    are read in file order and only a batch at a time is in memory.
+
+    augment(boards, pis, rng), if given, transforms each batch, e.g. into
+    random symmetries of its examples. An epoch goes over every example repeat
+    times, e.g. once per symmetry for examples stored in one symmetry only.
+    """
+
+    def __init__(self, chunks, batchSize, augment=None, seed=None, repeat=1):
+        self.chunks = [chunk for chunk in chunks if len(chunk[2])]
+        self.offsets = np.cumsum([0] + [len(vs) for _, _, vs in self.chunks])
+        self.batchSize = batchSize
+        self.augment = augment
+        self.repeat = repeat
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def steps(self):
+        """Number of batches per epoch."""
+        return -(-len(self) * self.repeat // self.batchSize)
+
+    def gather(self, indices):
+        """Returns the columns of the examples at the sorted indices."""
+        bounds = np.searchsorted(indices, self.offsets)
+        parts = [[column[indices[bounds[c]:bounds[c + 1]] - self.offsets[c]] for column in chunk]
+                 for c, chunk in enumerate(self.chunks) if bounds[c + 1] > bounds[c]]
+        return [np.concatenate(column) for column in zip(*parts)]
+
+    def __iter__(self):
+        order = self.rng.permutation(np.tile(np.arange(len(self)), self.repeat))
+        for start in range(0, len(order), self.batchSize):
+            boards, pis, vs = self.gather(np.sort(order[start:start + self.batchSize]))
+            if self.augment is not None:
+                boards, pis = self.augment(boards, pis, self.rng)
+            yield (np.asarray(boards, dtype=np.float32),
+                   (np.asarray(pis, dtype=np.float32), np.asarray(vs, dtype=np.float32)[:, np.newaxis]))
+
+
+def symmetryCount(game):
+    """
+    Returns the number of symmetries randomSymmetries(game) picks from, i.e.
+    how many examples self-play stores per position without augmentation.
+    """
+    permutations = game.getSymmetryPermutations()
+    if permutations is not None:
+        return len(permutations[0])
+    pi = np.full(game.getActionSize(), 1 / game.getActionSize())
+    return len(game.getSymmetries(game.getInitBoard(), pi))
+
+
+def randomSymmetries(game):
+    """
+    Returns an augment function for ExampleBatches that replaces every example
+    of a batch by a random one of its symmetries: one gather of the boards and
+    one of the policies by game.getSymmetryPermutations(), or a random pick
+    from game.getSymmetries() per example for games without permutations.
+    """
+    permutations = game.getSymmetryPermutations()
+    if permutations is None:
+        def augment(boards, pis, rng):
+            boards, pis = np.array(boards), np.array(pis)
+            for i in range(len(boards)):
+                symmetries = game.getSymmetries(boards[i], pis[i])
+                boards[i], pis[i] = symmetries[rng.integers(len(symmetries))]
+            return boards, pis
+        return augment
+
+    boardPermutations, piPermutations = permutations
+
+    def augment(boards, pis, rng):
+        symmetry = rng.integers(len(boardPermutations), size=len(boards))
+        rows = np.arange(len(boards))[:, np.newaxis]
+        flat = np.reshape(boards, (len(boards), -1))
+        return (flat[rows, boardPermutations[symmetry]].reshape(np.shape(boards)),
+                np.asarray(pis)[rows, piPermutations[symmetry]])
+    return augment
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class Game():
     """
     This class specifies the base Game class. To define your own game, subclass
@@ -72,6 +75,57 @@ class Game():
         """
         pass
 
+    def getGameEndedAfterMove(self, board, player, action):
+        """
+        Same as getGameEnded, for a board that was reached by playing action
+        on a position where the game had not ended yet. Games can override
+        this to only check what action can have changed (e.g. the lines
+        through the square it was played on); the default falls back to
+        getGameEnded.
+
+        Input:
+            board: board after action was played, in the same orientation as
+                   action (getCanonicalForm may only change the colors)
+            player: current player (1 or -1)
+            action: action that led to board, None if unknown
+
+        Returns:
+            r: same as getGameEnded(board, player)
+        """
+        return self.getGameEnded(board, player)
+
+    def getZobristKeys(self, board):
+        """
+        Optional, lets MCTS key its tables with integers instead of
+        stringRepresentation. Games that implement it must implement
+        getNextZobristKeys as well.
+
+        Input:
+            board: current board
+
+        Returns:
+            keys: (key, flippedKey), 64-bit Zobrist keys (ints) of board and
+                  of getCanonicalForm(board, -1); None if the game does not
+                  support Zobrist keys. The canonical form of the other
+                  player's view has the same keys swapped, so
+                  getCanonicalForm(board, -1) must be its own inverse.
+        """
+        return None
+
+    def getNextZobristKeys(self, board, player, action, keys):
+        """
+        Input:
+            board: current board
+            player: current player (1 or -1)
+            action: action taken by current player
+            keys: getZobristKeys(board)
+
+        Returns:
+            nextKeys: getZobristKeys of the board getNextState returns,
+                      updated from keys with the squares action changes
+        """
+        return self.getZobristKeys(self.getNextState(board, player, action)[0])
+
     def getCanonicalForm(self, board, player):
         """
         Input:
@@ -101,6 +155,73 @@ class Game():
         """
         pass
 
+    def getNextStates(self, boards, players, actions):
+        """
+        Batched getNextState, for stepping many games at once. Games can
+        override it (and the other batched methods) with a vectorized version;
+        the default loops over getNextState.
+
+        Input:
+            boards: (B, ...) array of stacked boards
+            players: (B,) array of the players to move (1 or -1)
+            actions: (B,) array of the actions they take
+
+        Returns:
+            nextBoards: (B, ...) array of the boards after the actions
+            nextPlayers: (B,) array of the players who play next
+        """
+        nextBoards, nextPlayers = zip(*(self.getNextState(board, player, action)
+                                        for board, player, action in zip(boards, players, actions)))
+        return np.stack(nextBoards), np.asarray(nextPlayers)
+
+    def getValidMovesBatch(self, boards, players):
+        """
+        Batched getValidMoves.
+
+        Input:
+            boards: (B, ...) array of stacked boards
+            players: (B,) array of the players to move
+
+        Returns:
+            validMoves: (B, self.getActionSize()) binary array, row i the
+                        getValidMoves of boards[i] and players[i]
+        """
+        return np.stack([self.getValidMoves(board, player) for board, player in zip(boards, players)])
+
+    def getGameEndedBatch(self, boards, players):
+        """
+        Batched getGameEnded.
+
+        Returns:
+            r: (B,) float array, r[i] the getGameEnded of boards[i] and players[i]
+        """
+        return np.asarray([self.getGameEnded(board, player) for board, player in zip(boards, players)], dtype=float)
+
+    def getCanonicalFormBatch(self, boards, players):
+        """
+        Batched getCanonicalForm.
+
+        Returns:
+            canonicalBoards: (B, ...) array, row i the canonical form of
+                             boards[i] for players[i]
+        """
+        return np.stack([self.getCanonicalForm(board, player) for board, player in zip(boards, players)])
+
+    def getSymmetryPermutations(self):
+        """
+        Optional, lets the examples be stored in one orientation and turned
+        into a random symmetry at training time with a single gather.
+
+        Returns:
+            permutations: (boardPermutations, piPermutations), int arrays of
+                          shape (S, board.size) and (S, self.getActionSize()),
+                          such that board.ravel()[boardPermutations[s]] and
+                          pi[piPermutations[s]] are the s-th of the S
+                          symmetries of getSymmetries(board, pi); None if the
+                          game does not provide them
+        """
+        return None
+
     def stringRepresentation(self, board):
         """
         Input:
@@ -0,0 +1,52 @@
+import numpy as np
+import tensorflow as tf
+
+from ExampleStore import ExampleBatches, ExampleStore, unpackExamples
+from ReplayBuffer import ReplayBuffer
+
+
+def exampleColumns(examples):
+    """
+    Returns the examples as a list of column chunks (boards, pis, vs): the
+    fields of an ExampleStore, the memmapped shards of a ReplayBuffer, or the
+    arrays of a list of (board, pi, v).
+    """
+    if isinstance(examples, ReplayBuffer):
+        return [examples.arrays(shard) for shard in examples.shards()]
+    return [unpackExamples(examples)]
+
+
+def exampleShapes(examples):
+    """
+    Returns the row shapes of the boards and policies of non-empty examples,
+    from the metadata of a ReplayBuffer or ExampleStore, or from the first of
+    a list of (board, pi, v).
+    """
+    if isinstance(examples, ReplayBuffer):
+        shapes = examples.rowShapes()
+        return shapes['boards'][0], shapes['pis'][0]
+    if isinstance(examples, ExampleStore):
+        return examples.dtype['board'].shape, examples.dtype['pi'].shape
+    board, pi, _ = examples[0]
+    return np.shape(board), np.shape(pi)
+
+
+def exampleDataset(examples, batchSize, augment=None, seed=None, repeat=1):
+    """
+    Streams examples (a ReplayBuffer, an ExampleStore or a list of
+    (board, pi, v)) as a prefetched tf.data.Dataset of shuffled batches for
+    model.fit, instead of converting all of them to arrays up front. See
+    ExampleBatches for augment and repeat.
+
+    Raises ValueError if there are no examples.
+    """
+    if not len(examples):
+        raise ValueError('No examples to train on')
+    boardShape, piShape = exampleShapes(examples)
+    batches = ExampleBatches(exampleColumns(examples), batchSize, augment=augment, seed=seed, repeat=repeat)
+    signature = (tf.TensorSpec((None,) + tuple(boardShape), tf.float32),
+                 (tf.TensorSpec((None,) + tuple(piShape), tf.float32), tf.TensorSpec((None, 1), tf.float32)))
+    dataset = tf.data.Dataset.from_generator(lambda: iter(batches), output_signature=signature)
+    dataset = dataset.apply(tf.data.experimental.assert_cardinality(batches.steps()))
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
@@ -0,0 +1,46 @@
+import numpy as np
+import tensorflow as tf
+
+
+class KerasPredictor():
+    """
+    Compiled inference for the Keras networks of the NNetWrappers.
+
+    The forward pass of the model is wrapped in one tf.function with a fixed
+    input signature (any batch size, float32 boards), so it is traced once
+    and then runs as a graph. Calling the model eagerly instead re-dispatches
+    every layer from Python on each call, and model.predict builds a whole
+    data pipeline per call. With jitCompile the graph is compiled with XLA
+    (once per batch size).
+
+    The function reads the model's variables, so training and
+    load_weights need no rebuild.
+    """
+
+    def __init__(self, model, boardSize, jitCompile=False):
+        self.model = model
+        self.forward = tf.function(
+            lambda boards: model(boards, training=False),
+            input_signature=[tf.TensorSpec((None,) + tuple(boardSize), tf.float32)],
+            jit_compile=jitCompile)
+
+    def predict_batch(self, boards):
+        """
+        Input:
+            boards: array of boards, stacked along a new first axis
+
+        Returns:
+            pis: array of policy vectors, one row per board
+            vs: array of values, one per board
+        """
+        pi, v = self.forward(np.asarray(boards, dtype=np.float32))
+        return pi.numpy(), v.numpy()[:, 0]
+
+    def predict(self, board):
+        """
+        Returns:
+            pi: policy vector of the board
+            v: value of the board, as an array of shape (1,)
+        """
+        pi, v = self.forward(np.asarray(board, dtype=np.float32)[np.newaxis])
+        return pi.numpy()[0], v.numpy()[0]
@@ -1,29 +1,193 @@
 import logging
 import math
+import sys
 
 import numpy as np
 
 EPS = 1e-8
 
+# rough memory cost of the search tables, see memoryUsage
+ENTRY_BYTES = 100  # one dict or list slot with its boxed value
+ARRAY_BYTES = 112  # header of a NumPy array
+PRUNE_TO = 0.75  # a tree over its budget is pruned to this fraction of it
+
 log = logging.getLogger(__name__)
 
 
+def makeMCTS(game, nnet, args):
+    """
+    Returns the search tree engine selected by args.mctsEngine: 'dict' (the
+    default) for MCTS, 'array' for ArrayMCTS. Batched search
+    (args.mctsBatchSize > 1) and tree reuse (args.mctsReuseTree) are only
+    available in ArrayMCTS and select it.
+    """
+    engine = args.get('mctsEngine', 'dict')
+    if args.get('mctsBatchSize', 1) > 1 or args.get('mctsReuseTree', False):
+        engine = 'array'
+    if engine == 'array':
+        return ArrayMCTS(game, nnet, args)
+    if engine != 'dict':
+        raise ValueError("Unknown mctsEngine '{}'".format(engine))
+    return MCTS(game, nnet, args)
+
+
+def countsToProbs(counts, temp):
+    """
+    Turns the root visit counts (a list over all actions) into the policy
+    returned by getActionProb.
+    """
+    if temp == 0:
+        bestAs = np.array(np.argwhere(counts == np.max(counts))).flatten()
+        bestA = np.random.choice(bestAs)
+        probs = [0] * len(counts)
+        probs[bestA] = 1
+        return probs
+
+    counts = [x ** (1. / temp) for x in counts]
+    counts_sum = float(sum(counts))
+    probs = [x / counts_sum for x in counts]
+    return probs
+
+
+def maskPolicy(pi, valids):
+    """
+    Restricts the network policy pi to the valid moves and renormalizes it.
+
+    Returns:
+        actions: indices of the valid moves
+        priors: the renormalized policy over actions, as float32
+    """
+    ps = pi * valids  # masking invalid moves
+    sum_Ps_s = np.sum(ps)
+    if sum_Ps_s > 0:
+        ps /= sum_Ps_s  # renormalize
+    else:
+        # if all valid moves were masked make all valid moves equally probable
+
+        # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
+        # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.
+        log.error("All valid moves were masked, doing a workaround.")
+        ps = ps + valids
+        ps /= np.sum(ps)
+
+    actions = np.flatnonzero(valids)
+    return actions, ps[actions].astype(np.float32)
+
+
+def treeBudget(args):
+    """
+    Returns the (maxNodes, maxBytes) budget of a search tree set by
+    args.mctsMaxNodes and args.mctsMaxMB, 0 where there is no limit.
+    """
+    return args.get('mctsMaxNodes', 0), int(args.get('mctsMaxMB', 0) * 2**20)
+
+
+def overBudget(nodes, size, budget):
+    maxNodes, maxBytes = budget
+    return (maxNodes > 0 and nodes > maxNodes) or (maxBytes > 0 and size > maxBytes)
+
+
+def pruneTarget(budget):
+    """The (nodes, bytes) a tree over budget is pruned down to."""
+    return tuple(PRUNE_TO * limit if limit > 0 else math.inf for limit in budget)
+
+
+def rootKeys(game, canonicalBoard, args):
+    """
+    Returns the Zobrist keys of the root board, or None if the game has none
+    or args.zobrist is False (the tables are then keyed by
+    stringRepresentation).
+    """
+    if not args.get('zobrist', True):
+        return None
+    return game.getZobristKeys(canonicalBoard)
+
+
+def childKeys(game, canonicalBoard, action, keys, nextPlayer):
+    """
+    Returns the Zobrist keys of the canonical board that follows action
+    from canonicalBoard, or None if keys is None.
+    """
+    if keys is None:
+        return None
+    keys = game.getNextZobristKeys(canonicalBoard, 1, action, keys)
+    return keys if nextPlayer == 1 else keys[::-1]
+
+
+def stateKey(game, canonicalBoard, keys, seen=None):
+    """
+    Returns the key the search tables store canonicalBoard under: its
+    Zobrist key if keys is given, else its stringRepresentation.
+
+    seen (a dict, only with args.zobristCheck) maps every Zobrist key to the
+    first board it was used for. Keys are then recomputed from scratch and
+    checked against those boards, which catches collisions as well as wrong
+    incremental updates.
+    """
+    if keys is None:
+        return game.stringRepresentation(canonicalBoard)
+    key = keys[0]
+    if seen is not None:
+        if tuple(game.getZobristKeys(canonicalBoard)) != tuple(keys):
+            raise RuntimeError(f'Incremental Zobrist keys {keys} do not match the board')
+        if not np.array_equal(seen.setdefault(key, canonicalBoard), canonicalBoard):
+            raise RuntimeError(f'Zobrist key collision on {key:#018x}')
+    return key
+
+
+def selectPUCT(qsa, nsa, ps, ns, cpuct):
+    """
+    Vectorized upper confidence bound over the edges of one node. All array
+    arguments are aligned with the valid actions of the node, ns is the visit
+    count of the node itself.
+
+    Returns:
+        the index of the edge with the highest upper confidence bound (the
+        first one on ties)
+    """
+    cps = cpuct * ps
+    u = np.where(nsa > 0, qsa + cps * math.sqrt(ns) / (1 + nsa), cps * math.sqrt(ns + EPS))  # Q = 0 ?
+    return int(np.argmax(u))
+
+
 class MCTS():
     """
     This class handles the MCTS tree.
+
+    With args.mctsMaxNodes or args.mctsMaxMB set, the least visited boards
+    are dropped whenever the tables grow over that budget (see prune). A
+    dropped board is simply evaluated again if the search comes back to it.
+
+    Boards reached by several paths share their statistics, so the tree is
+    really a graph, and in games like Kirche a graph with cycles. A
+    simulation that comes back to a board already on its path stops there
+    and backs up 0, a draw by repetition (args.mctsDetectCycles, on by
+    default). Simulations deeper than args.mctsMaxDepth (50) stop with 0 as
+    well.
     """
 
     def __init__(self, game, nnet, args):
         self.game = game
         self.nnet = nnet
         self.args = args
-        self.Qsa = {}  # stores Q values for s,a (as defined in the paper)
-        self.Nsa = {}  # stores #times edge s,a was visited
+        self.seenKeys = {} if args.get('zobristCheck', False) else None  # see stateKey
+
+        # boards are keyed by their Zobrist key if the game has them, else by stringRepresentation
         self.Ns = {}  # stores #times board s was visited
+        self.Es = {}  # stores game.getGameEnded ended for board s
+        self.Vs = {}  # stores the valid actions of board s (indices into the policy vector)
+
+        # the edge statistics of board s are arrays aligned with Vs[s]
         self.Ps = {}  # stores initial policy (returned by neural net)
+        self.Qsa = {}  # stores Q values for s,a (as defined in the paper)
+        self.Nsa = {}  # stores #times edge s,a was visited
 
-        self.Es = {}  # stores game.getGameEnded ended for board s
-        self.Vs = {}  # stores game.getValidMoves for board s
+        self.budget = treeBudget(args)
+        self.bytes = 0  # estimated size of the tables, see stateBytes
+
+        self.onPath = set()  # boards on the path of the running simulation
+        self.cycles = 0  # #simulations stopped by a repeated board
+        self.depthCutoffs = 0  # #simulations stopped by mctsMaxDepth
 
     def getActionProb(self, canonicalBoard, temp=1):
         """
@@ -34,25 +198,19 @@ class MCTS():
             probs: a policy vector where the probability of the ith action is
                    proportional to Nsa[(s,a)]**(1./temp)
         """
+        keys = rootKeys(self.game, canonicalBoard, self.args)
         for i in range(self.args.numMCTSSims):
-            self.search(canonicalBoard)
+            self.search(canonicalBoard, keys=keys)
+            if overBudget(len(self.Es), self.bytes, self.budget):
+                self.prune(stateKey(self.game, canonicalBoard, keys))
 
-        s = self.game.stringRepresentation(canonicalBoard)
-        counts = [self.Nsa[(s, a)] if (s, a) in self.Nsa else 0 for a in range(self.game.getActionSize())]
+        s = stateKey(self.game, canonicalBoard, keys, self.seenKeys)
+        counts = np.zeros(self.game.getActionSize(), dtype=np.int64)
+        if s in self.Vs:
+            counts[self.Vs[s]] = self.Nsa[s]
+        return countsToProbs(counts.tolist(), temp)
 
-        if temp == 0:
-            bestAs = np.array(np.argwhere(counts == np.max(counts))).flatten()
-            bestA = np.random.choice(bestAs)
-            probs = [0] * len(counts)
-            probs[bestA] = 1
-            return probs
-
-        counts = [x ** (1. / temp) for x in counts]
-        counts_sum = float(sum(counts))
-        probs = [x / counts_sum for x in counts]
-        return probs
-
-    def search(self, canonicalBoard, depth=0):
+    def search(self, canonicalBoard, depth=0, lastAction=None, keys=None):
         """
         This function performs one iteration of MCTS. It is recursively called
         till a leaf node is found. The action chosen at each node is one that
@@ -68,73 +226,461 @@ class MCTS():
         state. This is done since v is in [-1,1] and if v is the value of a
         state for the current player, then its value is -v for the other player.
 
+        lastAction is the action that led to canonicalBoard (None at the
+        root), it lets the game check for the end of the game incrementally.
+        keys are the Zobrist keys of canonicalBoard (see rootKeys), None to
+        key the board by stringRepresentation.
+
         Returns:
             v: the negative of the value of the current canonicalBoard
         """
 
-        s = self.game.stringRepresentation(canonicalBoard)
+        s = stateKey(self.game, canonicalBoard, keys, self.seenKeys)
+
+        if s in self.onPath:
+            # the board repeats on the path, a draw by repetition
+            self.cycles += 1
+            return 0
 
         # Recursion depth limit to handle cyclic games (especially with DummyNNet)
-        if depth > 50:
-             return 0
+        if depth > self.args.get('mctsMaxDepth', 50):
+            self.depthCutoffs += 1
+            return 0
 
         if s not in self.Es:
-            self.Es[s] = self.game.getGameEnded(canonicalBoard, 1)
+            self.Es[s] = self.game.getGameEndedAfterMove(canonicalBoard, 1, lastAction)
+            self.bytes += self.stateBytes(s)
         if self.Es[s] != 0:
             # terminal node
             return -self.Es[s]
 
         if s not in self.Ps:
             # leaf node
-            self.Ps[s], v = self.nnet.predict(canonicalBoard)
+            pi, v = self.nnet.predict(canonicalBoard)
             valids = self.game.getValidMoves(canonicalBoard, 1)
-            self.Ps[s] = self.Ps[s] * valids  # masking invalid moves
-            sum_Ps_s = np.sum(self.Ps[s])
-            if sum_Ps_s > 0:
-                self.Ps[s] /= sum_Ps_s  # renormalize
-            else:
-                # if all valid moves were masked make all valid moves equally probable
-
-                # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
-                # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.   
-                log.error("All valid moves were masked, doing a workaround.")
-                self.Ps[s] = self.Ps[s] + valids
-                self.Ps[s] /= np.sum(self.Ps[s])
-
-            self.Vs[s] = valids
+            self.Vs[s], self.Ps[s] = maskPolicy(pi, valids)
+            self.Nsa[s] = np.zeros(len(self.Vs[s]), dtype=np.int64)
+            self.Qsa[s] = np.zeros(len(self.Vs[s]))
             self.Ns[s] = 0
-            return -v
-
-        valids = self.Vs[s]
-        cur_best = -float('inf')
-        best_act = -1
+            self.bytes += self.stateBytes(s, edgesOnly=True)
+            return -float(np.ravel(v)[0])
 
         # pick the action with the highest upper confidence bound
-        for a in range(self.game.getActionSize()):
-            if valids[a]:
-                if (s, a) in self.Qsa:
-                    u = self.Qsa[(s, a)] + self.args.cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s]) / (
-                            1 + self.Nsa[(s, a)])
-                else:
-                    u = self.args.cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s] + EPS)  # Q = 0 ?
-
-                if u > cur_best:
-                    cur_best = u
-                    best_act = a
-
-        a = best_act
+        i = selectPUCT(self.Qsa[s], self.Nsa[s], self.Ps[s], self.Ns[s], self.args.cpuct)
+        a = self.Vs[s][i]
+
         next_s, next_player = self.game.getNextState(canonicalBoard, 1, a)
+        next_keys = childKeys(self.game, canonicalBoard, a, keys, next_player)
         next_s = self.game.getCanonicalForm(next_s, next_player)
 
-        v = self.search(next_s, depth=depth+1)
+        if self.args.get('mctsDetectCycles', True):
+            self.onPath.add(s)
+        try:
+            v = self.search(next_s, depth=depth+1, lastAction=a, keys=next_keys)
+        finally:
+            self.onPath.discard(s)
 
-        if (s, a) in self.Qsa:
-            self.Qsa[(s, a)] = (self.Nsa[(s, a)] * self.Qsa[(s, a)] + v) / (self.Nsa[(s, a)] + 1)
-            self.Nsa[(s, a)] += 1
-
-        else:
-            self.Qsa[(s, a)] = v
-            self.Nsa[(s, a)] = 1
+        nsa, qsa = self.Nsa[s], self.Qsa[s]
+        qsa[i] = (nsa[i] * qsa[i] + v) / (nsa[i] + 1)
+        nsa[i] += 1
 
         self.Ns[s] += 1
         return -v
+
+    def stateBytes(self, s, edgesOnly=False):
+        """Estimated memory the tables hold for board s (only its edge arrays with edgesOnly)."""
+        size = 0 if edgesOnly else sys.getsizeof(s) + ENTRY_BYTES
+        if s in self.Vs:
+            # Vs, Ps, Qsa, Nsa arrays and the Ns entry
+            size += 4 * (ENTRY_BYTES + ARRAY_BYTES) + ENTRY_BYTES + len(self.Vs[s]) * (8 + 4 + 8 + 8)
+        return size
+
+    def memoryUsage(self):
+        """
+        Returns:
+            nodes: number of boards in the tables
+            bytes: estimate of the memory the tables take
+        """
+        return len(self.Es), sum(self.stateBytes(s) for s in self.Es)
+
+    def prune(self, root):
+        """
+        Drops the least visited boards (the oldest first among equally
+        visited ones) until the tables are back to PRUNE_TO of their budget.
+        The root board s=root is kept.
+        """
+        targetNodes, targetBytes = pruneTarget(self.budget)
+        nodes, size = len(self.Es), self.bytes
+        for s in sorted(self.Es, key=lambda s: self.Ns.get(s, 0)):
+            if nodes <= targetNodes and size <= targetBytes:
+                break
+            if s == root:
+                continue
+            nodes -= 1
+            size -= self.stateBytes(s)
+            for table in (self.Es, self.Ns, self.Vs, self.Ps, self.Qsa, self.Nsa):
+                table.pop(s, None)
+            if self.seenKeys is not None:
+                self.seenKeys.pop(s, None)
+        self.bytes = size
+
+
+class ArrayMCTS():
+    """
+    Array-backed variant of MCTS. Every position gets an integer node id the
+    first time it is reached, and an expanded node keeps its priors, visit
+    counts and Q values in NumPy arrays aligned with its legal actions only.
+    Edges also remember the node id they lead to, so revisiting a known edge
+    needs neither getNextState nor stringRepresentation.
+
+    Positions are still shared across transpositions through a
+    Zobrist key (or stringRepresentation) -> node id table, so the search
+    visits exactly the same tree as MCTS and returns the same getActionProb
+    results.
+
+    With args.mctsBatchSize > 1 the simulations run in rounds of that many
+    leaves which are evaluated with one nnet.predict_batch call; pending
+    leaves are kept apart with a virtual loss of args.virtualLoss per
+    simulation in flight.
+
+    With args.mctsReuseTree every getActionProb call keeps only the subtree
+    below its root (usually a grandchild or child of the previous root) and
+    frees all other nodes, so the tree does not grow over a game. The visits
+    the root already has count towards numMCTSSims.
+
+    With args.mctsMaxNodes or args.mctsMaxMB set, the least visited subtrees
+    are dropped whenever the tree grows over that budget (see prune).
+
+    Cycles and the depth limit are handled as in MCTS.
+    """
+
+    def __init__(self, game, nnet, args):
+        self.game = game
+        self.nnet = nnet
+        self.args = args
+        self.nodes = {}  # Zobrist key (or stringRepresentation) -> node id
+        self.seenKeys = {} if args.get('zobristCheck', False) else None  # see stateKey
+
+        # per node id
+        self.boards = []  # canonical board
+        self.keys = []  # Zobrist keys of the board, None without
+        self.Es = []  # game.getGameEnded for the board
+        self.Ns = []  # #times the node was visited
+        self.actions = []  # legal actions, None until the node is expanded
+
+        # per node id, aligned with actions[node]
+        self.Ps = []  # initial policy (returned by neural net)
+        self.Nsa = []  # #times each edge was visited
+        self.Qsa = []  # Q value of each edge
+        self.children = []  # node id each edge leads to, -1 if not reached yet
+
+        self.inFlight = {}  # node id -> #simulations in flight per edge (batched search only)
+
+        self.budget = treeBudget(args)
+        self.bytes = 0  # estimated size of the tree, see nodeBytes
+
+        self.cycles = 0  # #simulations stopped by a repeated node
+        self.depthCutoffs = 0  # #simulations stopped by mctsMaxDepth
+
+    def getActionProb(self, canonicalBoard, temp=1):
+        """
+        This function performs numMCTSSims simulations of MCTS starting from
+        canonicalBoard.
+
+        Returns:
+            probs: a policy vector where the probability of the ith action is
+                   proportional to Nsa[(s,a)]**(1./temp)
+        """
+        root = self.getNode(canonicalBoard)
+        numSims = self.args.numMCTSSims
+        if self.args.get('mctsReuseTree', False):
+            root = self.reuseTree(root)
+            numSims = max(numSims - self.Ns[root], 1)
+
+        batchSize = self.args.get('mctsBatchSize', 1)
+        if batchSize > 1:
+            done = 0
+            if self.actions[root] is None:
+                # the first simulation expands the root, a batch would only collect it k times
+                self.search(root)
+                done = 1
+            for i in range(done, numSims, batchSize):
+                self.searchBatch(root, min(batchSize, numSims - i))
+                if overBudget(len(self.boards), self.bytes, self.budget):
+                    root = self.prune(root)
+        else:
+            for i in range(numSims):
+                self.search(root)
+                if overBudget(len(self.boards), self.bytes, self.budget):
+                    root = self.prune(root)
+
+        counts = np.zeros(self.game.getActionSize(), dtype=np.int64)
+        if self.actions[root] is not None:
+            counts[self.actions[root]] = self.Nsa[root]
+        return countsToProbs(counts.tolist(), temp)
+
+    def reuseTree(self, root):
+        """
+        Keeps root and the nodes reachable from it, with their statistics,
+        and frees all other nodes.
+
+        Returns:
+            the new node id of root (always 0)
+        """
+        if root == 0:
+            return 0  # still the root of the last search
+        return self.compact(root)
+
+    def prune(self, root):
+        """
+        Drops the least visited nodes (the oldest first among equally visited
+        ones), and with them the subtrees only they lead to, until the tree
+        is back to PRUNE_TO of its budget. Edges to dropped nodes are reset,
+        so the search evaluates those boards again if it comes back to them.
+
+        Returns:
+            the new node id of root (always 0)
+        """
+        targetNodes, targetBytes = pruneTarget(self.budget)
+        sizes = self.nodeBytes()
+        byVisits = np.argsort(-np.asarray(self.Ns), kind='stable')
+        keep = np.zeros(len(self.boards), dtype=bool)
+        keep[root] = True
+        nodes, size = 1, sizes[root]
+        for node in byVisits.tolist():
+            if nodes + 1 > targetNodes or size + sizes[node] > targetBytes:
+                break
+            if node != root:
+                keep[node] = True
+                nodes += 1
+                size += sizes[node]
+        return self.compact(root, keep)
+
+    def compact(self, root, keep=None):
+        """
+        Keeps the nodes reachable from root (only through nodes in the keep
+        mask if given) and frees all others. The kept nodes are renumbered
+        in breadth first order.
+
+        Returns:
+            the new node id of root (always 0)
+        """
+        remap = np.full(len(self.boards), -1, dtype=np.int64)  # old node id -> new node id
+        remap[root] = 0
+        order = [root]
+        for node in order:
+            children = self.children[node]
+            if children is None:
+                continue
+            for child in children[children >= 0].tolist():
+                if remap[child] < 0 and (keep is None or keep[child]):
+                    remap[child] = len(order)
+                    order.append(child)
+
+        for name in ('boards', 'keys', 'Es', 'Ns', 'actions', 'Ps', 'Nsa', 'Qsa', 'children'):
+            values = getattr(self, name)
+            setattr(self, name, [values[node] for node in order])
+        for node, children in enumerate(self.children):
+            if children is not None:
+                self.children[node] = np.where(children >= 0, remap[children], -1)
+        self.nodes = {s: int(remap[node]) for s, node in self.nodes.items() if remap[node] >= 0}
+        if self.seenKeys is not None:
+            self.seenKeys = {key: board for key, board in self.seenKeys.items() if key in self.nodes}
+        self.bytes = int(self.nodeBytes().sum())
+        return 0
+
+    def nodeBytes(self):
+        """Returns the estimated memory every node takes, as an array over node ids."""
+        sizes = np.zeros(len(self.boards), dtype=np.int64)
+        for s, node in self.nodes.items():
+            sizes[node] = self.newNodeBytes(s, self.boards[node])
+        for node, actions in enumerate(self.actions):
+            if actions is not None:
+                sizes[node] += self.edgeBytes(len(actions))
+        return sizes
+
+    def newNodeBytes(self, s, board):
+        # the key and its table entry, the board, the slots in the per node lists
+        return sys.getsizeof(s) + ENTRY_BYTES + board.nbytes + ARRAY_BYTES + 9 * 8
+
+    def edgeBytes(self, numActions):
+        # actions, Ps, Nsa, Qsa, children
+        return 5 * ARRAY_BYTES + numActions * (8 + 4 + 8 + 8 + 8)
+
+    def memoryUsage(self):
+        """
+        Returns:
+            nodes: number of nodes in the tree
+            bytes: estimate of the memory the tree takes
+        """
+        return len(self.boards), int(self.nodeBytes().sum())
+
+    def getNode(self, canonicalBoard, lastAction=None, keys=None):
+        """
+        Returns the node id of canonicalBoard, creating the node if the board
+        was not reached before. lastAction is the action that led to the
+        board, if known (see Game.getGameEndedAfterMove), keys its Zobrist
+        keys (computed from scratch if not given, see rootKeys).
+        """
+        if keys is None:
+            keys = rootKeys(self.game, canonicalBoard, self.args)
+        s = stateKey(self.game, canonicalBoard, keys, self.seenKeys)
+        node = self.nodes.get(s)
+        if node is None:
+            node = len(self.boards)
+            self.nodes[s] = node
+            self.bytes += self.newNodeBytes(s, canonicalBoard)
+            self.boards.append(canonicalBoard)
+            self.keys.append(keys)
+            self.Es.append(self.game.getGameEndedAfterMove(canonicalBoard, 1, lastAction))
+            self.Ns.append(0)
+            self.actions.append(None)
+            self.Ps.append(None)
+            self.Nsa.append(None)
+            self.Qsa.append(None)
+            self.children.append(None)
+        return node
+
+    def expand(self, node, prediction=None):
+        """
+        Evaluates a leaf with the neural network (unless its (pi, v) is given
+        as prediction) and allocates the edge arrays of the node.
+
+        Returns:
+            v: the value of the node for the player to move
+        """
+        board = self.boards[node]
+        pi, v = prediction if prediction is not None else self.nnet.predict(board)
+        valids = self.game.getValidMoves(board, 1)
+        actions, self.Ps[node] = maskPolicy(pi, valids)
+        self.actions[node] = actions
+        self.Nsa[node] = np.zeros(len(actions), dtype=np.int64)
+        self.Qsa[node] = np.zeros(len(actions))
+        self.children[node] = np.full(len(actions), -1, dtype=np.int64)
+        self.bytes += self.edgeBytes(len(actions))
+        return float(np.ravel(v)[0])
+
+    def select(self, node):
+        """
+        Returns the index (into actions[node]) of the edge with the highest
+        upper confidence bound. Edges with simulations in flight (batched
+        search) count virtualLoss-weighted lost visits.
+        """
+        qsa, nsa, ns = self.Qsa[node], self.Nsa[node], self.Ns[node]
+        inFlight = self.inFlight.get(node)
+        if inFlight is not None:
+            w = self.args.get('virtualLoss', 1.0)
+            qsa = (nsa * qsa - w * inFlight) / np.maximum(nsa + inFlight, 1)
+            nsa = nsa + inFlight
+            ns = ns + int(inFlight.sum())
+        return selectPUCT(qsa, nsa, self.Ps[node], ns, self.args.cpuct)
+
+    def descend(self, root):
+        """
+        Walks from the root along the edges with the maximum upper confidence
+        bound until a leaf, a terminal node, a node already on the path or
+        the depth limit is reached.
+
+        Returns:
+            path: list of (node, edge index) pairs that were traversed
+            node: the node the walk stopped at
+            v: the negative of the value of that node, or None if it is a leaf
+               that still has to be evaluated by the neural network
+        """
+        path = []
+        onPath = set()
+        detectCycles = self.args.get('mctsDetectCycles', True)
+        maxDepth = self.args.get('mctsMaxDepth', 50)
+        node = root
+        while True:
+            if node in onPath:
+                # the node repeats on the path, a draw by repetition
+                self.cycles += 1
+                return path, node, 0
+            # Recursion depth limit to handle cyclic games (see MCTS.search)
+            if len(path) > maxDepth:
+                self.depthCutoffs += 1
+                return path, node, 0
+            if self.Es[node] != 0:
+                # terminal node
+                return path, node, -self.Es[node]
+            if self.actions[node] is None:
+                # leaf node
+                return path, node, None
+
+            idx = self.select(node)
+            path.append((node, idx))
+            if detectCycles:
+                onPath.add(node)
+
+            child = self.children[node][idx]
+            if child < 0:
+                a = self.actions[node][idx]
+                board = self.boards[node]
+                next_s, next_player = self.game.getNextState(board, 1, a)
+                next_keys = childKeys(self.game, board, a, self.keys[node], next_player)
+                next_s = self.game.getCanonicalForm(next_s, next_player)
+                child = self.getNode(next_s, a, next_keys)
+                self.children[node][idx] = child
+            node = child
+
+    def backup(self, path, v):
+        """
+        Propagates v, the negative of the value of the last node, up the path
+        with alternating sign.
+        """
+        for node, idx in reversed(path):
+            nsa, qsa = self.Nsa[node], self.Qsa[node]
+            qsa[idx] = (nsa[idx] * qsa[idx] + v) / (nsa[idx] + 1)
+            nsa[idx] += 1
+            self.Ns[node] += 1
+            v = -v
+
+    def search(self, root):
+        """
+        This function performs one iteration of MCTS from the root node, exactly
+        like MCTS.search.
+        """
+        path, node, v = self.descend(root)
+        if v is None:
+            v = -self.expand(node)
+        self.backup(path, v)
+
+    def searchBatch(self, root, k):
+        """
+        Performs k simulations from the root with a single neural network call.
+
+        The k descents run one after another. Every edge on the path to a leaf
+        that waits for evaluation gets a virtual loss, which steers the next
+        descents towards other leaves. The collected leaves are then evaluated
+        with nnet.predict_batch, expanded, and all k results are backed up.
+        """
+        pending = []  # (path, leaf) waiting for the network
+        leaves = []  # distinct leaves in the batch
+        for _ in range(k):
+            path, node, v = self.descend(root)
+            if v is not None:
+                self.backup(path, v)
+                continue
+            if node not in leaves:
+                leaves.append(node)
+            pending.append((path, node))
+            for n, idx in path:
+                if n not in self.inFlight:
+                    self.inFlight[n] = np.zeros(len(self.actions[n]), dtype=np.int64)
+                self.inFlight[n][idx] += 1
+
+        self.inFlight.clear()
+        if not leaves:
+            return
+
+        boards = np.stack([self.boards[n] for n in leaves])
+        if hasattr(self.nnet, 'predict_batch'):
+            pis, vs = self.nnet.predict_batch(boards)
+        else:
+            pis, vs = zip(*[self.nnet.predict(board) for board in boards])
+        values = {}
+        for n, pi, v in zip(leaves, pis, vs):
+            values[n] = self.expand(n, (pi, v))
+        for path, node in pending:
+            self.backup(path, -values[node])
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class NeuralNet():
     """
     This class specifies the base NeuralNet class. To define your own neural
@@ -36,6 +39,22 @@ class NeuralNet():
         """
         pass
 
+    def predict_batch(self, boards):
+        """
+        Input:
+            boards: array of boards in canonical form, stacked along a new
+                    first axis
+
+        Returns:
+            pis: array of policy vectors, one row per board
+            vs: array of values, one per board
+
+        The default implementation calls predict for every board; wrappers
+        should override it with a single batched forward pass.
+        """
+        pis, vs = zip(*[self.predict(board) for board in boards])
+        return np.asarray(pis), np.ravel(vs)
+
     def save_checkpoint(self, folder, filename):
         """
         Saves the current neural network (with its parameters) in
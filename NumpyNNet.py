@@ -0,0 +1,358 @@
+"""
+Pure-NumPy inference for trained Keras networks.
+
+exportWeights() walks the layers of a Keras network, folds every
+BatchNormalization into the Conv / Dense layer before it and writes the
+result to a flat .npz. NumpyNNet loads that file and runs the forward pass
+with NumPy alone, so playing against a trained network does not need to
+import TensorFlow.
+
+Export a checkpoint (needs Keras, run once per checkpoint):
+    python NumpyNNet.py --game kirche --n 6 --priests 2 --folder ./temp/variant2/ --filename best.pth.tar
+
+The script then compares the two networks: predict latency, and the time
+and peak memory of a fresh interpreter from start-up to its first
+prediction.
+
+Supported layers: Reshape, Conv2D / Conv3D ('same' or 'valid'),
+BatchNormalization, Dense, Activation('relu'), Flatten and Dropout (skipped),
+followed by the two heads 'pi' (softmax) and 'v' (tanh) of the AlphaZero
+networks.
+"""
+
+import argparse
+import importlib
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from NeuralNet import NeuralNet
+
+
+def foldBatchNorm(kernel, bias, bn):
+    """
+    Folds a BatchNormalization over the last axis into the preceding layer.
+
+    Input:
+        kernel: conv or dense kernel, output channels last
+        bias: its bias
+        bn: the BatchNormalization layer
+
+    Returns:
+        kernel, bias: of a layer computing bn(layer(x)) at inference time
+    """
+    scale, shift = batchNormAffine(bn)
+    return kernel * scale, bias * scale + shift
+
+
+def batchNormAffine(bn):
+    """Returns scale, shift with bn(x) = x * scale + shift along bn's axis at inference time."""
+    gamma = np.asarray(bn.gamma) if bn.scale else 1.0
+    beta = np.asarray(bn.beta) if bn.center else 0.0
+    scale = gamma / np.sqrt(np.asarray(bn.moving_variance) + bn.epsilon)
+    return scale, beta - np.asarray(bn.moving_mean) * scale
+
+
+def exportWeights(model, path):
+    """
+    Writes the inference weights of a Keras model to path (.npz).
+
+    The file holds 'ops', the layer sequence of the trunk (one string per
+    layer: 'reshape', 'conv:same', 'conv:valid', 'dense', 'affine', 'relu'
+    or 'flatten'), the parameters of layer i as 'i.kernel', 'i.bias',
+    'i.shape', 'i.scale' and 'i.shift', and the heads as 'pi.kernel',
+    'pi.bias', 'v.kernel', 'v.bias'. A BatchNormalization that does not
+    normalize the output channels of a conv / dense layer is kept as an
+    'affine' layer.
+
+    Raises ValueError for a layer NumpyNNet cannot evaluate.
+    """
+    ops, arrays = [], {}
+
+    def addLayer(kind, kernel, bias):
+        arrays[f'{len(ops)}.kernel'] = kernel
+        arrays[f'{len(ops)}.bias'] = bias if bias is not None else np.zeros(kernel.shape[-1], kernel.dtype)
+        ops.append(kind)
+
+    for layer in model.layers:
+        kind = layer.__class__.__name__
+        cfg = layer.get_config()
+        if layer.name in ('pi', 'v'):
+            kernel, bias = layer.get_weights()
+            arrays[layer.name + '.kernel'], arrays[layer.name + '.bias'] = kernel, bias
+        elif kind in ('InputLayer', 'Dropout'):
+            continue
+        elif kind == 'Reshape':
+            arrays[f'{len(ops)}.shape'] = np.asarray(cfg['target_shape'])
+            ops.append('reshape')
+        elif kind == 'Flatten':
+            ops.append('flatten')
+        elif kind == 'Activation' and cfg['activation'] == 'relu':
+            ops.append('relu')
+        elif kind in ('Conv2D', 'Conv3D') and set(cfg['strides']) == {1} and set(cfg['dilation_rate']) == {1} \
+                and cfg['activation'] == 'linear':
+            weights = layer.get_weights()
+            addLayer('conv:' + cfg['padding'], weights[0], weights[1] if cfg['use_bias'] else None)
+        elif kind == 'Dense' and cfg['activation'] == 'linear':
+            weights = layer.get_weights()
+            addLayer('dense', weights[0], weights[1] if cfg['use_bias'] else None)
+        elif kind == 'BatchNormalization':
+            rank = len(layer.input.shape)
+            axis = layer.axis % rank
+            i = len(ops) - 1
+            if axis == rank - 1 and ops and ops[-1].split(':')[0] in ('conv', 'dense'):
+                arrays[f'{i}.kernel'], arrays[f'{i}.bias'] = foldBatchNorm(arrays[f'{i}.kernel'], arrays[f'{i}.bias'], layer)
+            else:
+                broadcast = [1] * (rank - 1)
+                broadcast[axis - 1] = -1
+                scale, shift = batchNormAffine(layer)
+                arrays[f'{i + 1}.scale'] = np.reshape(scale, broadcast)
+                arrays[f'{i + 1}.shift'] = np.reshape(shift, broadcast)
+                ops.append('affine')
+        else:
+            raise ValueError(f"cannot export layer {layer.name} ({kind}) to NumPy")
+    if 'pi.kernel' not in arrays or 'v.kernel' not in arrays:
+        raise ValueError("the model has no 'pi' and 'v' heads")
+
+    arrays = {key: value.astype(np.float32) if value.dtype.kind == 'f' else value for key, value in arrays.items()}
+    np.savez(path, ops=np.asarray(ops), **arrays)
+
+
+def im2col(x, size, padding):
+    """
+    Receptive fields of a stride 1 convolution, so that the convolution is one
+    matrix product.
+
+    Input:
+        x: array of shape (batch, *spatial, channels)
+        size: spatial shape of the kernel
+        padding: 'same' or 'valid'
+
+    Returns:
+        cols: array of shape (batch * output positions, prod(size) * channels),
+              matching the kernel reshaped to (-1, filters)
+        shape: output shape without the filter axis
+    """
+    if padding == 'same':
+        x = np.pad(x, [(0, 0)] + [((k - 1) // 2, k // 2) for k in size] + [(0, 0)])
+    windows = sliding_window_view(x, size, axis=tuple(range(1, len(size) + 1)))  # batch, *out, channels, *size
+    d = len(size) + 1
+    shape = windows.shape[:d]
+    windows = windows.transpose(tuple(range(d)) + tuple(range(d + 1, d + 1 + len(size))) + (d,))
+    return windows.reshape(int(np.prod(shape)), -1), shape
+
+
+class NumpyNNet(NeuralNet):
+    """
+    Inference-only NeuralNet that evaluates a network exported by
+    exportWeights() with NumPy. Outputs match the Keras network up to float32
+    rounding; train the Keras network and export it again to update it.
+    """
+
+    extension = '.npz'
+
+    def __init__(self, game=None):
+        self.layers = []
+        self.linears = {}
+
+    def load(self, path):
+        with np.load(path) as data:
+            self.build({key: data[key] for key in data.files})
+
+    def build(self, arrays):
+        """Sets up the layers from the arrays of an exported network."""
+        self.arrays = arrays
+        self.layers, self.linears = [], {}
+        for i, op in enumerate(self.arrays['ops']):
+            kind, _, padding = str(op).partition(':')
+            if kind == 'reshape':
+                self.layers.append((kind, tuple(int(d) for d in self.arrays[f'{i}.shape'])))
+            elif kind == 'affine':
+                self.layers.append((kind, (self.arrays[f'{i}.scale'], self.arrays[f'{i}.shift'])))
+            elif kind in ('conv', 'dense'):
+                self.linears[str(i)] = self.loadLinear(str(i))
+                self.layers.append((kind, (str(i), self.arrays[f'{i}.kernel'].shape[:-2], padding)))
+            else:
+                self.layers.append((kind, None))
+        for head in ('pi', 'v'):
+            self.linears[head] = self.loadLinear(head)
+
+    def loadLinear(self, name):
+        kernel = self.arrays[name + '.kernel']
+        return kernel.reshape(-1, kernel.shape[-1]), self.arrays[name + '.bias']
+
+    def linear(self, x, name):
+        """x @ kernel + bias of the conv / dense layer name, x 2-dimensional."""
+        kernel, bias = self.linears[name]
+        return x @ kernel + bias
+
+    def forward(self, boards):
+        x = np.asarray(boards, dtype=np.float32)
+        for kind, params in self.layers:
+            if kind == 'conv':
+                name, size, padding = params
+                cols, shape = im2col(x, size, padding)
+                x = self.linear(cols, name).reshape(shape + (-1,))
+            elif kind == 'dense':
+                x = self.linear(x, params[0])
+            elif kind == 'affine':
+                x = x * params[0] + params[1]
+            elif kind == 'relu':
+                x = np.maximum(x, 0)
+            elif kind == 'reshape':
+                x = x.reshape((len(x),) + params)
+            elif kind == 'flatten':
+                x = x.reshape(len(x), -1)
+        logits = self.linear(x, 'pi')
+        pi = np.exp(logits - logits.max(axis=1, keepdims=True))
+        pi /= pi.sum(axis=1, keepdims=True)
+        v = np.tanh(self.linear(x, 'v'))
+        return pi, v
+
+    def predict(self, board):
+        pi, v = self.forward(np.asarray(board)[np.newaxis])
+        return pi[0], v[0]
+
+    def predict_batch(self, boards):
+        pi, v = self.forward(boards)
+        return pi, v[:, 0]
+
+    def train(self, examples):
+        raise NotImplementedError("NumpyNNet is inference only, train the Keras network and export it")
+
+    def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
+        filepath = os.path.join(folder, filename.split(".")[0] + self.extension)
+        if not os.path.exists(folder):
+            os.mkdir(folder)
+        np.savez(filepath, **self.arrays)
+
+    def load_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
+        filepath = os.path.join(folder, filename.split(".")[0] + self.extension)
+        if not os.path.exists(filepath):
+            raise FileNotFoundError("No exported model in path '{}'".format(filepath))
+        self.load(filepath)
+
+
+def exportCheckpoint(nnet, folder, filename, game, samples=64):
+    """
+    Exports the Keras network of the NNetWrapper nnet to folder/<filename>.npz
+    and checks the NumPy outputs against Keras on random boards.
+
+    Returns:
+        numpyNet: the loaded NumpyNNet
+        maxDiff: largest absolute difference of the policy and value outputs
+    """
+    exportWeights(nnet.nnet.model, os.path.join(folder, filename.split(".")[0] + NumpyNNet.extension))
+    numpyNet = NumpyNNet(game)
+    numpyNet.load_checkpoint(folder, filename)
+
+    boards = np.random.default_rng(0).integers(-1, 2, (samples,) + tuple(game.getBoardSize())).astype(np.float32)
+    boards[0] = game.getInitBoard()
+    pi, v = nnet.nnet.model(boards, training=False)
+    npPi, npV = numpyNet.forward(boards)
+    maxDiff = max(np.abs(npPi - pi.numpy()).max(), np.abs(npV - v.numpy()).max())
+    return numpyNet, maxDiff
+
+
+def gameArguments(parser):
+    """Adds the options selecting a game and checkpoint to an ArgumentParser."""
+    parser.add_argument('--game', choices=['kirche', 'tictactoe', 'tictactoe3d'], default='kirche')
+    parser.add_argument('--n', type=int, default=6)
+    parser.add_argument('--priests', type=int, default=2)
+    parser.add_argument('--compact-actions', action='store_true')
+    parser.add_argument('--folder', default='./temp/')
+    parser.add_argument('--filename', default='best.pth.tar')
+
+
+def makeGame(opts):
+    """Returns the game selected by the gameArguments options and the name of its Keras NNet module."""
+    if opts.game == 'kirche':
+        from kirche.KircheGame import KircheGame
+        return KircheGame(opts.n, opts.priests, compact_actions=opts.compact_actions), 'kirche.keras.NNet'
+    if opts.game == 'tictactoe3d':
+        from tictactoe_3d.TicTacToeGame import TicTacToeGame
+        return TicTacToeGame(opts.n), 'tictactoe_3d.keras.NNet'
+    from tictactoe.TicTacToeGame import TicTacToeGame
+    return TicTacToeGame(opts.n), 'tictactoe.keras.NNet'
+
+
+def loadKerasNNet(opts, game, moduleName):
+    """Returns the Keras NNetWrapper of moduleName with the checkpoint of the options loaded."""
+    NNet = importlib.import_module(moduleName)
+    NNet.args['num_channels'] = opts.channels
+    nnet = NNet.NNetWrapper(game)
+    nnet.load_checkpoint(opts.folder, opts.filename)
+    return nnet
+
+
+def peakMemoryKiB():
+    """
+    Peak resident memory of this process. ru_maxrss is only the fallback: on
+    Linux it keeps the peak of the process that forked this one.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measureStartup(kind):
+    """
+    Runs this script with --startup kind ('keras' or 'numpy') in a fresh
+    interpreter, which loads that network and predicts one board.
+
+    Returns:
+        seconds: from starting the interpreter to its exit
+        peakMiB: peak resident memory of the interpreter
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ['--startup', kind],
+                            capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, int(result.stdout.split()[-1]) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a Keras checkpoint for NumpyNNet.')
+    gameArguments(parser)
+    parser.add_argument('--channels', type=int, default=64, help='num_channels the network was trained with')
+    parser.add_argument('--startup', choices=['keras', 'numpy'], help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+
+    game, moduleName = makeGame(opts)
+    if opts.startup:
+        # the child of measureStartup: load, predict once, report the peak memory in KiB
+        if opts.startup == 'numpy':
+            net = NumpyNNet(game)
+            net.load_checkpoint(opts.folder, opts.filename)
+        else:
+            net = loadKerasNNet(opts, game, moduleName)
+        net.predict(game.getInitBoard())
+        print(peakMemoryKiB())
+        return
+
+    nnet = loadKerasNNet(opts, game, moduleName)
+
+    numpyNet, maxDiff = exportCheckpoint(nnet, opts.folder, opts.filename, game)
+    print(f"Exported {os.path.join(opts.folder, opts.filename.split('.')[0] + NumpyNNet.extension)}, "
+          f"max abs difference to Keras {maxDiff:.2e}")
+
+    board = game.getInitBoard()
+    for name, net in (('keras', nnet), ('numpy', numpyNet)):
+        net.predict(board)
+        start = time.perf_counter()
+        for _ in range(200):
+            net.predict(board)
+        print(f'  {name:5s} predict: {1e3 * (time.perf_counter() - start) / 200:.2f} ms')
+    for name in ('keras', 'numpy'):
+        seconds, peakMiB = measureStartup(name)
+        print(f'  {name:5s} start-up to first prediction: {seconds:.2f} s, peak memory {peakMiB:.0f} MiB')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Int8 post-training quantization of networks exported with NumpyNNet.py.
+
+The kernel of every conv / dense layer (heads included) is quantized to int8
+with one scale per output channel, and its input to int8 with one scale per
+layer, calibrated on boards sampled from the stored training examples. Products
+are accumulated over the int8 values, then rescaled to float32 for the bias,
+the activations and the heads' softmax / tanh.
+
+Quantize a checkpoint exported with NumpyNNet.py and report the accuracy
+against the float network:
+    python QuantizedNNet.py --game kirche --n 6 --priests 2 --folder ./temp/variant2/ --filename best.pth.tar
+"""
+
+import argparse
+import glob
+import os
+import time
+from pickle import Unpickler
+
+import numpy as np
+
+from Arena import Arena, MCTSPlayer
+from NumpyNNet import NumpyNNet, gameArguments, makeGame
+from ReplayBuffer import ReplayBuffer
+
+QMAX = 127
+
+
+class QuantizedNNet(NumpyNNet):
+    """
+    NumpyNNet evaluating an int8 network written by quantize(). Loads
+    folder/<filename>.int8.npz.
+
+    NumPy has no int8 matrix product, so the int8 values are multiplied as
+    float32 by BLAS. The products are exact up to 2**24, and the result is
+    that of int8 inference with 32 bit accumulation.
+    """
+
+    extension = '.int8.npz'
+
+    def loadLinear(self, name):
+        kernel = self.arrays[name + '.kernel']
+        inputScale = float(self.arrays[name + '.ascale'])
+        return (kernel.reshape(-1, kernel.shape[-1]).astype(np.float32),
+                (inputScale * self.arrays[name + '.wscale']).astype(np.float32),
+                np.float32(1 / inputScale),
+                self.arrays[name + '.bias'])
+
+    def linear(self, x, name):
+        kernel, scale, inverseInputScale, bias = self.linears[name]
+        x = np.clip(np.rint(x * inverseInputScale), -QMAX, QMAX)
+        return (x @ kernel) * scale + bias
+
+
+class CalibrationNNet(NumpyNNet):
+    """Float network that records the largest input magnitude of every conv / dense layer."""
+
+    def __init__(self, net):
+        super().__init__()
+        self.build(net.arrays)
+        self.ranges = {}
+
+    def linear(self, x, name):
+        self.ranges[name] = max(self.ranges.get(name, 0.0), float(np.abs(x).max()))
+        return super().linear(x, name)
+
+
+def quantize(net, boards, batchSize=256):
+    """
+    Input:
+        net: float NumpyNNet
+        boards: calibration boards (canonical form)
+
+    Returns:
+        the QuantizedNNet of net
+    """
+    calibration = CalibrationNNet(net)
+    for start in range(0, len(boards), batchSize):
+        calibration.forward(boards[start:start + batchSize])
+
+    arrays = dict(net.arrays)
+    for name in net.linears:
+        kernel = net.arrays[name + '.kernel']
+        weightScale = np.abs(kernel.reshape(-1, kernel.shape[-1])).max(axis=0) / QMAX
+        weightScale[weightScale == 0] = 1.0
+        arrays[name + '.kernel'] = np.rint(kernel / weightScale).astype(np.int8)
+        arrays[name + '.wscale'] = weightScale.astype(np.float32)
+        arrays[name + '.ascale'] = np.float32(max(calibration.ranges[name], 1e-8) / QMAX)
+    quantized = QuantizedNNet()
+    quantized.build(arrays)
+    return quantized
+
+
+def loadExampleBoards(folder):
+    """
+    Returns the boards of the replay buffer of the checkpoint folder, or of
+    the newest .examples file in folder for checkpoints of older versions.
+    """
+    replayBuffer = ReplayBuffer(os.path.join(folder, 'replay'))
+    if replayBuffer.shards():
+        return np.concatenate([replayBuffer.arrays(shard)[0] for shard in replayBuffer.shards()]).astype(np.float32)
+    files = glob.glob(os.path.join(folder, '*.examples'))
+    if not files:
+        raise FileNotFoundError(f"No replay buffer or .examples files in '{folder}' to calibrate with")
+    with open(max(files, key=os.path.getmtime), 'rb') as f:
+        history = Unpickler(f).load()
+    return np.asarray([board for examples in history for board, _, _ in examples], dtype=np.float32)
+
+
+def compareOutputs(floatNet, quantizedNet, boards, batchSize=256):
+    """
+    Returns:
+        kl: KL(float policy || quantized policy) per board
+        valueError: absolute value difference per board
+    """
+    kl, valueError = [], []
+    for start in range(0, len(boards), batchSize):
+        pi, v = floatNet.predict_batch(boards[start:start + batchSize])
+        qPi, qV = quantizedNet.predict_batch(boards[start:start + batchSize])
+        kl.append(np.sum(pi * (np.log(pi + 1e-12) - np.log(qPi + 1e-12)), axis=1))
+        valueError.append(np.abs(v - qV))
+    return np.concatenate(kl), np.concatenate(valueError)
+
+
+def timePredict(net, boards, repeat=200):
+    """Returns the seconds per predict_batch call on boards."""
+    net.predict_batch(boards)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        net.predict_batch(boards)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quantize an exported checkpoint to int8 and compare it with float.')
+    gameArguments(parser)
+    parser.add_argument('--calibration', type=int, default=1024, help='boards to calibrate with')
+    parser.add_argument('--evaluation', type=int, default=2048, help='held-out boards to compare the outputs on')
+    parser.add_argument('--arena-games', type=int, default=40)
+    parser.add_argument('--sims', type=int, default=25)
+    parser.add_argument('--workers', type=int, default=1)
+    opts = parser.parse_args()
+
+    game, _ = makeGame(opts)
+    floatNet = NumpyNNet(game)
+    floatNet.load_checkpoint(opts.folder, opts.filename)
+    boards = np.random.default_rng(0).permutation(loadExampleBoards(opts.folder))
+    quantizedNet = quantize(floatNet, boards[:opts.calibration])
+    quantizedNet.save_checkpoint(opts.folder, opts.filename)
+
+    heldOut = boards[opts.calibration:opts.calibration + opts.evaluation]
+    if len(heldOut) == 0:
+        heldOut = boards[:opts.calibration]
+    kl, valueError = compareOutputs(floatNet, quantizedNet, heldOut)
+    print(f'{len(heldOut)} held-out boards: policy KL mean {kl.mean():.2e} max {kl.max():.2e}, '
+          f'|v error| mean {valueError.mean():.2e} max {valueError.max():.2e}')
+
+    base = opts.filename.split('.')[0]
+    for name, net in (('float32', floatNet), ('int8', quantizedNet)):
+        size = os.path.getsize(os.path.join(opts.folder, base + net.extension))
+        latency = '  '.join(f'batch {b}: {1e3 * timePredict(net, boards[:b]):.2f} ms' for b in (1, 32))
+        print(f'  {name:7s} {size / 2**20:6.2f} MiB  {latency}')
+
+    if opts.arena_games > 0:
+        args = {'numMCTSSims': opts.sims, 'cpuct': 1.0}
+        arena = Arena(MCTSPlayer(game, NumpyNNet, opts.folder, opts.filename, args),
+                      MCTSPlayer(game, QuantizedNNet, opts.folder, opts.filename, args),
+                      game, numWorkers=opts.workers)
+        floatWins, int8Wins, draws = arena.playGames(opts.arena_games)
+        decisive = floatWins + int8Wins
+        print(f'Arena, {opts.sims} sims each: float32 {floatWins} / int8 {int8Wins} / draws {draws}, '
+              f'int8 score {int8Wins / decisive if decisive else 0.5:.2f}')
+
+
+if __name__ == "__main__":
+    main()
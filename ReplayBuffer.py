@@ -0,0 +1,168 @@
+import glob
+import json
+import logging
+import os
+
+import numpy as np
+
+from ExampleStore import ExampleStore, unpackExamples
+
+log = logging.getLogger(__name__)
+
+
+class ReplayBuffer():
+    """
+    Columnar on-disk store of the training examples of the latest iterations.
+
+    Every iteration is one shard: three flat binary files holding the boards,
+    policies and values of its examples as fixed-dtype rows. The examples of
+    each episode are appended to the open shard as soon as the episode ends,
+    so saving costs only the new examples, and a shard is dropped by deleting
+    its files. Reading maps the files with np.memmap, so resuming a run loads
+    nothing up front.
+
+    The row count of a shard is taken from the file sizes, so a shard cut
+    short by a crash loses at most the episode being written.
+    """
+
+    COLUMNS = ('boards', 'pis', 'vs')
+
+    def __init__(self, folder, maxShards=None, maxShardLength=None):
+        """
+        Input:
+            folder: directory of the shards, created on the first write
+            maxShards: shards kept by trim() (args.numItersForTrainExamplesHistory)
+            maxShardLength: examples read from each shard, the newest ones
+                            (args.maxlenOfQueue)
+        """
+        self.folder = folder
+        self.maxShards = maxShards
+        self.maxShardLength = maxShardLength
+        self.meta = None  # board shape / dtypes, fixed by the first examples written
+        self.files = None  # open column files of the shard being written
+        metaFile = os.path.join(folder, 'meta.json')
+        if os.path.isfile(metaFile):
+            with open(metaFile) as f:
+                self.meta = json.load(f)
+
+    def shardPath(self, shard, column):
+        return os.path.join(self.folder, f'shard_{shard:06d}.{column}')
+
+    def shards(self):
+        """Ids of the stored shards, oldest first."""
+        paths = glob.glob(os.path.join(self.folder, 'shard_*.vs'))
+        return sorted(int(os.path.basename(p)[len('shard_'):-len('.vs')]) for p in paths)
+
+    def beginShard(self):
+        """Opens a new shard, after the newest stored one, for add()."""
+        os.makedirs(self.folder, exist_ok=True)
+        shards = self.shards()
+        shard = shards[-1] + 1 if shards else 0
+        self.files = {column: open(self.shardPath(shard, column), 'ab') for column in self.COLUMNS}
+        return shard
+
+    def add(self, examples):
+        """
+        Appends examples, an ExampleStore or a list of (board, pi, v), to the
+        open shard. Raises ValueError if their board shape, board dtype or
+        action size differ from those of the examples already stored.
+        """
+        if not len(examples):
+            return
+        boards, pis, vs = unpackExamples(examples)
+        dtype = boards.dtype if boards.dtype.kind in 'biuf' else np.dtype(np.float32)
+        meta = {'boardShape': list(boards.shape[1:]), 'boardDtype': dtype.str, 'actionSize': pis.shape[1]}
+        if self.meta is None:
+            self.meta = meta
+            with open(os.path.join(self.folder, 'meta.json'), 'w') as f:
+                json.dump(self.meta, f)
+        elif meta != self.meta:
+            raise ValueError(f'Examples with {meta} do not match the replay buffer in "{self.folder}" ({self.meta})')
+        self.files['boards'].write(np.asarray(boards, dtype=self.meta['boardDtype']).tobytes())
+        self.files['pis'].write(np.asarray(pis, dtype=np.float32).tobytes())
+        self.files['vs'].write(np.asarray(vs, dtype=np.float32).tobytes())
+
+    def endShard(self):
+        """Closes the open shard, if any."""
+        if self.files is None:
+            return
+        for f in self.files.values():
+            f.close()
+        self.files = None
+
+    def trim(self):
+        """Deletes the oldest shards beyond maxShards. Returns the number of shards deleted."""
+        shards = self.shards()
+        if self.maxShards is None or len(shards) <= self.maxShards:
+            return 0
+        for shard in shards[:len(shards) - self.maxShards]:
+            for column in self.COLUMNS:
+                os.remove(self.shardPath(shard, column))
+        return len(shards) - self.maxShards
+
+    def clear(self):
+        """Deletes all shards and the metadata, so the next examples start an empty buffer."""
+        for path in glob.glob(os.path.join(self.folder, 'shard_*')):
+            os.remove(path)
+        metaFile = os.path.join(self.folder, 'meta.json')
+        if os.path.isfile(metaFile):
+            os.remove(metaFile)
+        self.meta = None
+
+    def rowShapes(self):
+        return {'boards': (tuple(self.meta['boardShape']), np.dtype(self.meta['boardDtype'])),
+                'pis': ((self.meta['actionSize'],), np.dtype(np.float32)),
+                'vs': ((), np.dtype(np.float32))}
+
+    def arrays(self, shard):
+        """
+        Returns:
+            boards, pis, vs: read-only memmaps of the newest (at most
+                             maxShardLength) examples of the shard
+        """
+        shapes = self.rowShapes()
+        rows = min(os.path.getsize(self.shardPath(shard, column)) // (int(np.prod(shape)) * dtype.itemsize)
+                   for column, (shape, dtype) in shapes.items())
+        start = 0 if self.maxShardLength is None else max(rows - self.maxShardLength, 0)
+        columns = []
+        for column, (shape, dtype) in shapes.items():
+            if rows == 0:
+                columns.append(np.empty((0,) + shape, dtype))
+                continue
+            data = np.memmap(self.shardPath(shard, column), dtype=dtype, mode='r', shape=(rows,) + shape)
+            columns.append(data[start:])
+        return tuple(columns)
+
+    def __len__(self):
+        if self.meta is None:
+            return 0
+        return sum(len(self.arrays(shard)[2]) for shard in self.shards())
+
+    def examples(self, piDtype=np.float32):
+        """Returns the examples of all shards in one ExampleStore, oldest first."""
+        if self.meta is None:
+            return ExampleStore((), 0, capacity=0)
+        shards = [self.arrays(shard) for shard in self.shards()]
+        examples = ExampleStore(self.meta['boardShape'], self.meta['actionSize'],
+                                capacity=sum(len(vs) for _, _, vs in shards), piDtype=piDtype)
+        for boards, pis, vs in shards:
+            examples.append(boards, pis, vs)
+        return examples
+
+    def importHistory(self, history):
+        """
+        Stores a pickled trainExamplesHistory (a list of iterations' examples)
+        as one shard per iteration. The examples go through an ExampleStore
+        first, so the shards get the int8 boards self-play appends later,
+        whatever array type the pickled boards have.
+        """
+        for examples in history:
+            examples = list(examples)
+            self.beginShard()
+            if examples:
+                board, pi, _ = examples[0]
+                store = ExampleStore(np.shape(board), len(pi), capacity=len(examples))
+                store.extend(examples)
+                self.add(store)
+            self.endShard()
+        log.info(f'Imported {len(history)} iterations of examples into {self.folder}')
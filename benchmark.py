@@ -0,0 +1,811 @@
+"""
+Micro-benchmarks for the search and game engines.
+
+Usage:
+    python benchmark.py mcts [--game kirche6] [--sims 400] [--moves 5]
+    python benchmark.py puct [--repeat 2000]
+    python benchmark.py predict [--game kirche6] [--channels 64] [--batch-sizes 1 8 32 256]
+    python benchmark.py batch [--game kirche6] [--sims 400] [--channels 64] [--batch-sizes 1 8 16 32]
+    python benchmark.py selfplay [--game kirche5] [--episodes 16] [--workers 1 2 4 8]
+    python benchmark.py replay [--game kirche5] [--iters 20] [--examples 5000]
+    python benchmark.py examples [--game kirche5] [--iters 20] [--examples 2000]
+    python benchmark.py symmetries [--game tictactoe] [--episodes 400] [--epochs 4]
+    python benchmark.py train [--game kirche5] [--iters 10] [--examples 5000] [--channels 32] [--epochs 2]
+    python benchmark.py movegen [--n 6] [--priests 2] [--positions 2000]
+    python benchmark.py winlines [--sizes 3 4 5] [--positions 2000]
+    python benchmark.py cubesym [--sizes 3 4 5] [--positions 2000]
+    python benchmark.py batchgame [--games tictactoe tictactoe3d kirche6] [--batch-sizes 1 64 4096] [--steps 20]
+    python benchmark.py evalcache [--game kirche5] [--episodes 20] [--cache-mb 0 64]
+    python benchmark.py reuse [--game kirche6] [--sims 400] [--moves 40]
+    python benchmark.py memory [--game kirche6] [--sims 400] [--moves 40] [--max-mb 0 4 1]
+    python benchmark.py cycles [--game kirche6] [--sims 400] [--moves 40]
+
+Unless noted otherwise the benchmarks use a uniform NumPy stand-in for the
+neural network, so they measure the cost of the search itself and run
+without Keras.
+"""
+
+import argparse
+import itertools
+import math
+import multiprocessing
+import os
+import random
+import resource
+import pickle
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from CachedNNet import CachedNNet
+from Coach import Coach
+from ExampleStore import ExampleStore, unpackExamples
+from Game import Game
+from MCTS import EPS, makeMCTS, maskPolicy, selectPUCT
+from ReplayBuffer import ReplayBuffer
+from kirche.KircheGame import KircheGame
+from kirche.KircheLogic import Board, BitBoard
+from tictactoe.TicTacToeGame import TicTacToeGame
+from tictactoe_3d.TicTacToeGame import TicTacToeGame as TicTacToe3DGame
+from tictactoe_3d.TicTacToeLogic import Board as Board3D
+from utils import *
+
+GAMES = {
+    'tictactoe': lambda: TicTacToeGame(),
+    'tictactoe3d': lambda: TicTacToe3DGame(3),
+    'kirche5': lambda: KircheGame(5, 1),
+    'kirche6': lambda: KircheGame(6, 2),
+}
+
+
+class UniformNNet():
+    """Uniform policy, zero value (same as DummyNNet in play_kirche.py)."""
+
+    def __init__(self, game):
+        self.action_size = game.getActionSize()
+
+    def predict(self, board):
+        return np.ones(self.action_size) / self.action_size, 0
+
+
+def timeSearch(game, args, moves):
+    """
+    Returns the seconds needed to play `moves` moves of self-play with
+    temp=0, and the search tree.
+    """
+    mcts = makeMCTS(game, UniformNNet(game), args)
+    board, player = game.getInitBoard(), 1
+    np.random.seed(0)
+    start = time.perf_counter()
+    for _ in range(moves):
+        if game.getGameEnded(board, player) != 0:
+            break
+        pi = mcts.getActionProb(game.getCanonicalForm(board, player), temp=0)
+        board, player = game.getNextState(board, player, int(np.argmax(pi)))
+    return time.perf_counter() - start, mcts
+
+
+def keyBytes(mcts):
+    """Memory held by the keys of the position table of a search tree."""
+    table = mcts.nodes if hasattr(mcts, 'nodes') else mcts.Es
+    return sum(sys.getsizeof(key) for key in table)
+
+
+def benchMCTS(opts):
+    game = GAMES[opts.game]()
+    print(f'{opts.game}: {opts.moves} moves x {opts.sims} sims')
+    base = None
+    for engine in ('dict', 'array'):
+        for zobrist in (False, True):
+            args = dotdict({'numMCTSSims': opts.sims, 'cpuct': 1.0, 'mctsEngine': engine, 'zobrist': zobrist})
+            t, mcts = timeSearch(game, args, opts.moves)
+            base = base or t
+            keys = 'zobrist' if zobrist else 'string'
+            print(f'  {engine:>6} {keys:>7} keys: {t:7.3f}s  {opts.sims * opts.moves / t:9.0f} sims/s  x{base / t:.2f}  '
+                  f'{keyBytes(mcts) / 1024:7.0f} KiB of keys')
+
+
+def scalarPUCT(valids, Ps, Qsa, Nsa, Ns, cpuct):
+    """The per-action selection loop MCTS.search used before selectPUCT."""
+    cur_best = -float('inf')
+    best_act = -1
+    for a in range(len(valids)):
+        if valids[a]:
+            if a in Qsa:
+                u = Qsa[a] + cpuct * Ps[a] * math.sqrt(Ns) / (1 + Nsa[a])
+            else:
+                u = cpuct * Ps[a] * math.sqrt(Ns + EPS)
+            if u > cur_best:
+                cur_best = u
+                best_act = a
+    return best_act
+
+
+def benchPUCT(opts):
+    rng = np.random.default_rng(0)
+    for name, makeGame in GAMES.items():
+        game = makeGame()
+        board = game.getInitBoard()
+        valids = game.getValidMoves(board, 1)
+        actions, ps = maskPolicy(rng.random(game.getActionSize()), valids)
+        nsa = rng.integers(0, 5, len(actions))
+        qsa = rng.uniform(-1, 1, len(actions)) * (nsa > 0)
+        ns = int(nsa.sum())
+
+        # the dict layout of the old loop, with full-length priors
+        fullPs = np.zeros(game.getActionSize())
+        fullPs[actions] = ps
+        Qsa = {a: q for a, q, n in zip(actions, qsa, nsa) if n > 0}
+        Nsa = {a: n for a, n in zip(actions, nsa) if n > 0}
+
+        start = time.perf_counter()
+        for _ in range(opts.repeat):
+            old = scalarPUCT(valids, fullPs, Qsa, Nsa, ns, 1.0)
+        tOld = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(opts.repeat):
+            new = actions[selectPUCT(qsa, nsa, ps, ns, 1.0)]
+        tNew = time.perf_counter() - start
+        assert old == new
+        print(f'{name:>12}: {len(actions):3d}/{len(valids):4d} legal  '
+              f'loop {1e6 * tOld / opts.repeat:7.1f}us  vectorized {1e6 * tNew / opts.repeat:6.1f}us  x{tOld / tNew:.1f}')
+
+
+def kerasNNet(game, channels):
+    """An untrained Keras network of the game, with num_channels=channels."""
+    if isinstance(game, KircheGame):
+        from kirche.keras import NNet
+    elif isinstance(game, TicTacToe3DGame):
+        from tictactoe_3d.keras import NNet
+    else:
+        from tictactoe.keras import NNet
+    NNet.args['num_channels'] = channels
+    return NNet.NNetWrapper(game)
+
+
+def benchPredict(opts):
+    """Per-call latency of the Keras network: eager call, model.predict, tf.function, tf.function + XLA."""
+    from KerasPredictor import KerasPredictor
+    game = GAMES[opts.game]()
+    model = kerasNNet(game, opts.channels).nnet.model
+    paths = [
+        ('eager', lambda x: model(x, training=False)),
+        ('model.predict', lambda x: model.predict(x, verbose=False)),
+        ('tf.function', KerasPredictor(model, game.getBoardSize()).predict_batch),
+        ('tf.function+XLA', KerasPredictor(model, game.getBoardSize(), jitCompile=True).predict_batch),
+    ]
+    board = np.asarray(game.getInitBoard(), dtype=np.float32)
+    print(f'{opts.game}: num_channels={opts.channels}, ms per call')
+    print('  ' + ' ' * 15 + ''.join(f'{f"batch {b}":>12}' for b in opts.batch_sizes))
+    for name, run in paths:
+        times = []
+        for batchSize in opts.batch_sizes:
+            boards = np.repeat(board[np.newaxis], batchSize, axis=0)
+            run(boards)  # warm-up: tracing / XLA compilation
+            calls = max(opts.calls // batchSize, 3)
+            start = time.perf_counter()
+            for _ in range(calls):
+                run(boards)
+            times.append(1e3 * (time.perf_counter() - start) / calls)
+        print(f'  {name:15s}' + ''.join(f'{t:12.2f}' for t in times))
+
+
+def benchBatch(opts):
+    """Sequential vs batched leaf evaluation with the game's Keras network."""
+    game = GAMES[opts.game]()
+    nnet = kerasNNet(game, opts.channels)
+    board = game.getInitBoard()
+    print(f'{opts.game}: {opts.sims} sims from the initial board, num_channels={opts.channels}')
+    base = None
+    for batchSize in opts.batch_sizes:
+        args = dotdict({'numMCTSSims': opts.sims, 'cpuct': 1.0, 'mctsEngine': 'array',
+                        'mctsBatchSize': batchSize, 'virtualLoss': 1.0})
+        mcts = makeMCTS(game, nnet, args)
+        mcts.getActionProb(board)  # warm-up, also traces the model
+        mcts = makeMCTS(game, nnet, args)
+        start = time.perf_counter()
+        mcts.getActionProb(board)
+        t = time.perf_counter() - start
+        base = base or t
+        print(f'  batch {batchSize:3d}: {opts.sims / t:8.0f} sims/s  x{base / t:.2f}')
+
+
+def benchSelfPlay(opts):
+    """Self-play throughput of Coach.selfPlay for several worker counts (needs Keras)."""
+    game = GAMES[opts.game]()
+    nnet = kerasNNet(game, opts.channels)
+    with tempfile.TemporaryDirectory() as folder:
+        print(f'{opts.game}: {opts.episodes} episodes x {opts.sims} sims, num_channels={opts.channels}')
+        base = None
+        for workers in opts.workers:
+            args = dotdict({'numEps': opts.episodes, 'tempThreshold': 15, 'numMCTSSims': opts.sims, 'cpuct': 1,
+                            'checkpoint': folder, 'seed': 0, 'numSelfPlayWorkers': workers})
+            coach = Coach(game, nnet, args)
+            for _ in coach.selfPlay(0):  # warm-up: starts the workers and loads the weights
+                pass
+            start = time.perf_counter()
+            episodes = sum(1 for _ in coach.selfPlay(1))
+            t = time.perf_counter() - start
+            coach.closeSelfPlayPool()
+            base = base or t
+            print(f'  {workers:2d} workers: {60 * episodes / t:7.1f} episodes/min  x{base / t:.2f}')
+
+
+def benchReuse(opts):
+    """Time and tree size over one self-play game, with and without tree reuse."""
+    game = GAMES[opts.game]()
+    print(f'{opts.game}: {opts.moves} moves x {opts.sims} sims')
+    base = None
+    for reuse in (False, True):
+        args = dotdict({'numMCTSSims': opts.sims, 'cpuct': 1.0, 'mctsEngine': 'array', 'mctsReuseTree': reuse})
+        mcts = makeMCTS(game, UniformNNet(game), args)
+        board, player = game.getInitBoard(), 1
+        np.random.seed(0)
+        peak = 0
+        start = time.perf_counter()
+        for _ in range(opts.moves):
+            if game.getGameEnded(board, player) != 0:
+                break
+            pi = mcts.getActionProb(game.getCanonicalForm(board, player), temp=1)
+            peak = max(peak, len(mcts.boards))
+            board, player = game.getNextState(board, player, np.random.choice(len(pi), p=pi))
+        t = time.perf_counter() - start
+        base = base or t
+        print(f'  reuse {str(reuse):>5}: {t:7.3f}s  x{base / t:.2f}  {len(mcts.boards):7d} nodes at the end, {peak:7d} at most')
+
+
+def benchMemory(opts):
+    """Tree memory over one self-play game with one search tree, for several budgets."""
+    game = GAMES[opts.game]()
+    print(f'{opts.game}: {opts.moves} moves x {opts.sims} sims')
+    for engine in ('dict', 'array'):
+        base = None
+        for maxMB in opts.max_mb:
+            args = dotdict({'numMCTSSims': opts.sims, 'cpuct': 1.0, 'mctsEngine': engine, 'mctsMaxMB': maxMB})
+            t, mcts = timeSearch(game, args, opts.moves)
+            base = base or t
+            nodes, size = mcts.memoryUsage()
+            budget = f'{maxMB:g} MiB' if maxMB else 'no limit'
+            print(f'  {engine:>6} {budget:>9}: {t:7.3f}s  x{base / t:.2f}  {nodes:7d} nodes  {size / 2**20:7.2f} MiB')
+
+
+def benchCycles(opts):
+    """Simulations lost to the depth limit over one self-play game, with and without cycle detection."""
+    game = GAMES[opts.game]()
+    sims = opts.sims * opts.moves
+    print(f'{opts.game}: {opts.moves} moves x {opts.sims} sims')
+    for detectCycles in (False, True):
+        args = dotdict({'numMCTSSims': opts.sims, 'cpuct': 1.0, 'mctsEngine': 'array', 'mctsDetectCycles': detectCycles})
+        t, mcts = timeSearch(game, args, opts.moves)
+        print(f'  cycle detection {"on" if detectCycles else "off":>3}: {t:7.3f}s  '
+              f'{mcts.depthCutoffs:6d} depth cutoffs ({100 * mcts.depthCutoffs / sims:4.1f}%)  '
+              f'{mcts.cycles:6d} cycles ({100 * mcts.cycles / sims:4.1f}%)')
+
+
+def benchReplay(opts):
+    """Saving / resuming the training examples: pickled history vs replay buffer shards."""
+    game = GAMES[opts.game]()
+    rng = np.random.default_rng(0)
+    board = np.asarray(game.getInitBoard())
+    actions = game.getActionSize()
+
+    def iterationExamples():
+        return [(rng.permutation(board.ravel()).reshape(board.shape), rng.random(actions, dtype=np.float32) / actions,
+                 float(rng.choice([-1, 1]))) for _ in range(opts.examples)]
+
+    with tempfile.TemporaryDirectory() as folder:
+        history, pickleSave, bufferSave = [], 0.0, 0.0
+        replayBuffer = ReplayBuffer(os.path.join(folder, 'replay'), maxShards=opts.iters)
+        for i in range(opts.iters):
+            examples = iterationExamples()
+            history.append(examples)
+            start = time.perf_counter()
+            with open(os.path.join(folder, 'checkpoint.examples'), 'wb') as f:
+                pickle.Pickler(f).dump(history)
+            pickleSave = time.perf_counter() - start
+            start = time.perf_counter()
+            replayBuffer.beginShard()
+            for e in range(0, len(examples), 100):  # one episode at a time
+                replayBuffer.add(examples[e:e + 100])
+            replayBuffer.endShard()
+            bufferSave = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with open(os.path.join(folder, 'checkpoint.examples'), 'rb') as f:
+            loaded = pickle.Unpickler(f).load()
+        pickleLoad = time.perf_counter() - start
+        del loaded
+        start = time.perf_counter()
+        replayBuffer = ReplayBuffer(os.path.join(folder, 'replay'))
+        count = len(replayBuffer)
+        bufferLoad = time.perf_counter() - start
+        pickleSize = os.path.getsize(os.path.join(folder, 'checkpoint.examples'))
+        bufferSize = sum(os.path.getsize(os.path.join(folder, 'replay', f))
+                         for f in os.listdir(os.path.join(folder, 'replay')))
+
+    print(f'{opts.game}: {opts.iters} iterations x {opts.examples} examples ({count} in the buffer)')
+    print(f'  pickle         save (last iteration) {pickleSave:7.3f}s  resume {pickleLoad:7.3f}s  {pickleSize / 2**20:7.1f} MiB')
+    print(f'  replay buffer  save (last iteration) {bufferSave:7.3f}s  resume {bufferLoad:7.3f}s  {bufferSize / 2**20:7.1f} MiB')
+
+
+def examplesPeakRSS(compact, gameName, iters, examples):
+    """
+    Builds, shuffles and unpacks a history of iters x examples random
+    examples, as lists (compact False) or in an ExampleStore, and returns
+    the RSS before and the peak RSS after, in MiB.
+    """
+    game = GAMES[gameName]()
+    rng = np.random.default_rng(0)
+    board = np.asarray(game.getInitBoard())
+    actions = game.getActionSize()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    history = []
+    for _ in range(iters):
+        boards = [rng.permutation(board.ravel()).reshape(board.shape) for _ in range(examples)]
+        pis = rng.random((examples, actions)) / actions
+        vs = rng.choice([-1.0, 1.0], examples)
+        if compact:
+            store = ExampleStore.forGame(game, capacity=examples)
+            store.append(boards, pis, vs)
+            history.append(store)
+        else:
+            history.append([(b, p.tolist(), v) for b, p, v in zip(boards, pis, vs.tolist())])
+        del boards, pis
+    if compact:
+        trainExamples = ExampleStore.forGame(game, capacity=iters * examples)
+        for store in history:
+            trainExamples.extend(store)
+        trainExamples.shuffle()
+    else:
+        trainExamples = []
+        for e in history:
+            trainExamples.extend(e)
+        random.shuffle(trainExamples)
+    unpackExamples(trainExamples)
+    return before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchExamples(opts):
+    """Peak RSS of the training examples of a full history: lists of tuples vs ExampleStore."""
+    print(f'{opts.game}: {opts.iters} iterations x {opts.examples} examples')
+    context = multiprocessing.get_context('spawn')
+    for compact in (False, True):
+        with context.Pool(1) as pool:  # a fresh process per format, for a clean peak RSS
+            before, peak = pool.apply(examplesPeakRSS, (compact, opts.game, opts.iters, opts.examples))
+        name = 'ExampleStore' if compact else 'list of tuples'
+        print(f'  {name:15s} peak RSS {peak:8.0f} MiB  ({peak - before:8.0f} MiB above the baseline)')
+
+
+def trainRun(mode, gameName, folder, channels, epochs, batchSize):
+    """
+    Trains a fresh Keras network for epochs on the examples of the replay
+    buffer in folder, fed as arrays unpacked from a list of tuples (mode
+    'list') or from an ExampleStore ('store'), or streamed through tf.data
+    from an ExampleStore ('tf.data store') or from the buffer's memmapped
+    shards ('tf.data replay'). Returns the seconds to the first trained
+    batch, the seconds of the last epoch and the peak RSS in MiB.
+    """
+    import keras
+    from KerasDataset import exampleDataset
+
+    class Timer(keras.callbacks.Callback):
+        def on_train_batch_end(self, batch, logs=None):
+            if self.firstBatch is None:
+                self.firstBatch = time.perf_counter() - self.start
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self.epochStart = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            self.epochTime = time.perf_counter() - self.epochStart
+
+    game = GAMES[gameName]()
+    model = kerasNNet(game, channels).nnet.model
+    replayBuffer = ReplayBuffer(folder)
+    if mode == 'list':  # the pickled history of before the replay buffer
+        store = replayBuffer.examples()
+        examples = list(zip(store.boards.astype(np.int64), store.pis.astype(np.float64), store.vs.tolist()))
+        del store
+    timer = Timer()
+    timer.firstBatch, timer.start = None, time.perf_counter()
+    if mode in ('list', 'store'):
+        if mode == 'store':
+            examples = replayBuffer.examples()
+            examples.shuffle()
+        boards, pis, vs = unpackExamples(examples)
+        model.fit(x=boards, y=[pis, vs], batch_size=batchSize, epochs=epochs, callbacks=[timer], verbose=0)
+    else:
+        examples = replayBuffer.examples() if mode == 'tf.data store' else replayBuffer
+        model.fit(exampleDataset(examples, batchSize), epochs=epochs, callbacks=[timer], shuffle=False, verbose=0)
+    return timer.firstBatch, timer.epochTime, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchTrain(opts):
+    """Training on the replay buffer: fit on whole arrays vs batches streamed through tf.data (needs Keras)."""
+    game = GAMES[opts.game]()
+    rng = np.random.default_rng(0)
+    board = np.asarray(game.getInitBoard())
+    actions = game.getActionSize()
+    count = opts.iters * opts.examples
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as folder:
+        replayBuffer = ReplayBuffer(folder)
+        for _ in range(opts.iters):
+            replayBuffer.beginShard()
+            replayBuffer.add(list(zip([rng.permutation(board.ravel()).reshape(board.shape) for _ in range(opts.examples)],
+                                      rng.dirichlet(np.ones(actions), opts.examples).astype(np.float32),
+                                      rng.choice([-1.0, 1.0], opts.examples))))
+            replayBuffer.endShard()
+        print(f'{opts.game}: {count} examples, num_channels={opts.channels}, batch size {opts.batch_size}, '
+              f'{opts.epochs} epochs')
+        for mode in ('list', 'store', 'tf.data store', 'tf.data replay'):
+            with context.Pool(1) as pool:  # a fresh process per mode, for a clean peak RSS
+                firstBatch, epochTime, peak = pool.apply(
+                    trainRun, (mode, opts.game, folder, opts.channels, opts.epochs, opts.batch_size))
+            print(f'  {mode:15s} first batch {firstBatch:6.2f}s  last epoch {count / epochTime:7.0f} examples/s  '
+                  f'peak RSS {peak:6.0f} MiB')
+
+
+def benchSymmetries(opts):
+    """
+    Self-play examples stored in every symmetry vs once with random symmetries
+    at training time: storage, training time and held-out loss (needs Keras).
+    """
+    import keras
+
+    game = GAMES[opts.game]()
+    args = dotdict({'tempThreshold': 15, 'numMCTSSims': opts.sims, 'cpuct': 1, 'checkpoint': tempfile.gettempdir()})
+    coach = Coach(game, UniformNNet(game), args)
+    stores = {}
+    for storeSymmetries in (True, False):
+        coach.storeSymmetries = storeSymmetries
+        episodes = []
+        for episode in range(opts.episodes):
+            coach.seedEpisode(episode)  # the same games in both modes
+            coach.mcts = makeMCTS(game, coach.nnet, args)
+            episodes.append(coach.executeEpisode())
+        train, test = ExampleStore.forGame(game), ExampleStore.forGame(game)
+        for episode, examples in enumerate(episodes):
+            (test if episode % 5 == 0 else train).extend(examples)
+        stores[storeSymmetries] = train, test
+    test = stores[True][1]  # held out in every symmetry
+
+    print(f'{opts.game}: {opts.episodes} episodes x {opts.sims} sims, {len(game.getSymmetryPermutations()[0])} '
+          f'distinct symmetries, num_channels={opts.channels}')
+    epochs = opts.epochs
+    for name, storeSymmetries in (('all symmetries', True), ('random symmetry', False)):
+        train = stores[storeSymmetries][0]
+        keras.utils.set_random_seed(0)
+        nnet = kerasNNet(game, opts.channels)
+        getNNetArgs(type(nnet)).update(augment=not storeSymmetries, epochs=epochs, batch_size=64, checkpoint=args.checkpoint)
+        start = time.perf_counter()
+        nnet.train(train)
+        t = time.perf_counter() - start
+        loss, piLoss, vLoss = nnet.nnet.model.evaluate(test.boards.astype(np.float32), [test.pis, test.vs],
+                                                       batch_size=256, verbose=0)[:3]
+        print(f'  {name:28s} {len(train):7d} examples {train.records.nbytes / 2**10:8.1f} KiB  {epochs:3d} epochs '
+              f'{t:6.1f}s  held-out pi loss {piLoss:.4f}  v loss {vLoss:.4f}')
+
+
+def benchEvalCache(opts):
+    """Sequential self-play with and without the network evaluation cache (needs Keras)."""
+    game = GAMES[opts.game]()
+    nnet = kerasNNet(game, opts.channels)
+    with tempfile.TemporaryDirectory() as folder:
+        print(f'{opts.game}: {opts.episodes} episodes x {opts.sims} sims, num_channels={opts.channels}')
+        base = None
+        for cacheMB in opts.cache_mb:
+            args = dotdict({'numEps': opts.episodes, 'tempThreshold': 15, 'numMCTSSims': opts.sims, 'cpuct': 1,
+                            'checkpoint': folder, 'seed': 0, 'evalCacheMB': cacheMB})
+            coach = Coach(game, nnet, args)
+            start = time.perf_counter()
+            episodes = sum(1 for _ in coach.selfPlay(1))
+            t = time.perf_counter() - start
+            base = base or t
+            stats = coach.nnet.describe() if isinstance(coach.nnet, CachedNNet) else 'no cache'
+            print(f'  {cacheMB:4d} MiB: {60 * episodes / t:7.1f} episodes/min  x{base / t:.2f}  {stats}')
+
+
+def benchMoveGen(opts):
+    """Kirche move generation: tensor Board vs BitBoard, on positions of random games."""
+    game = KircheGame(opts.n, opts.priests)
+    rng = np.random.default_rng(0)
+    positions = []
+    while len(positions) < opts.positions:
+        board, player = game.getInitBoard(), 1
+        while len(positions) < opts.positions and game.getGameEnded(board, player) == 0:
+            positions.append((board, player))
+            actions = np.flatnonzero(game.getValidMoves(board, player))
+            board, player = game.getNextState(board, player, rng.choice(actions))
+
+    def tensorMoves(board, player):
+        b = Board(opts.n)
+        b.state = np.copy(board)
+        return b.get_legal_moves(player)
+
+    def bitMoves(board, player):
+        return BitBoard.from_tensor(board).get_legal_actions(player)
+
+    print(f'kirche {opts.n}x{opts.n}, {opts.priests} priests: {len(positions)} positions')
+    bitboards = [(BitBoard.from_tensor(board), player) for board, player in positions]
+    base = None
+    for name, gen, inputs in (('Board', tensorMoves, positions),
+                              ('BitBoard', bitMoves, positions),
+                              ('BitBoard without from_tensor', BitBoard.get_legal_actions, bitboards)):
+        start = time.perf_counter()
+        for board, player in inputs:
+            gen(board, player)
+        t = time.perf_counter() - start
+        base = base or t
+        print(f'  {name:>28}: {len(positions) / t:9.0f} positions/s  x{base / t:.1f}')
+
+
+def loopIsWin(pieces, color):
+    """The nested-loop scan Board.is_win of 3D TicTacToe used before the win-line
+    table, with its hard-coded n=3 space diagonals generalised to any n."""
+    n = len(pieces)
+    # every straight line, once per ordering of the axes (each line is scanned twice)
+    for outer, middle, inner in itertools.permutations(range(3)):
+        for i in range(n):
+            for j in range(n):
+                count = 0
+                for k in range(n):
+                    cell = [0, 0, 0]
+                    cell[outer], cell[middle], cell[inner] = i, j, k
+                    if pieces[tuple(cell)] == color:
+                        count += 1
+                if count == n:
+                    return True
+    # both diagonals of every plane
+    for axis in range(3):
+        for i in range(n):
+            for flip in (False, True):
+                count = 0
+                for d in range(n):
+                    cell = [d, d, d]
+                    cell[axis] = i
+                    cell[(axis + 2) % 3] = n - d - 1 if flip else d
+                    if pieces[tuple(cell)] == color:
+                        count += 1
+                if count == n:
+                    return True
+    # the 4 space diagonals
+    for fx, fy in ((False, False), (False, True), (True, False), (True, True)):
+        count = 0
+        for d in range(n):
+            if pieces[d, n - d - 1 if fx else d, n - d - 1 if fy else d] == color:
+                count += 1
+        if count == n:
+            return True
+    return False
+
+
+def benchWinLines(opts):
+    """3D TicTacToe game-end check: nested loops vs the precomputed win-line table."""
+    rng = np.random.default_rng(0)
+    for n in opts.sizes:
+        game = TicTacToe3DGame(n)
+        positions = []
+        while len(positions) < opts.positions:
+            board, player = game.getInitBoard(), 1
+            while len(positions) < opts.positions and game.getGameEnded(board, player) == 0:
+                positions.append(board)
+                actions = np.flatnonzero(game.getValidMoves(board, player)[:-1])
+                board, player = game.getNextState(board, player, rng.choice(actions))
+
+        def loops(board):
+            return 1 if loopIsWin(board, 1) else -1 if loopIsWin(board, -1) else 0
+
+        def table(board):
+            b = Board3D(n)
+            b.pieces = board
+            return b.winner()
+
+        times, results = {}, {}
+        for name, check in (('loops', loops), ('table', table)):
+            start = time.perf_counter()
+            results[name] = [check(board) for board in positions]
+            times[name] = time.perf_counter() - start
+        assert results['loops'] == results['table']
+        print(f'n={n}: {len(Board3D.win_lines(n)):4d} lines  '
+              f'loops {1e6 * times["loops"] / len(positions):7.1f}us  '
+              f'table {1e6 * times["table"] / len(positions):5.1f}us  x{times["loops"] / times["table"]:.1f}')
+
+
+def loopSymmetries(board, pi, n):
+    """The reshape / fliplr / flipud loop 3D TicTacToe getSymmetries used
+    before the precomputed permutations (16 copies, 3 distinct symmetries)."""
+    pi_board = np.reshape(pi[:-1], (n, n, n))
+    l = []
+    newB = np.reshape(board, (n*n, n))
+    newPi = pi_board
+    for i in range(1, 5):
+        for z in [True, False]:
+            for j in [True, False]:
+                if j:
+                    newB = np.fliplr(newB)
+                    newPi = np.fliplr(newPi)
+                if z:
+                    newB = np.flipud(newB)
+                    newPi = np.flipud(newPi)
+                newB = np.reshape(newB, (n, n, n))
+                newPi = np.reshape(newPi, (n, n, n))
+                l += [(newB, list(newPi.ravel()) + [pi[-1]])]
+    return l
+
+
+def benchCubeSymmetries(opts):
+    """3D TicTacToe symmetries: flip loop vs one np.take per symmetry vs the batched variant."""
+    rng = np.random.default_rng(0)
+    for n in opts.sizes:
+        game = TicTacToe3DGame(n)
+        boards = rng.integers(-1, 2, (opts.positions, n, n, n)).astype(np.float64)
+        pis = rng.random((opts.positions, game.getActionSize()))
+        timings = []
+        for name, run in (('loop', lambda: [loopSymmetries(b, p, n) for b, p in zip(boards, pis)]),
+                          ('np.take', lambda: [game.getSymmetries(b, p) for b, p in zip(boards, pis)]),
+                          ('batched', lambda: game.getSymmetriesBatch(boards, pis))):
+            start = time.perf_counter()
+            run()
+            timings.append((name, time.perf_counter() - start))
+        symmetries = (16, 48, 48)
+        print(f'n={n}: ' + '  '.join(f'{name} {1e6 * t / opts.positions:7.1f}us/board '
+                                     f'({1e6 * t / opts.positions / s:5.2f}us/symmetry)'
+                                     for (name, t), s in zip(timings, symmetries)))
+
+
+def benchBatchedGames(opts):
+    """
+    Random play of many games at once, restarting the ones that end: the
+    looping fallbacks of the Game base class vs the vectorized batched API.
+    The time spent picking the random actions is not counted.
+    """
+    rng = np.random.default_rng(0)
+    for name in opts.games:
+        game = GAMES[name]()
+        init = game.getInitBoard()
+        for size in opts.batch_sizes:
+            rates = []
+            for batched in (Game, type(game)):
+                boards, players = np.stack([init] * size), np.ones(size, dtype=int)
+                start, choosing = time.perf_counter(), 0.0
+                for _ in range(opts.steps):
+                    batched.getCanonicalFormBatch(game, boards, players)  # the network input
+                    valids = batched.getValidMovesBatch(game, boards, players)
+                    startChoosing = time.perf_counter()
+                    # a random valid action per game: an offset into the row's run of nonzero() entries
+                    rows, cols = np.nonzero(valids)
+                    counts = np.bincount(rows, minlength=size)
+                    actions = cols[np.minimum(np.cumsum(counts) - counts + (rng.random(size) * counts).astype(int),
+                                              len(cols) - 1)]
+                    choosing += time.perf_counter() - startChoosing
+                    boards, players = batched.getNextStates(game, boards, players, actions)
+                    ended = batched.getGameEndedBatch(game, boards, players) != 0
+                    boards[ended], players[ended] = init, 1
+                rates.append(size * opts.steps / (time.perf_counter() - start - choosing))
+            print(f'{name:>12} batch {size:5d}: loop {rates[0]:9.0f} steps/s  '
+                  f'batched {rates[1]:10.0f} steps/s  x{rates[1] / rates[0]:.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('mcts', help='dict vs array MCTS engine')
+    p.add_argument('--game', choices=GAMES, default='kirche6')
+    p.add_argument('--sims', type=int, default=400)
+    p.add_argument('--moves', type=int, default=5)
+    p.set_defaults(run=benchMCTS)
+
+    p = sub.add_parser('puct', help='scalar vs vectorized PUCT selection')
+    p.add_argument('--repeat', type=int, default=2000)
+    p.set_defaults(run=benchPUCT)
+
+    p = sub.add_parser('predict', help='eager vs compiled Keras inference latency (needs Keras)')
+    p.add_argument('--game', choices=GAMES, default='kirche6')
+    p.add_argument('--channels', type=int, default=64)
+    p.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32, 256])
+    p.add_argument('--calls', type=int, default=512, help='boards evaluated per measurement')
+    p.set_defaults(run=benchPredict)
+
+    p = sub.add_parser('batch', help='sequential vs batched leaf evaluation (needs Keras)')
+    p.add_argument('--game', choices=GAMES, default='kirche6')
+    p.add_argument('--sims', type=int, default=400)
+    p.add_argument('--channels', type=int, default=64)
+    p.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 16, 32])
+    p.set_defaults(run=benchBatch)
+
+    p = sub.add_parser('selfplay', help='self-play episodes/min vs worker count (needs Keras)')
+    p.add_argument('--game', choices=GAMES, default='kirche5')
+    p.add_argument('--episodes', type=int, default=16)
+    p.add_argument('--sims', type=int, default=25)
+    p.add_argument('--channels', type=int, default=64)
+    p.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    p.set_defaults(run=benchSelfPlay)
+
+    p = sub.add_parser('reuse', help='self-play game with and without tree reuse')
+    p.add_argument('--game', choices=GAMES, default='kirche6')
+    p.add_argument('--sims', type=int, default=400)
+    p.add_argument('--moves', type=int, default=40)
+    p.set_defaults(run=benchReuse)
+
+    p = sub.add_parser('memory', help='search tree memory with and without a budget')
+    p.add_argument('--game', choices=GAMES, default='kirche6')
+    p.add_argument('--sims', type=int, default=400)
+    p.add_argument('--moves', type=int, default=40)
+    p.add_argument('--max-mb', type=float, nargs='+', default=[0, 4, 1])
+    p.set_defaults(run=benchMemory)
+
+    p = sub.add_parser('cycles', help='depth cutoffs with and without cycle detection')
+    p.add_argument('--game', choices=GAMES, default='kirche6')
+    p.add_argument('--sims', type=int, default=400)
+    p.add_argument('--moves', type=int, default=40)
+    p.set_defaults(run=benchCycles)
+
+    p = sub.add_parser('evalcache', help='self-play with and without the evaluation cache (needs Keras)')
+    p.add_argument('--game', choices=GAMES, default='kirche5')
+    p.add_argument('--episodes', type=int, default=20)
+    p.add_argument('--sims', type=int, default=25)
+    p.add_argument('--channels', type=int, default=64)
+    p.add_argument('--cache-mb', type=int, nargs='+', default=[0, 64])
+    p.set_defaults(run=benchEvalCache)
+
+    p = sub.add_parser('replay', help='saving / resuming training examples, pickle vs replay buffer')
+    p.add_argument('--game', choices=GAMES, default='kirche5')
+    p.add_argument('--iters', type=int, default=20)
+    p.add_argument('--examples', type=int, default=5000, help='examples per iteration')
+    p.set_defaults(run=benchReplay)
+
+    p = sub.add_parser('examples', help='peak RSS of the training examples, lists vs ExampleStore')
+    p.add_argument('--game', choices=GAMES, default='kirche5')
+    p.add_argument('--iters', type=int, default=20)
+    p.add_argument('--examples', type=int, default=2000, help='examples per iteration')
+    p.set_defaults(run=benchExamples)
+
+    p = sub.add_parser('symmetries', help='examples stored in every symmetry vs random symmetries in training (needs Keras)')
+    p.add_argument('--game', choices=GAMES, default='tictactoe')
+    p.add_argument('--episodes', type=int, default=400)
+    p.add_argument('--sims', type=int, default=25)
+    p.add_argument('--channels', type=int, default=64)
+    p.add_argument('--epochs', type=int, default=4)
+    p.set_defaults(run=benchSymmetries)
+
+    p = sub.add_parser('train', help='training on arrays vs tf.data batches (needs Keras)')
+    p.add_argument('--game', choices=GAMES, default='kirche5')
+    p.add_argument('--iters', type=int, default=10)
+    p.add_argument('--examples', type=int, default=5000, help='examples per iteration')
+    p.add_argument('--channels', type=int, default=32)
+    p.add_argument('--epochs', type=int, default=2)
+    p.add_argument('--batch-size', type=int, default=64)
+    p.set_defaults(run=benchTrain)
+
+    p = sub.add_parser('movegen', help='Kirche move generation, tensor Board vs BitBoard')
+    p.add_argument('--n', type=int, default=6)
+    p.add_argument('--priests', type=int, default=2)
+    p.add_argument('--positions', type=int, default=2000)
+    p.set_defaults(run=benchMoveGen)
+
+    p = sub.add_parser('winlines', help='3D TicTacToe win check, nested loops vs win-line table')
+    p.add_argument('--sizes', type=int, nargs='+', default=[3, 4, 5])
+    p.add_argument('--positions', type=int, default=2000)
+    p.set_defaults(run=benchWinLines)
+
+    p = sub.add_parser('cubesym', help='3D TicTacToe symmetries, flip loop vs precomputed permutations')
+    p.add_argument('--sizes', type=int, nargs='+', default=[3, 4, 5])
+    p.add_argument('--positions', type=int, default=2000)
+    p.set_defaults(run=benchCubeSymmetries)
+
+    p = sub.add_parser('batchgame', help='stepping many games, looping fallback vs batched Game API')
+    p.add_argument('--games', choices=GAMES, nargs='+', default=['tictactoe', 'tictactoe3d', 'kirche6'])
+    p.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 64, 4096])
+    p.add_argument('--steps', type=int, default=20)
+    p.set_defaults(run=benchBatchedGames)
+
+    opts = parser.parse_args()
+    opts.run(opts)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,25 @@ from __future__ import print_function
 import sys
 sys.path.append('..')
 from Game import Game
-from .KircheLogic import Board
+from utils import xorKeys, zobristList, zobristTable
+from .KircheLogic import Board, BitBoard
 import numpy as np
 
 class KircheGame(Game):
     """
     Game class for 'Lass die Kirche im Dorf' (Refactored).
     Supports variable board size and number of priests.
+
+    Actions are encoded as src*n*n + dst ((n*n)**2 actions). With
+    compact_actions=True they are encoded as src*4 + direction instead
+    (n*n*4 actions), since every move is a one-step move in one of
+    Board.DIRECTIONS. Networks trained with one encoding can not be used
+    with the other.
     """
-    def __init__(self, n=6, num_priests=1):
+    def __init__(self, n=6, num_priests=1, compact_actions=False):
         self.n = n
         self.num_priests = num_priests
+        self.compact_actions = compact_actions
 
     def getInitBoard(self):
         b = Board(self.n)
@@ -45,17 +53,38 @@ class KircheGame(Game):
         return (self.n, self.n, 2)
 
     def getActionSize(self):
+        if self.compact_actions:
+            return self.n * self.n * 4
         return (self.n * self.n) ** 2
 
-    def getNextState(self, board, player, action):
+    def encodeAction(self, start, end):
+        """
+        Returns the action index of the move start -> end, both (x, y)
+        squares.
+        """
         n = self.n
-        src = action // (n * n)
-        dst = action % (n * n)
-        
-        start_x, start_y = src // n, src % n
-        end_x, end_y = dst // n, dst % n
-        
-        move = ((start_x, start_y), (end_x, end_y))
+        src = start[0] * n + start[1]
+        if self.compact_actions:
+            direction = Board.DIRECTIONS.index((end[0] - start[0], end[1] - start[1]))
+            return src * 4 + direction
+        return src * (n * n) + end[0] * n + end[1]
+
+    def decodeAction(self, action):
+        """
+        Returns the move ((start_x, start_y), (end_x, end_y)) of an action
+        index.
+        """
+        n = self.n
+        if self.compact_actions:
+            src, direction = divmod(int(action), 4)
+            start_x, start_y = divmod(src, n)
+            dx, dy = Board.DIRECTIONS[direction]
+            return ((start_x, start_y), (start_x + dx, start_y + dy))
+        src, dst = divmod(int(action), n * n)
+        return (divmod(src, n), divmod(dst, n))
+
+    def getNextState(self, board, player, action):
+        move = self.decodeAction(action)
         
         b = Board(self.n)
         b.state = np.copy(board)
@@ -64,33 +93,21 @@ class KircheGame(Game):
         return (b.state, -player)
 
     def getValidMoves(self, board, player):
-        b = Board(self.n)
-        b.state = np.copy(board)
-        legalMoves = b.get_legal_moves(player)
-        
-        valids = [0] * self.getActionSize()
-        
-        if len(legalMoves) == 0:
-            return np.array(valids)
-            
-        for (start, end) in legalMoves:
-            start_idx = start[0] * self.n + start[1]
-            end_idx = end[0] * self.n + end[1]
-            action_idx = start_idx * (self.n * self.n) + end_idx
-            valids[action_idx] = 1
-            
-        return np.array(valids)
+        # move generation runs on the bitboard form (see KircheLogic.BitBoard)
+        b = BitBoard.from_tensor(board)
+        valids = np.zeros(self.getActionSize(), dtype=int)
+        valids[b.get_legal_actions(player, compact=self.compact_actions)] = 1
+        return valids
 
     def getGameEnded(self, board, player):
-        b = Board(self.n)
-        b.state = np.copy(board)
+        b = BitBoard.from_tensor(board)
 
         if b.is_win(player):
             return 1
         if b.is_win(-player):
             return -1
             
-        if len(b.get_legal_moves(player)) == 0:
+        if not b.has_legal_moves(player):
             return -1 
             
         return 0
@@ -113,6 +130,92 @@ class KircheGame(Game):
         
         return ret
 
+    def movableSquares(self, boards, players):
+        """
+        Returns a (B, 4, n, n) boolean array, [i, d, x, y] True if the piece
+        on (x, y) of boards[i] belongs to players[i] and can make a one-step
+        move in Board.DIRECTIONS[d].
+        """
+        owner, kind = boards[..., 0], boards[..., 1]
+        own = owner == np.asarray(players).reshape(-1, 1, 1)
+        empty = owner == 0
+        vertical = own & (kind != Board.HORIZONTAL)  # vertical houses and priests
+        horizontal = own & (kind != Board.VERTICAL)
+        movable = np.zeros((len(boards), 4) + owner.shape[1:], dtype=bool)
+        movable[:, 0, :-1] = vertical[:, :-1] & empty[:, 1:]  # (1, 0)
+        movable[:, 1, 1:] = vertical[:, 1:] & empty[:, :-1]  # (-1, 0)
+        movable[:, 2, :, :-1] = horizontal[:, :, :-1] & empty[:, :, 1:]  # (0, 1)
+        movable[:, 3, :, 1:] = horizontal[:, :, 1:] & empty[:, :, :-1]  # (0, -1)
+        return movable
+
+    def getNextStates(self, boards, players, actions):
+        boards, actions = np.asarray(boards), np.asarray(actions)
+        nn = self.n * self.n
+        if self.compact_actions:
+            src, direction = np.divmod(actions, 4)
+            dst = src + np.array([dx * self.n + dy for dx, dy in Board.DIRECTIONS])[direction]
+        else:
+            src, dst = np.divmod(actions, nn)
+        rows = np.arange(len(boards))
+        flat = boards.reshape(len(boards), nn, 2).copy()
+        owner, kind = flat[rows, src, 0], flat[rows, src, 1]
+        flat[rows, src] = 0
+        flat[rows, dst, 0] = owner
+        # houses turn when they move, priests do not (see Board.execute_move)
+        flat[rows, dst, 1] = np.where(kind == Board.PRIEST, Board.PRIEST, 1 - kind)
+        return flat.reshape(boards.shape), -np.asarray(players)
+
+    def getValidMovesBatch(self, boards, players):
+        nn = self.n * self.n
+        movable = self.movableSquares(np.asarray(boards), players).reshape(len(boards), 4, nn)
+        if self.compact_actions:
+            return movable.transpose(0, 2, 1).reshape(len(boards), nn * 4).astype(int)
+        valids = np.zeros((len(boards), nn, nn), dtype=int)
+        rows, direction, src = np.nonzero(movable)
+        valids[rows, src, src + np.array([dx * self.n + dy for dx, dy in Board.DIRECTIONS])[direction]] = 1
+        return valids.reshape(len(boards), nn * nn)
+
+    def getGameEndedBatch(self, boards, players):
+        boards, players = np.asarray(boards), np.asarray(players)
+        # P1 wins on row n-1, P2 on row 0 (see Board.is_win)
+        wins1, wins2 = (boards[:, -1, :, 0] == 1).any(axis=1), (boards[:, 0, :, 0] == -1).any(axis=1)
+        won, lost = np.where(players == 1, wins1, wins2), np.where(players == 1, wins2, wins1)
+        stuck = ~self.movableSquares(boards, players).any(axis=(1, 2, 3))
+        return np.where(won, 1, np.where(lost | stuck, -1, 0)).astype(float)
+
+    def getCanonicalFormBatch(self, boards, players):
+        boards = np.asarray(boards)
+        flip = np.asarray(players) == -1
+        canonical = boards.copy()
+        flipped = boards[flip][:, ::-1, ::-1].copy()
+        flipped[..., 0] *= -1
+        canonical[flip] = flipped
+        return canonical
+
+    def getZobristKeys(self, board):
+        # table[square, owner, type] with owner 0 for player 1 and 1 for player -1.
+        # The flipped key is the key of the canonical form for player -1: colors
+        # swapped and the board rotated by 180 degrees, i.e. square -> n*n-1-square
+        table = zobristTable((self.n * self.n, 2, 3))
+        owner, kind = board[:, :, 0].ravel(), board[:, :, 1].ravel()
+        squares = np.flatnonzero(owner)
+        side = (owner[squares] == -1).astype(int)
+        kind = kind[squares]
+        return (xorKeys(table[squares, side, kind]),
+                xorKeys(table[self.n * self.n - 1 - squares, 1 - side, kind]))
+
+    def getNextZobristKeys(self, board, player, action, keys):
+        (start_x, start_y), (end_x, end_y) = self.decodeAction(action)
+        table = zobristList((self.n * self.n, 2, 3))
+        last = self.n * self.n - 1
+        start, end = start_x * self.n + start_y, end_x * self.n + end_y
+        owner, kind = board[start_x, start_y].tolist()
+        side = 0 if owner == 1 else 1
+        # houses turn when they move, see Board.execute_move
+        new_kind = kind if kind == Board.PRIEST else 1 - kind
+        return (keys[0] ^ table[start][side][kind] ^ table[end][side][new_kind],
+                keys[1] ^ table[last - start][1 - side][kind] ^ table[last - end][1 - side][new_kind])
+
     def getSymmetries(self, board, pi):
         # Since we use 180 rotation for canonical form, 
         # let's include rotational symmetries if the game supports it.
@@ -1,4 +1,6 @@
 
+import functools
+
 import numpy as np
 
 class Board():
@@ -19,6 +21,10 @@ class Board():
     HORIZONTAL = 1
     PRIEST = 2
 
+    # One-step move directions as (dx, dy); the index is the direction part
+    # of the compact action encoding (see KircheGame.encodeAction)
+    DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+
     def __init__(self, n=6):
         self.n = n
         # tensor of shape (n, n, 2)
@@ -98,3 +104,162 @@ class Board():
             for y in range(self.n):
                if self.state[0][y][0] == -1: return True
         return False
+
+
+
+class BitBoard():
+    """
+    Bitboard form of the Kirche board, with the same rules as Board.
+
+    Square (x, y) is bit x*n + y of every mask (the same index the actions
+    use for squares). The board is held as Python ints:
+    - own[1], own[-1]: squares owned by player 1 / -1
+    - vertical, horizontal, priest: squares holding a piece of that type
+
+    Moves are generated for all pieces of a direction at once by shifting
+    the movers by one square and AND-ing with the empty squares. A player
+    wins when one of its pieces is on the opposite edge, a single AND with
+    the edge row mask.
+    """
+
+    def __init__(self, n=6):
+        self.n = n
+        self.own = {1: 0, -1: 0}
+        self.vertical = 0
+        self.horizontal = 0
+        self.priest = 0
+        self.full, self.first_row, self.last_row, self.shifts, self.bit_values = self.geometry(n)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def geometry(n):
+        """Masks that only depend on the board size, computed once per n."""
+        full = (1 << (n * n)) - 1
+        first_row = (1 << n) - 1  # x == 0
+        last_row = first_row << (n * (n - 1))  # x == n-1
+        first_col = sum(1 << (x * n) for x in range(n))  # y == 0
+        last_col = first_col << (n - 1)  # y == n-1
+        # (shift, squares a piece may not move from) per direction (dx, dy),
+        # in the order of Board.DIRECTIONS
+        shifts = (
+            ((1, 0), n, last_row),
+            ((-1, 0), -n, first_row),
+            ((0, 1), 1, last_col),
+            ((0, -1), -1, first_col),
+        )
+        # value of every square's bit, for packing boards that fit in 64 bits
+        bit_values = np.left_shift(np.uint64(1), np.arange(n * n, dtype=np.uint64)) if n * n <= 64 else None
+        return full, first_row, last_row, shifts, bit_values
+
+    # one row per square code owner*3 + type + 3, giving its bit in
+    # (own[1], own[-1], vertical, horizontal, priest)
+    SQUARE_MASKS = np.array([
+        [0, 1, 1, 0, 0], [0, 1, 0, 1, 0], [0, 1, 0, 0, 1],  # owner -1
+        [0, 0, 0, 0, 0], [0, 0, 0, 0, 0], [0, 0, 0, 0, 0],  # empty
+        [1, 0, 1, 0, 0], [1, 0, 0, 1, 0], [1, 0, 0, 0, 1],  # owner 1
+    ], dtype=np.uint64)
+
+    @classmethod
+    def from_tensor(cls, state):
+        """Builds the bitboard of an (n, n, 2) Board.state tensor."""
+        n = state.shape[0]
+        b = cls(n)
+        codes = (state[:, :, 0] * 3 + state[:, :, 1] + 3).ravel()
+        if n * n <= 64:
+            # one uint64 matrix product packs all five masks
+            masks = (b.bit_values @ cls.SQUARE_MASKS[codes]).tolist()
+        else:
+            packed = np.packbits(cls.SQUARE_MASKS[codes].T.astype(bool), axis=1, bitorder='little')
+            masks = [int.from_bytes(row.tobytes(), 'little') for row in packed]
+        b.own[1], b.own[-1], b.vertical, b.horizontal, b.priest = masks
+        return b
+
+    def to_tensor(self):
+        """Returns the (n, n, 2) Board.state tensor (the network input)."""
+        n = self.n
+        nbytes = (n * n + 7) // 8
+
+        def unpack(mask):
+            return np.unpackbits(np.frombuffer(mask.to_bytes(nbytes, 'little'), dtype=np.uint8),
+                                 bitorder='little')[:n * n].astype(bool)
+
+        state = np.zeros((n * n, 2), dtype=int)
+        state[unpack(self.own[1]), 0] = 1
+        state[unpack(self.own[-1]), 0] = -1
+        state[unpack(self.horizontal), 1] = Board.HORIZONTAL
+        state[unpack(self.priest), 1] = Board.PRIEST
+        return state.reshape(n, n, 2)
+
+    def targets(self, color):
+        """
+        Yields (dx, dy, dst) for every direction, where dst is the mask of the
+        squares the pieces of color can reach with a one-step move in it.
+        """
+        own = self.own[color]
+        empty = self.full & ~(self.own[1] | self.own[-1])
+        vertical = own & (self.vertical | self.priest)
+        horizontal = own & (self.horizontal | self.priest)
+        for (dx, dy), shift, edge in self.shifts:
+            movers = (vertical if dx else horizontal) & ~edge
+            dst = (movers << shift if shift > 0 else movers >> -shift) & empty
+            if dst:
+                yield dx, dy, dst
+
+    def get_legal_moves(self, color):
+        n = self.n
+        moves = []
+        for dx, dy, dst in self.targets(color):
+            while dst:
+                low = dst & -dst
+                i = low.bit_length() - 1
+                x, y = divmod(i, n)
+                moves.append(((x - dx, y - dy), (x, y)))
+                dst ^= low
+        return moves
+
+    def get_legal_actions(self, color, compact=False):
+        """
+        Returns the legal moves as action indices src*n*n + dst, or
+        src*4 + direction with compact (see KircheGame.encodeAction).
+        """
+        nn = self.n * self.n
+        actions = []
+        for dx, dy, dst in self.targets(color):
+            delta = dx * self.n + dy
+            direction = Board.DIRECTIONS.index((dx, dy))
+            while dst:
+                low = dst & -dst
+                i = low.bit_length() - 1
+                if compact:
+                    actions.append((i - delta) * 4 + direction)
+                else:
+                    actions.append((i - delta) * nn + i)
+                dst ^= low
+        return actions
+
+    def has_legal_moves(self, color):
+        return any(True for _ in self.targets(color))
+
+    def execute_move(self, move, color):
+        (start_x, start_y), (end_x, end_y) = move
+        src = 1 << (start_x * self.n + start_y)
+        dst = 1 << (end_x * self.n + end_y)
+
+        for c in (1, -1):
+            if self.own[c] & src:
+                self.own[c] ^= src | dst
+        if self.priest & src:
+            # Priest doesn't rotate
+            self.priest ^= src | dst
+        elif self.vertical & src:
+            # Houses rotate
+            self.vertical ^= src
+            self.horizontal |= dst
+        elif self.horizontal & src:
+            self.horizontal ^= src
+            self.vertical |= dst
+
+    def is_win(self, color):
+        # P1 wins on row n-1, P2 on row 0 (see Board.is_win)
+        edge = self.last_row if color == 1 else self.first_row
+        return (self.own[color] & edge) != 0
@@ -40,9 +40,7 @@ class GreedyKirchePlayer():
             # Simple heuristic:
             # Score = Advancement.
             # Convert action to src, dst
-            n = self.game.n
-            dst = a % (n * n)
-            dst_r = dst // n 
+            (src_r, src_c), (dst_r, dst_c) = self.game.decodeAction(a)
             # As P1 (1), we want to maximize Row index (reach N-1)
             
             score = dst_r 
@@ -18,12 +18,30 @@ args = dotdict({
     'numMCTSSims': 25,          # Number of games moves for MCTS to simulate.
     'arenaCompare': 40,         # Number of games to play during arena play to determine if new net will be accepted.
     'cpuct': 1,
+    'mctsReuseTree': False,     # Keep the subtree of the played move between moves and free the rest of the tree.
+    'mctsMaxNodes': 0,          # Prune the least visited nodes of a search tree above this many nodes (0 = no limit).
+    'mctsMaxMB': 0,             # Prune the least visited nodes of a search tree above this estimated size (0 = no limit).
+    'mctsMaxDepth': 50,         # Simulations deeper than this stop and back up 0.
+    'mctsDetectCycles': True,   # Simulations that repeat a position of their path stop and back up 0 (a draw).
 
     'checkpoint': './temp/',
     'load_model': False,
     'load_folder_file': ('/dev/models/8x100x50','best.pth.tar'),
     'numItersForTrainExamplesHistory': 20,
+    'examplePolicyDtype': 'float32',  # dtype of the training policies in memory ('float16' halves their size).
+    'streamExamples': False,    # Train on batches read from the replay buffer instead of loading all examples (Keras nets).
+    'storeSymmetries': True,    # Store every position in all its symmetries; False for a network with augment on.
 
+    'numSelfPlayWorkers': 1,    # Number of worker processes for self-play (1 = play in this process).
+    'numArenaWorkers': 1,       # Number of worker processes for the arena games against the previous network.
+    'arenaSPRT': False,         # Stop the arena early once a sequential probability ratio test decides accept/reject.
+    'sprtMargin': 0.1,          # SPRT tests updateThreshold - sprtMargin against updateThreshold + sprtMargin.
+    'sprtAlpha': 0.05,          # SPRT probability of accepting a network at the lower win rate.
+    'sprtBeta': 0.05,           # SPRT probability of rejecting a network at the upper win rate.
+    'seed': None,               # Seed for self-play episodes; makes the examples independent of numSelfPlayWorkers.
+    'asyncPipeline': False,     # Overlap self-play actors, training and arena gating in separate processes.
+    'asyncEpisodesPerUpdate': 100,  # With asyncPipeline, new episodes between two trainings of the network.
+    'evalCacheMB': 0,           # Size of the network evaluation cache shared by the episodes of an iteration (0 = off).
 })
 
 def main():
@@ -1,11 +1,13 @@
 import pygame
 import numpy as np
+import os
 import sys
 import time
 from utils import *
-from MCTS import MCTS
+from CachedNNet import cacheNNet
+from MCTS import makeMCTS
+from NumpyNNet import NumpyNNet
 from kirche.KircheGame import KircheGame
-from kirche.keras.NNet import NNetWrapper as NNet
 
 # --- Constants ---
 SCREEN_WIDTH = 800
@@ -27,11 +29,12 @@ class DummyNNet():
 # --- Configuration ---
 # --- Configuration ---
 class VariantConfig:
-    def __init__(self, name, n, priests, checkpoint_dir):
+    def __init__(self, name, n, priests, checkpoint_dir, compact_actions=False):
         self.name = name
         self.n = n
         self.priests = priests
         self.checkpoint_dir = checkpoint_dir
+        self.compact_actions = compact_actions # action encoding the model was trained with
 
 class DifficultyConfig:
     def __init__(self, name, sims):
@@ -50,6 +53,17 @@ DIFFICULTIES = [
     DifficultyConfig("Hard (400 Sims)", 400),
 ]
 
+def load_nnet(game, checkpoint_dir):
+    """
+    Network to load the checkpoints of checkpoint_dir into: a NumpyNNet if
+    they were exported with NumpyNNet.py (no TensorFlow import), the Keras
+    NNetWrapper otherwise.
+    """
+    if any(os.path.exists(os.path.join(checkpoint_dir, f)) for f in ('best.npz', 'temp.npz')):
+        return NumpyNNet()
+    from kirche.keras.NNet import NNetWrapper as NNet
+    return NNet(game)
+
 def draw_text(screen, text, size, x, y, color=(0, 0, 0)):
     font = pygame.font.SysFont("Arial", size)
     img = font.render(text, True, color)
@@ -239,7 +253,7 @@ def main():
     # 4. Setup Game
     n = variant_cfg.n
     cell_size = SCREEN_WIDTH // n
-    game = KircheGame(n=n, num_priests=variant_cfg.priests)
+    game = KircheGame(n=n, num_priests=variant_cfg.priests, compact_actions=variant_cfg.compact_actions)
     board = game.getInitBoard()
     
     # 5. Load Model / Setup AI (Only if PVE)
@@ -248,7 +262,7 @@ def main():
         if variant_cfg.checkpoint_dir:
             try:
                 print(f"Loading model from {variant_cfg.checkpoint_dir}...")
-                nnet = NNet(game)
+                nnet = load_nnet(game, variant_cfg.checkpoint_dir)
                 try:
                     nnet.load_checkpoint(variant_cfg.checkpoint_dir, 'best.pth.tar')
                 except:
@@ -261,8 +275,9 @@ def main():
             print("No checkpoint configured. Using Dummy AI.")
             nnet = DummyNNet(game)
 
-        args = dotdict({'numMCTSSims': diff_cfg.sims, 'cpuct': 1.0})
-        mcts = MCTS(game, nnet, args)
+        args = dotdict({'numMCTSSims': diff_cfg.sims, 'cpuct': 1.0, 'mctsEngine': 'array', 'mctsReuseTree': True,
+                        'mctsMaxMB': 256, 'evalCacheMB': 64})
+        mcts = makeMCTS(game, cacheNNet(nnet, args), args)
 
     player = 1
     selected_piece = None
@@ -294,20 +309,14 @@ def main():
             # Transform action back to real coordinates
             if player == -1:
                 # Decode
-                n = game.n
-                src_idx = action // (n * n)
-                dst_idx = action % (n * n)
-                src_r, src_c = src_idx // n, src_idx % n
-                dst_r, dst_c = dst_idx // n, dst_idx % n
+                (src_r, src_c), (dst_r, dst_c) = game.decodeAction(action)
                 
                 # Rotate 180 (Invert)
                 real_src_r, real_src_c = n - 1 - src_r, n - 1 - src_c
                 real_dst_r, real_dst_c = n - 1 - dst_r, n - 1 - dst_c
                 
                 # Encode
-                real_src_idx = real_src_r * n + real_src_c
-                real_dst_idx = real_dst_r * n + real_dst_c
-                action = real_src_idx * (n * n) + real_dst_idx
+                action = game.encodeAction((real_src_r, real_src_c), (real_dst_r, real_dst_c))
 
             board, player = game.getNextState(board, player, action)
             print("AI moved.")
@@ -363,10 +372,7 @@ def main():
                         if v:
                             # Canonical Action -> Real Action
                             # Canonical Src/Dst
-                            can_src = idx // (n*n)
-                            can_dst = idx % (n*n)
-                            can_src_r, can_src_c = can_src // n, can_src % n
-                            can_dst_r, can_dst_c = can_dst // n, can_dst % n
+                            (can_src_r, can_src_c), (can_dst_r, can_dst_c) = game.decodeAction(idx)
                             
                             if player == 1:
                                 real_src_r, real_src_c = can_src_r, can_src_c
@@ -395,9 +401,11 @@ def main():
                                 # "action takes int value of (x1,y1) -> (x2,y2)"
                                 # "action is size n*n*n*n"
                                 
-                                # If getNextState expects the action index corresponding to the canonical board...
-                                # Then `idx` is correct.
-                                legal_moves_map[(real_dst_r, real_dst_c)] = idx
+                                # getNextState executes the move on the board it is given,
+                                # i.e. the real board here, so store the real action
+                                # (for player 1 it is the same as `idx`).
+                                legal_moves_map[(real_dst_r, real_dst_c)] = game.encodeAction(
+                                    (real_src_r, real_src_c), (real_dst_r, real_dst_c))
                                 
 
                 # B: Move to valid dest
@@ -0,0 +1,973 @@
+"""
+Consistency tests for the alternative search and game engines. Every fast
+path is checked against the reference implementation it replaces, using a
+deterministic NumPy stand-in for the neural network so the tests do not need
+Keras. Only the check of the NumPy export against real Keras networks needs
+it, and is skipped without it.
+"""
+
+import importlib
+import importlib.util
+import math
+import multiprocessing
+import os
+import pickle
+import tempfile
+import unittest
+import zlib
+from collections import deque
+
+import numpy as np
+
+from Arena import SPRT, Arena
+from CachedNNet import CachedNNet
+from Coach import Coach
+from ExampleStore import ExampleBatches, ExampleStore, randomSymmetries, symmetryCount, unpackExamples
+from Game import Game
+from MCTS import MCTS, ArrayMCTS, makeMCTS
+from NumpyNNet import NumpyNNet, exportWeights, im2col
+from QuantizedNNet import compareOutputs, quantize
+from ReplayBuffer import ReplayBuffer
+from kirche.KircheGame import KircheGame
+from kirche.KircheLogic import Board, BitBoard
+from tictactoe.TicTacToeGame import TicTacToeGame
+from tictactoe_3d.TicTacToeGame import TicTacToeGame as TicTacToe3DGame
+from tictactoe_3d.TicTacToeLogic import Board as Board3D
+from utils import *
+
+
+class HashNNet():
+    """Deterministic pseudo-random policy and value derived from the board bytes."""
+
+    def __init__(self, game):
+        self.action_size = game.getActionSize()
+
+    def predict(self, board):
+        rng = np.random.default_rng(zlib.crc32(np.ascontiguousarray(board).tobytes()))
+        pi = rng.random(self.action_size)
+        return pi / pi.sum(), rng.uniform(-1, 1)
+
+
+class CheckpointNNet(HashNNet):
+    """HashNNet with the training and checkpoint interface of a NeuralNet: its
+    weights are a version number, incremented by train, in a small file."""
+
+    def __init__(self, game):
+        super().__init__(game)
+        self.version = 0
+
+    def train(self, examples):
+        self.version += 1
+
+    def save_checkpoint(self, folder, filename):
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, filename.split('.')[0] + '.version'), 'w') as f:
+            f.write(str(self.version))
+
+    def load_checkpoint(self, folder, filename):
+        with open(os.path.join(folder, filename.split('.')[0] + '.version')) as f:
+            self.version = int(f.read())
+
+
+class BrokenCandidateNNet(CheckpointNNet):
+    """A CheckpointNNet that cannot load candidate checkpoints, which kills the evaluator of learnAsync."""
+
+    def load_checkpoint(self, folder, filename):
+        if filename.startswith('candidate'):
+            raise OSError(f'cannot read {filename}')
+        super().load_checkpoint(folder, filename)
+
+
+class BrokenTrainingNNet(CheckpointNNet):
+    """A CheckpointNNet whose second training fails."""
+
+    def train(self, examples):
+        super().train(examples)
+        if self.version == 2:
+            raise ValueError('training failed')
+
+
+class DuelGame(Game):
+    """
+    Both players pick a number from 0 to 2 and the higher one wins, equal
+    picks are a draw. Slot 0 of the board holds player 1's pick + 1, slot 1
+    player -1's.
+    """
+
+    def getInitBoard(self):
+        return np.zeros(2)
+
+    def getBoardSize(self):
+        return (2,)
+
+    def getActionSize(self):
+        return 3
+
+    def getNextState(self, board, player, action):
+        board = board.copy()
+        board[(1 - player) // 2] = action + 1
+        return board, -player
+
+    def getValidMoves(self, board, player):
+        return np.ones(3)
+
+    def getGameEnded(self, board, player):
+        if not board.all():
+            return 0
+        if board[0] == board[1]:
+            return 1e-4
+        return player if board[0] > board[1] else -player
+
+    def getCanonicalForm(self, board, player):
+        return board if player == 1 else board[::-1]
+
+    def stringRepresentation(self, board):
+        return board.tobytes()
+
+
+class ScriptedPlayer():
+    """A DuelGame player that picks first if it starts the game and second otherwise."""
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+    def __call__(self, board):
+        return self.second if board.any() else self.first
+
+
+def playSelfPlayGame(game, mcts, seed, maxMoves=40):
+    """Plays one game with mcts on both sides and returns the policies it produced."""
+    np.random.seed(seed)
+    # the game is played on the canonical board, Kirche's canonical form rotates the board
+    canonicalBoard = game.getInitBoard()
+    policies = []
+    for step in range(maxMoves):
+        if game.getGameEnded(canonicalBoard, 1) != 0:
+            break
+        pi = mcts.getActionProb(canonicalBoard, temp=int(step < 4))
+        policies.append(pi)
+        action = np.random.choice(len(pi), p=pi)
+        board, player = game.getNextState(canonicalBoard, 1, action)
+        canonicalBoard = game.getCanonicalForm(board, player)
+    return policies
+
+
+class TestSearchEngines(unittest.TestCase):
+
+    GAMES = [
+        lambda: TicTacToeGame(),
+        lambda: TicTacToe3DGame(3),
+        lambda: KircheGame(5, 1),
+        lambda: KircheGame(6, 2),
+    ]
+
+    def assertSameGames(self, engine, args):
+        for makeGame in self.GAMES:
+            game = makeGame()
+            expected = playSelfPlayGame(game, MCTS(game, HashNNet(game), args), seed=7)
+            actual = playSelfPlayGame(game, engine(game, HashNNet(game), args), seed=7)
+            self.assertEqual(len(expected), len(actual))
+            for p, q in zip(expected, actual):
+                np.testing.assert_array_equal(p, q)
+
+    def test_array_engine_matches_dict_engine(self):
+        self.assertSameGames(ArrayMCTS, dotdict({'numMCTSSims': 30, 'cpuct': 1.0}))
+
+    def test_cycles_stop_simulations(self):
+        args = dotdict({'numMCTSSims': 100, 'cpuct': 1.0})
+        game = KircheGame(5, 1)
+        engines = [MCTS(game, HashNNet(game), args), ArrayMCTS(game, HashNNet(game), args)]
+        for mcts in engines:
+            playSelfPlayGame(game, mcts, seed=3)
+        self.assertGreater(engines[0].cycles, 0)
+        self.assertEqual(engines[0].cycles, engines[1].cycles)
+        self.assertEqual(engines[0].depthCutoffs, engines[1].depthCutoffs)
+
+    def test_batched_search_spends_all_simulations(self):
+        args = dotdict({'numMCTSSims': 50, 'cpuct': 1.0, 'mctsBatchSize': 8, 'virtualLoss': 1.0})
+        for makeGame in self.GAMES:
+            game = makeGame()
+            mcts = ArrayMCTS(game, HashNNet(game), args)
+            board = game.getInitBoard()
+            pi = np.asarray(mcts.getActionProb(board, temp=1))
+            root = mcts.getNode(board)
+            # the first simulation only expands the root, as in sequential search
+            self.assertEqual(mcts.Nsa[root].sum(), args.numMCTSSims - 1)
+            self.assertAlmostEqual(pi.sum(), 1.0)
+            self.assertTrue(np.all(pi[game.getValidMoves(board, 1) == 0] == 0))
+            self.assertFalse(mcts.inFlight)
+
+    def test_tree_reuse(self):
+        args = dotdict({'numMCTSSims': 40, 'cpuct': 1.0, 'mctsReuseTree': True})
+        game = KircheGame(5, 1)
+        mcts = makeMCTS(game, HashNNet(game), args)
+        np.random.seed(0)
+        board = game.getInitBoard()
+        for _ in range(20):
+            if game.getGameEnded(board, 1) != 0:
+                break
+            pi = mcts.getActionProb(board, temp=1)
+            # the visits the root had before count towards numMCTSSims
+            self.assertGreaterEqual(mcts.Ns[0], args.numMCTSSims - 1)
+            action = np.random.choice(len(pi), p=pi)
+            child = mcts.children[0][list(mcts.actions[0]).index(action)]
+            visits, edgeVisits = mcts.Ns[child], mcts.Nsa[child]
+            next_board, next_player = game.getNextState(board, 1, action)
+            board = game.getCanonicalForm(next_board, next_player)
+
+            root = mcts.reuseTree(mcts.getNode(board))
+            self.assertEqual(mcts.Ns[root], visits)
+            if edgeVisits is not None:
+                np.testing.assert_array_equal(mcts.Nsa[root], edgeVisits)
+            # only the subtree of the new root is left
+            reached = {int(c) for children in mcts.children if children is not None for c in children if c >= 0}
+            self.assertEqual(reached | {root}, set(range(len(mcts.boards))))
+            self.assertEqual(sorted(mcts.nodes.values()), list(range(len(mcts.boards))))
+
+    def test_tree_budget(self):
+        game = KircheGame(6, 2)
+        board = game.getInitBoard()
+        for budget in ({'mctsMaxNodes': 60}, {'mctsMaxMB': 0.1}):
+            for engine in (MCTS, ArrayMCTS):
+                args = dotdict({'numMCTSSims': 300, 'cpuct': 1.0}, **budget)
+                mcts = engine(game, HashNNet(game), args)
+                pi = np.asarray(mcts.getActionProb(board, temp=1))
+                nodes, size = mcts.memoryUsage()
+                self.assertEqual(size, mcts.bytes)
+                self.assertLessEqual(nodes, budget.get('mctsMaxNodes', nodes))
+                self.assertLessEqual(size, budget.get('mctsMaxMB', 1) * 2**20)
+                self.assertAlmostEqual(pi.sum(), 1.0)
+                self.assertTrue(np.all(pi[game.getValidMoves(board, 1) == 0] == 0))
+
+    def test_zobrist_keys(self):
+        for makeGame in self.GAMES + [lambda: KircheGame(5, 1, compact_actions=True)]:
+            game = makeGame()
+            rng = np.random.default_rng(0)
+            for _ in range(10):
+                board, player = game.getInitBoard(), 1
+                keys = game.getZobristKeys(board)
+                while game.getGameEnded(board, player) == 0:
+                    self.assertEqual(keys, game.getZobristKeys(board))
+                    self.assertEqual(keys[::-1], game.getZobristKeys(game.getCanonicalForm(board, -1)))
+                    action = rng.choice(np.flatnonzero(game.getValidMoves(board, player)))
+                    keys = game.getNextZobristKeys(board, player, action, keys)
+                    board, player = game.getNextState(board, player, action)
+        # the tables are keyed differently but hold the same tree
+        args = dotdict({'numMCTSSims': 30, 'cpuct': 1.0, 'zobristCheck': True})
+        self.assertSameGames(MCTS, args)
+        self.assertSameGames(ArrayMCTS, args)
+        self.assertSameGames(ArrayMCTS, dotdict(args, zobrist=False))
+
+
+class TestCachedNNet(unittest.TestCase):
+
+    def test_hits_eviction_and_invalidation(self):
+        game = TicTacToeGame()
+        nnet = HashNNet(game)
+        boards = [game.getInitBoard()]
+        for a in range(4):
+            boards.append(game.getNextState(boards[-1], 1, a)[0])
+        cached = CachedNNet(nnet, maxBytes=10 ** 6)
+        for board in boards + boards:
+            pi, v = cached.predict(board)
+            np.testing.assert_array_equal(pi, nnet.predict(board)[0])
+        self.assertEqual((cached.hits, cached.misses), (5, 5))
+
+        batch = boards[3:] + [game.getNextState(boards[-1], 1, 4)[0]]
+        pis, vs = cached.predict_batch(np.stack(batch))
+        self.assertEqual((cached.hits, cached.misses), (7, 6))
+        np.testing.assert_array_equal(vs, [nnet.predict(b)[1] for b in batch])
+
+        # a board repeated within a batch is evaluated and stored once
+        fresh = CachedNNet(nnet, maxBytes=10 ** 6)
+        pis, vs = fresh.predict_batch(np.stack([boards[1], boards[2], boards[1]]))
+        np.testing.assert_array_equal(pis[2], pis[0])
+        self.assertEqual((fresh.hits, fresh.misses, len(fresh.cache)), (1, 2, 2))
+        single = CachedNNet(nnet, maxBytes=10 ** 6)
+        for board in boards[1:3]:
+            single.predict(board)
+        self.assertEqual(fresh.bytes, single.bytes)
+        # storing a key again replaces its entry and its size
+        key, (pi, v) = fresh.lookup(boards[1])
+        fresh.store(key, pi, v)
+        self.assertEqual((len(fresh.cache), fresh.bytes), (2, single.bytes))
+
+        # room for two entries: the least recently used ones go first
+        entryBytes = cached.bytes // len(cached.cache)
+        small = CachedNNet(nnet, maxBytes=2 * entryBytes)
+        for board in boards[:3]:
+            small.predict(board)
+        self.assertEqual(len(small.cache), 2)
+        small.predict(boards[2])
+        small.predict(boards[0])
+        self.assertEqual((small.hits, small.misses), (1, 4))
+
+        nnet.train = lambda examples: None
+        cached.train([])
+        self.assertEqual((len(cached.cache), cached.bytes), (0, 0))
+
+    def test_search_is_unchanged(self):
+        args = dotdict({'numMCTSSims': 30, 'cpuct': 1.0})
+        game = KircheGame(5, 1)
+        cached = CachedNNet(HashNNet(game))
+        expected = playSelfPlayGame(game, MCTS(game, HashNNet(game), args), seed=7)
+        for _ in range(2):
+            actual = playSelfPlayGame(game, MCTS(game, cached, args), seed=7)
+            for p, q in zip(expected, actual):
+                np.testing.assert_array_equal(p, q)
+        self.assertGreater(cached.hitRate(), 0.4)
+
+
+class TestSelfPlayWorkers(unittest.TestCase):
+
+    def test_examples_do_not_depend_on_workers(self):
+        game = TicTacToeGame()
+        with tempfile.TemporaryDirectory() as folder:
+            episodes = []
+            for workers in (1, 2):
+                args = dotdict({'numEps': 4, 'tempThreshold': 15, 'numMCTSSims': 10, 'cpuct': 1,
+                                'checkpoint': folder, 'seed': 3, 'numSelfPlayWorkers': workers})
+                coach = Coach(game, CheckpointNNet(game), args)
+                try:
+                    episodes.append(list(coach.selfPlay(1)))
+                finally:
+                    coach.closeSelfPlayPool()
+            # the workers get the weights without touching best.pth.tar
+            self.assertEqual(sorted(os.listdir(folder)), ['selfplay.version'])
+
+            # abandoning the episodes terminates the pool
+            coach = Coach(game, CheckpointNNet(game), args)
+            selfPlay = coach.selfPlay(1)
+            next(selfPlay)
+            self.assertIsNotNone(coach.selfPlayPool)
+            selfPlay.close()
+            self.assertIsNone(coach.selfPlayPool)
+        self.assertEqual([len(e) for e in episodes], [4, 4])
+        for serial, parallel in zip(*episodes):
+            np.testing.assert_array_equal(serial.boards, parallel.boards)
+            np.testing.assert_array_equal(serial.pis, parallel.pis)
+            np.testing.assert_array_equal(serial.vs, parallel.vs)
+        # the episodes are seeded differently
+        self.assertFalse(all(len(e) == len(episodes[0][0]) and np.array_equal(e.pis, episodes[0][0].pis)
+                             for e in episodes[0][1:]))
+
+
+class TestAsyncPipeline(unittest.TestCase):
+
+    def asyncArgs(self, folder, **kwargs):
+        return dotdict({'numIters': 2, 'numEps': 2, 'asyncPipeline': True, 'asyncEpisodesPerUpdate': 2,
+                        'tempThreshold': 15, 'numMCTSSims': 2, 'cpuct': 1, 'arenaCompare': 2,
+                        'updateThreshold': 0.6, 'seed': 0, 'checkpoint': folder}, **kwargs)
+
+    def test_learn_async(self):
+        game = TicTacToeGame()
+        # with two arena workers, the evaluator has child processes of its own
+        for numArenaWorkers in (1, 2):
+            with tempfile.TemporaryDirectory() as folder:
+                coach = Coach(game, CheckpointNNet(game), self.asyncArgs(folder, numArenaWorkers=numArenaWorkers))
+                with self.assertLogs('Coach', 'INFO') as logs:
+                    coach.learn()
+                self.assertEqual(coach.nnet.version, 2)
+                self.assertTrue(any('Candidate 2:' in line for line in logs.output))
+                # one shard per update, none left empty
+                self.assertEqual(coach.replayBuffer.shards(), [0, 1])
+                self.assertTrue(all(len(coach.replayBuffer.arrays(shard)[2]) for shard in (0, 1)))
+                files = os.listdir(folder)
+                self.assertIn('checkpoint_0.version', files)
+                self.assertIn('best.version', files)
+                # gated (or skipped) candidates are deleted, accepted ones live on as checkpoint_<k>
+                self.assertEqual([f for f in files if f.startswith('candidate_')], [])
+
+                # resuming trains on the loaded examples first, without opening an empty shard
+                coach = Coach(game, CheckpointNNet(game), self.asyncArgs(folder, numIters=1,
+                                                                         load_folder_file=(folder, 'best.pth.tar')))
+                coach.loadTrainExamples()
+                coach.learn()
+                self.assertEqual(coach.replayBuffer.shards(), [0, 1])
+
+    def test_learner_error(self):
+        game = TicTacToeGame()
+        with tempfile.TemporaryDirectory() as folder:
+            coach = Coach(game, BrokenTrainingNNet(game), self.asyncArgs(folder, numIters=3, numArenaWorkers=2))
+            with self.assertRaisesRegex(ValueError, 'training failed'):
+                coach.learn()
+            self.assertEqual(multiprocessing.active_children(), [])
+
+    def test_dead_evaluator(self):
+        game = TicTacToeGame()
+        with tempfile.TemporaryDirectory() as folder:
+            coach = Coach(game, BrokenCandidateNNet(game), self.asyncArgs(folder, numIters=3))
+            with self.assertRaisesRegex(RuntimeError, 'evaluator'):
+                coach.learn()
+
+
+class TestArena(unittest.TestCase):
+
+    def test_sprt_bounds(self):
+        for result, decision in [(1, SPRT.ACCEPT), (-1, SPRT.REJECT)]:
+            sprt = SPRT(0.55)
+            games = 0
+            while sprt.update(1e-4) == 0 and sprt.update(result) == 0:
+                games += 1
+                self.assertTrue(sprt.lower < sprt.llr < sprt.upper)
+            self.assertEqual(sprt.decision, decision)
+            self.assertTrue(sprt.llr >= sprt.upper if result == 1 else sprt.llr <= sprt.lower)
+            # only the decisive games moved the ratio
+            step = math.log(sprt.p1 / sprt.p0) if result == 1 else math.log((1 - sprt.p1) / (1 - sprt.p0))
+            self.assertAlmostEqual(sprt.llr, (games + 1) * step)
+
+    def test_schedule_and_swap(self):
+        starts = []
+
+        def player(name, first, second):
+            def play(board):
+                if not board.any():
+                    starts.append(name)
+                return second if board.any() else first
+            return play
+
+        # the starting player wins
+        one, two = player('one', 2, 0), player('two', 2, 0)
+        arena = Arena(one, two, DuelGame())
+        self.assertEqual(arena.playGames(4), (2, 2, 0))
+        self.assertEqual(starts, ['one', 'one', 'two', 'two'])
+        self.assertEqual(arena.gamesSaved, 0)
+        self.assertIs(arena.player1, two)
+        self.assertIs(arena.player2, one)
+
+        starts.clear()
+        arena = Arena(one, two, DuelGame())
+        self.assertEqual(arena.playGames(4, sprt=SPRT(0.55)), (2, 2, 0))
+        self.assertEqual(starts, ['one', 'two', 'one', 'two'])
+        self.assertIs(arena.player1, two)
+
+    def test_sprt_stops_the_match(self):
+        game = DuelGame()
+        # player2 wins (loses) every game, so the match stops after as many
+        # games as a test fed only wins (losses) needs
+        cases = [(ScriptedPlayer(0, 0), ScriptedPlayer(1, 1), 1, SPRT.ACCEPT, (0, 1, 0)),
+                 (ScriptedPlayer(1, 1), ScriptedPlayer(0, 0), -1, SPRT.REJECT, (1, 0, 0))]
+        for player1, player2, result, decision, perGame in cases:
+            reference = SPRT(0.55)
+            games = 1
+            while reference.update(result) == 0:
+                games += 1
+            sprt = SPRT(0.55)
+            arena = Arena(player1, player2, game)
+            self.assertEqual(arena.playGames(40, sprt=sprt), tuple(games * n for n in perGame))
+            self.assertEqual(sprt.decision, decision)
+            self.assertEqual(arena.gamesSaved, 40 - games)
+
+    def test_sprt_ignores_draws(self):
+        sprt = SPRT(0.55)
+        arena = Arena(ScriptedPlayer(1, 1), ScriptedPlayer(1, 1), DuelGame())
+        self.assertEqual(arena.playGames(40, sprt=sprt), (0, 0, 40))
+        self.assertEqual((sprt.decision, sprt.llr), (0, 0.0))
+        self.assertEqual(arena.gamesSaved, 0)
+
+    def test_parallel_tallies_match_sequential(self):
+        game = DuelGame()
+        # (wins when starting, losses when not) and (losses when starting, draws when not)
+        for first, second, expected in [((2, 0), (1, 1), (3, 3, 0)), ((1, 1), (1, 2), (0, 3, 3))]:
+            for workers in (1, 2):
+                arena = Arena(ScriptedPlayer(*first), ScriptedPlayer(*second), game, numWorkers=workers)
+                self.assertEqual(arena.playGames(6), expected)
+
+
+class TestKircheBitBoard(unittest.TestCase):
+
+    def randomPositions(self, game, numGames, seed):
+        """Yields (board, player) for every position of numGames random games."""
+        rng = np.random.default_rng(seed)
+        for _ in range(numGames):
+            board, player = game.getInitBoard(), 1
+            for _ in range(200):
+                yield board, player
+                b = Board(game.n)
+                b.state = board
+                moves = b.get_legal_moves(player)
+                if not moves or b.is_win(1) or b.is_win(-1):
+                    break
+                b = Board(game.n)
+                b.state = np.copy(board)
+                b.execute_move(moves[rng.integers(len(moves))], player)
+                board, player = b.state, -player
+
+    def test_matches_tensor_board(self):
+        for n, priests in [(4, 0), (5, 1), (6, 1), (6, 2), (7, 3)]:
+            game = KircheGame(n, priests)
+            for board, player in self.randomPositions(game, 20, seed=n * 10 + priests):
+                ref = Board(n)
+                ref.state = board
+                bit = BitBoard.from_tensor(board)
+                np.testing.assert_array_equal(bit.to_tensor(), board)
+                for color in (1, -1):
+                    moves = ref.get_legal_moves(color)
+                    self.assertEqual(sorted(bit.get_legal_moves(color)), sorted(moves))
+                    self.assertEqual(sorted(bit.get_legal_actions(color)),
+                                     sorted((s[0] * n + s[1]) * n * n + e[0] * n + e[1] for s, e in moves))
+                    self.assertEqual(bit.has_legal_moves(color), len(moves) > 0)
+                    self.assertEqual(bit.is_win(color), ref.is_win(color))
+                for move in ref.get_legal_moves(player):
+                    ref = Board(n)
+                    ref.state = np.copy(board)
+                    ref.execute_move(move, player)
+                    bit = BitBoard.from_tensor(board)
+                    bit.execute_move(move, player)
+                    np.testing.assert_array_equal(bit.to_tensor(), ref.state)
+
+    def test_compact_action_encoding(self):
+        full, compact = KircheGame(6, 2), KircheGame(6, 2, compact_actions=True)
+        self.assertEqual(compact.getActionSize(), 6 * 6 * 4)
+        for board, player in self.randomPositions(full, 10, seed=1):
+            moves = {full.decodeAction(a) for a in np.flatnonzero(full.getValidMoves(board, player))}
+            compactActions = np.flatnonzero(compact.getValidMoves(board, player))
+            self.assertEqual({compact.decodeAction(a) for a in compactActions}, moves)
+            for a in compactActions:
+                move = compact.decodeAction(a)
+                self.assertEqual(compact.encodeAction(*move), a)
+                np.testing.assert_array_equal(compact.getNextState(board, player, a)[0],
+                                              full.getNextState(board, player, full.encodeAction(*move))[0])
+
+
+class TestTicTacToe3DWinLines(unittest.TestCase):
+
+    def test_win_lines(self):
+        for n in range(2, 6):
+            lines = Board3D.win_lines(n)
+            self.assertEqual(len(lines), ((n + 2) ** 3 - n ** 3) // 2)
+            self.assertEqual(len({tuple(sorted(line)) for line in lines}), len(lines))
+            for line in lines:
+                for color in (1, -1):
+                    b = Board3D(n)
+                    b.pieces.ravel()[line] = color
+                    self.assertEqual(b.winner(), color)
+                    self.assertTrue(b.is_win(color))
+                    b.pieces.ravel()[line[-1]] = 0
+                    self.assertEqual(b.winner(), 0)
+
+    def test_space_diagonal_beyond_3x3x3(self):
+        game = TicTacToe3DGame(4)
+        board = game.getInitBoard()
+        for d in range(4):
+            board[d, 3 - d, d] = -1
+        self.assertEqual(game.getGameEnded(board, 1), -1)
+        self.assertEqual(game.getGameEnded(board, -1), 1)
+
+    def test_cube_symmetries(self):
+        rng = np.random.default_rng(0)
+        for n in (3, 4):
+            game = TicTacToe3DGame(n)
+            boardPermutations, piPermutations = game.getSymmetryPermutations()
+            self.assertEqual(len({p.tobytes() for p in boardPermutations}), 48)
+            # a group: closed under composition
+            for p in boardPermutations:
+                self.assertEqual(len({p[q].tobytes() for q in boardPermutations} |
+                                     {q.tobytes() for q in boardPermutations}), 48)
+
+            positions = []
+            for _ in range(5):
+                board, player = game.getInitBoard(), 1
+                while game.getGameEnded(board, player) == 0:
+                    positions.append(board)
+                    board, player = game.getNextState(board, player, rng.choice(np.flatnonzero(game.getValidMoves(board, player)[:-1])))
+                positions.append(board)
+            pis = rng.random((len(positions), game.getActionSize()))
+            symBoards, symPis = game.getSymmetriesBatch(np.stack(positions), pis)
+            for board, pi, boards, symmetryPis in zip(positions, pis, symBoards, symPis):
+                valids = game.getValidMoves(board, 1)
+                ended = game.getGameEnded(board, 1)
+                for (b, p), batchBoard, batchPi, piPermutation in zip(game.getSymmetries(board, pi), boards, symmetryPis, piPermutations):
+                    np.testing.assert_array_equal(b, batchBoard)
+                    np.testing.assert_array_equal(p, batchPi)
+                    self.assertEqual(game.getGameEnded(b, 1), ended)
+                    np.testing.assert_array_equal(game.getValidMoves(b, 1), valids[piPermutation])
+
+
+class TestBatchedGameAPI(unittest.TestCase):
+
+    def test_matches_single_board_methods(self):
+        rng = np.random.default_rng(0)
+        for game in (TicTacToeGame(), TicTacToe3DGame(3), KircheGame(5, 1), KircheGame(6, 2, compact_actions=True)):
+            boards, players, actions = [], [], []
+            while len(boards) < 300:
+                board, player = game.getInitBoard(), 1
+                while True:
+                    valids = game.getValidMoves(board, player)
+                    boards.append(board)
+                    players.append(player)
+                    # a pass on the full boards of TicTacToe, none on stuck Kirche boards
+                    actions.append(rng.choice(np.flatnonzero(valids)) if valids.any() else -1)
+                    if game.getGameEnded(board, player) != 0:
+                        break
+                    board, player = game.getNextState(board, player, actions[-1])
+            boards, players, actions = np.stack(boards), np.asarray(players), np.asarray(actions)
+
+            for batched in (type(game), Game):  # vectorized and the looping fallback of Game
+                np.testing.assert_array_equal(batched.getValidMovesBatch(game, boards, players),
+                                              [game.getValidMoves(b, p) for b, p in zip(boards, players)])
+                np.testing.assert_array_equal(batched.getGameEndedBatch(game, boards, players),
+                                              [game.getGameEnded(b, p) for b, p in zip(boards, players)])
+                np.testing.assert_array_equal(batched.getCanonicalFormBatch(game, boards, players),
+                                              [game.getCanonicalForm(b, p) for b, p in zip(boards, players)])
+                moves = actions >= 0
+                nextBoards, nextPlayers = batched.getNextStates(game, boards[moves], players[moves], actions[moves])
+                expected = [game.getNextState(b, p, a) for b, p, a in zip(boards[moves], players[moves], actions[moves])]
+                np.testing.assert_array_equal(nextBoards, [b for b, _ in expected])
+                np.testing.assert_array_equal(nextPlayers, [p for _, p in expected])
+
+
+class TestGameEndedAfterMove(unittest.TestCase):
+
+    def test_matches_full_scan(self):
+        rng = np.random.default_rng(0)
+        for game in (TicTacToeGame(3), TicTacToeGame(4), TicTacToe3DGame(3), TicTacToe3DGame(4)):
+            for _ in range(50):
+                board, player = game.getInitBoard(), 1
+                while game.getGameEnded(board, player) == 0:
+                    action = rng.choice(np.flatnonzero(game.getValidMoves(board, player)))
+                    board, player = game.getNextState(board, player, action)
+                    for p in (player, -player):
+                        self.assertEqual(game.getGameEndedAfterMove(board, p, action), game.getGameEnded(board, p))
+                        canonical = game.getCanonicalForm(board, p)
+                        self.assertEqual(game.getGameEndedAfterMove(canonical, 1, action), game.getGameEnded(canonical, 1))
+
+
+
+class TestSymmetryPermutations(unittest.TestCase):
+
+    def test_gather_matches_getSymmetries(self):
+        rng = np.random.default_rng(0)
+        for game in (TicTacToeGame(), TicTacToeGame(4), TicTacToe3DGame(3)):
+            board = rng.integers(-1, 2, game.getBoardSize())
+            pi = rng.random(game.getActionSize())
+            boardPermutations, piPermutations = game.getSymmetryPermutations()
+            gathered = {(board.ravel()[b].tobytes(), pi[p].tobytes()) for b, p in zip(boardPermutations, piPermutations)}
+            symmetries = {(np.ravel(b).tobytes(), np.asarray(p).tobytes()) for b, p in game.getSymmetries(board, pi)}
+            self.assertEqual(gathered, symmetries)
+            self.assertEqual(len(gathered), len(boardPermutations))
+
+            # a batch of copies of board is turned into random symmetries of it
+            boards, pis = randomSymmetries(game)(np.stack([board] * 512), np.stack([pi] * 512), rng)
+            self.assertEqual(boards.shape, (512,) + board.shape)
+            augmented = {(b.tobytes(), p.tobytes()) for b, p in zip(boards.reshape(512, -1), pis)}
+            self.assertLessEqual(augmented, symmetries)
+            self.assertEqual(len(augmented), len(symmetries))
+
+    def test_examples_per_position(self):
+        for game in (TicTacToeGame(), KircheGame(5, 1)):
+            args = dotdict({'tempThreshold': 15, 'numMCTSSims': 5, 'cpuct': 1, 'checkpoint': tempfile.gettempdir()})
+            # a network without augment needs every symmetry stored
+            with self.assertRaises(ValueError):
+                Coach(game, HashNNet(game), dotdict(args, storeSymmetries=False))
+            coach = Coach(game, HashNNet(game), args)
+            lengths = []
+            for storeSymmetries in (True, False):
+                coach.storeSymmetries = storeSymmetries
+                coach.seedEpisode(0)
+                coach.mcts = makeMCTS(game, coach.nnet, args)
+                lengths.append(len(coach.executeEpisode()))
+            self.assertEqual(lengths[0], symmetryCount(game) * lengths[1])
+
+
+class TestNumpyNNet(unittest.TestCase):
+
+    def test_convolution_matches_loops(self):
+        def conv(x, kernel, bias, padding):
+            cols, shape = im2col(x, kernel.shape[:-2], padding)
+            return (cols @ kernel.reshape(-1, kernel.shape[-1]) + bias).reshape(shape + (-1,))
+
+        rng = np.random.default_rng(0)
+        x = rng.standard_normal((2, 5, 4, 3)).astype(np.float32)
+        kernel = rng.standard_normal((3, 3, 3, 6)).astype(np.float32)
+        bias = rng.standard_normal(6).astype(np.float32)
+        padded = np.pad(x, ((0, 0), (1, 1), (1, 1), (0, 0)))
+        expected = np.zeros((2, 5, 4, 6), dtype=np.float32)
+        for i in range(5):
+            for j in range(4):
+                expected[:, i, j] = np.tensordot(padded[:, i:i + 3, j:j + 3], kernel, axes=3) + bias
+        np.testing.assert_allclose(conv(x, kernel, bias, 'same'), expected, rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(conv(x, kernel, bias, 'valid'), expected[:, 1:-1, 1:-1], rtol=1e-4, atol=1e-5)
+
+    @staticmethod
+    def tinyNet(rng):
+        net = NumpyNNet()
+        net.build({'ops': np.asarray(['reshape', 'conv:same', 'relu', 'flatten', 'dense', 'relu']),
+                   '0.shape': np.asarray([3, 3, 1]),
+                   '1.kernel': rng.standard_normal((3, 3, 1, 4)).astype(np.float32),
+                   '1.bias': rng.standard_normal(4).astype(np.float32),
+                   '4.kernel': rng.standard_normal((36, 16)).astype(np.float32),
+                   '4.bias': rng.standard_normal(16).astype(np.float32),
+                   'pi.kernel': rng.standard_normal((16, 10)).astype(np.float32) / 4,
+                   'pi.bias': np.zeros(10, dtype=np.float32),
+                   'v.kernel': rng.standard_normal((16, 1)).astype(np.float32) / 4,
+                   'v.bias': np.zeros(1, dtype=np.float32)})
+        return net
+
+    def test_predict_contract(self):
+        rng = np.random.default_rng(1)
+        net = self.tinyNet(rng)
+        with tempfile.TemporaryDirectory() as folder:
+            net.save_checkpoint(folder, 'best.pth.tar')
+            net = NumpyNNet()
+            net.load_checkpoint(folder, 'best.pth.tar')
+        boards = rng.integers(-1, 2, (5, 3, 3))
+        pis, vs = net.predict_batch(boards)
+        self.assertEqual((pis.shape, vs.shape), ((5, 10), (5,)))
+        np.testing.assert_allclose(pis.sum(axis=1), 1, rtol=1e-5)
+        pi, v = net.predict(boards[2])
+        np.testing.assert_allclose(pi, pis[2], rtol=1e-5)
+        np.testing.assert_allclose(v, vs[2:3], rtol=1e-5)
+
+    def test_int8_quantization(self):
+        rng = np.random.default_rng(2)
+        net = self.tinyNet(rng)
+        boards = rng.integers(-1, 2, (300, 3, 3)).astype(np.float32)
+        quantized = quantize(net, boards[:200])
+        self.assertEqual(quantized.arrays['4.kernel'].dtype, np.int8)
+        kl, valueError = compareOutputs(net, quantized, boards[200:])
+        self.assertLess(kl.mean(), 1e-3)
+        self.assertLess(valueError.mean(), 0.01)
+
+
+
+@unittest.skipUnless(importlib.util.find_spec('keras'), 'needs Keras')
+class TestNumpyExport(unittest.TestCase):
+
+    def test_matches_keras(self):
+        # Conv2D with bias, Conv3D with BatchNormalization(axis=3) kept as an
+        # affine layer, Conv2D without bias
+        cases = [(TicTacToeGame(), 'tictactoe.keras.NNet'), (TicTacToe3DGame(3), 'tictactoe_3d.keras.NNet'),
+                 (KircheGame(5, 1), 'kirche.keras.NNet')]
+        rng = np.random.default_rng(0)
+        for game, moduleName in cases:
+            NNet = importlib.import_module(moduleName)
+            channels = NNet.args['num_channels']
+            NNet.args['num_channels'] = 8
+            try:
+                model = NNet.NNetWrapper(game).nnet.model
+            finally:
+                NNet.args['num_channels'] = channels
+            # trained-looking statistics, so that folding them is not a no-op
+            for layer in model.layers:
+                if layer.__class__.__name__ == 'BatchNormalization':
+                    size = len(layer.get_weights()[0])
+                    layer.set_weights([rng.uniform(0.5, 1.5, size), rng.normal(0, 0.2, size),
+                                       rng.normal(0, 0.2, size), rng.uniform(0.5, 1.5, size)])
+            boards = rng.integers(-1, 2, (16,) + tuple(game.getBoardSize())).astype(np.float32)
+            boards[0] = game.getInitBoard()
+            pi, v = model.predict(boards, verbose=0)
+            with tempfile.TemporaryDirectory() as folder:
+                exportWeights(model, os.path.join(folder, 'best' + NumpyNNet.extension))
+                net = NumpyNNet(game)
+                net.load_checkpoint(folder, 'best.pth.tar')
+            npPi, npV = net.predict_batch(boards)
+            np.testing.assert_allclose(npPi, pi, rtol=1e-4, atol=1e-5, err_msg=moduleName)
+            np.testing.assert_allclose(np.ravel(npV), np.ravel(v), rtol=1e-4, atol=1e-5, err_msg=moduleName)
+            kinds = [kind for kind, _ in net.layers]
+            self.assertEqual('affine' in kinds, moduleName.startswith('tictactoe_3d'), msg=moduleName)
+
+
+@unittest.skipUnless(importlib.util.find_spec('tensorflow'), 'needs TensorFlow')
+class TestKerasDataset(unittest.TestCase):
+
+    def test_shapes_and_empty_input(self):
+        from KerasDataset import exampleDataset
+        game = TicTacToeGame()
+        with tempfile.TemporaryDirectory() as folder:
+            empty = [ExampleStore.forGame(game), ReplayBuffer(folder), []]
+            replayBuffer = ReplayBuffer(folder)
+            replayBuffer.beginShard()
+            replayBuffer.endShard()  # a shard without examples
+            empty.append(replayBuffer)
+            for examples in empty:
+                with self.assertRaisesRegex(ValueError, 'No examples'):
+                    exampleDataset(examples, 4)
+
+            examples = ExampleStore.forGame(game)
+            examples.append(np.zeros((5, 3, 3)), np.full((5, 10), 0.1), np.ones(5))
+            replayBuffer.beginShard()
+            replayBuffer.add(examples)
+            replayBuffer.endShard()
+            for examples in (examples, replayBuffer, list(zip(*unpackExamples(examples)))):
+                dataset = exampleDataset(examples, 4)
+                self.assertEqual(len(dataset), 2)
+                boards, (pis, vs) = next(iter(dataset))
+                self.assertEqual((boards.shape[1:], pis.shape[1:], vs.shape[1:]), ((3, 3), (10,), (1,)))
+
+
+class TestExampleStore(unittest.TestCase):
+
+    def test_append_grow_shuffle(self):
+        rng = np.random.default_rng(0)
+        examples = [(rng.integers(-1, 3, (3, 3, 2)), rng.random(5).tolist(), float(i)) for i in range(50)]
+        store = ExampleStore((3, 3, 2), 5, capacity=4, piDtype=np.float16)
+        store.extend(examples[:10])
+        copy = ExampleStore((3, 3, 2), 5, capacity=0)
+        copy.extend(examples[10:])
+        store.extend(copy)
+        self.assertEqual((len(store), store.boards.dtype, store.pis.dtype), (50, np.int8, np.float16))
+        boards, pis, vs = unpackExamples(examples)
+        np.testing.assert_array_equal(store.boards, boards)
+        np.testing.assert_allclose(store.pis, pis, rtol=1e-3)
+
+        store.shuffle(np.random.default_rng(1))
+        order = store.vs.astype(int)
+        self.assertEqual(sorted(order), list(range(50)))
+        np.testing.assert_array_equal(store.boards, boards[order])
+        with self.assertRaises(ValueError):
+            store.append(np.full((1, 3, 3, 2), 0.5), np.zeros((1, 5)), [0.0])
+
+
+class TestReplayBuffer(unittest.TestCase):
+
+    def test_shards(self):
+        rng = np.random.default_rng(0)
+
+        def episode(length):
+            return [(rng.integers(-1, 2, (3, 3)), rng.random(10).tolist(), float(rng.choice([-1, 1])))
+                    for _ in range(length)]
+
+        with tempfile.TemporaryDirectory() as folder:
+            replayBuffer = ReplayBuffer(folder, maxShards=2, maxShardLength=8)
+            iterations = []
+            for length in (5, 7, 6):
+                replayBuffer.beginShard()
+                iterations.append(episode(length) + episode(length))
+                replayBuffer.add(iterations[-1][:length])
+                replayBuffer.add(iterations[-1][length:])
+                replayBuffer.endShard()
+            self.assertEqual(replayBuffer.trim(), 1)
+
+            # reopened, as on resume
+            replayBuffer = ReplayBuffer(folder, maxShards=2, maxShardLength=8)
+            self.assertEqual(replayBuffer.shards(), [1, 2])
+            expected = iterations[1][-8:] + iterations[2][-8:]
+            examples = replayBuffer.examples()
+            self.assertEqual(len(replayBuffer), len(expected))
+            self.assertEqual(len(examples), len(expected))
+            boards, pis, vs = unpackExamples(expected)
+            np.testing.assert_array_equal(examples.boards, boards)
+            np.testing.assert_allclose(examples.pis, pis, rtol=1e-6)
+            np.testing.assert_array_equal(examples.vs, vs)
+
+            # rows of an episode cut short by a crash are ignored
+            with open(replayBuffer.shardPath(2, 'boards'), 'ab') as f:
+                f.write(np.zeros((2, 3, 3), dtype=replayBuffer.meta['boardDtype']).tobytes() + b'\0')
+            boards, pis, vs = ReplayBuffer(folder).arrays(2)
+            self.assertEqual((len(boards), len(pis), len(vs)), (12, 12, 12))
+
+    def test_mismatched_examples(self):
+        with tempfile.TemporaryDirectory() as folder:
+            replayBuffer = ReplayBuffer(folder)
+            replayBuffer.beginShard()
+            try:
+                replayBuffer.add([(np.zeros((3, 3), dtype=np.int8), np.ones(10) / 10, 1.0)])
+                for board, pi in [(np.zeros((4, 4), dtype=np.int8), np.ones(17) / 17),
+                                  (np.zeros((3, 3), dtype=np.int8), np.ones(17) / 17),
+                                  (np.zeros((3, 3)), np.ones(10) / 10)]:
+                    with self.assertRaises(ValueError):
+                        replayBuffer.add([(board, pi, 1.0)])
+            finally:
+                replayBuffer.endShard()
+            # nor on a reopened buffer
+            replayBuffer = ReplayBuffer(folder)
+            replayBuffer.beginShard()
+            with self.assertRaises(ValueError):
+                replayBuffer.add([(np.zeros((4, 4), dtype=np.int8), np.ones(17) / 17, 1.0)])
+            replayBuffer.endShard()
+            self.assertEqual(len(replayBuffer), 1)
+
+    def test_only_loaded_examples_are_reused(self):
+        game = TicTacToeGame()
+        with tempfile.TemporaryDirectory() as folder:
+            args = dotdict({'numIters': 1, 'numEps': 2, 'tempThreshold': 15, 'numMCTSSims': 5, 'cpuct': 1,
+                            'arenaCompare': 2, 'updateThreshold': 0.6, 'seed': 0,
+                            'checkpoint': os.path.join(folder, 'run'),
+                            'load_folder_file': (os.path.join(folder, 'run'), 'best.pth.tar')})
+            sizes = []
+            for _ in range(2):
+                coach = Coach(game, CheckpointNNet(game), args)
+                coach.learn()
+                sizes.append((coach.replayBuffer.shards(), len(coach.replayBuffer)))
+            # the second fresh run does not train on the examples of the first
+            self.assertEqual(sizes[0], sizes[1])
+            self.assertEqual(sizes[0][0], [0])
+
+            # resuming keeps them, in place or copied over an earlier buffer
+            for checkpoint in (args.checkpoint, os.path.join(folder, 'copy')):
+                if checkpoint != args.checkpoint:
+                    stale = ReplayBuffer(os.path.join(checkpoint, 'replay'))
+                    stale.beginShard()
+                    stale.add([(np.zeros((3, 3), dtype=np.int8), np.ones(10) / 10, 1.0)] * 3)
+                    stale.endShard()
+                coach = Coach(game, CheckpointNNet(game), dotdict(args, checkpoint=checkpoint))
+                coach.loadTrainExamples()
+                self.assertEqual((coach.replayBuffer.shards(), len(coach.replayBuffer)), sizes[0])
+
+    def test_resume_from_pickled_history(self):
+        game = TicTacToeGame()
+        rng = np.random.default_rng(0)
+        with tempfile.TemporaryDirectory() as folder:
+            # trainExamplesHistory as older versions pickled it: int64 boards, list policies
+            history = [deque((rng.integers(-1, 2, (3, 3)), (np.ones(10) / 10).tolist(), 1.0) for _ in range(length))
+                       for length in (4, 6)]
+            with open(os.path.join(folder, 'best.pth.tar.examples'), 'wb') as f:
+                pickle.dump(history, f)
+            args = dotdict({'numIters': 2, 'numEps': 2, 'tempThreshold': 15, 'numMCTSSims': 5, 'cpuct': 1,
+                            'arenaCompare': 2, 'updateThreshold': 0.6, 'seed': 0,
+                            'checkpoint': os.path.join(folder, 'run'), 'load_folder_file': (folder, 'best.pth.tar')})
+            coach = Coach(game, CheckpointNNet(game), args)
+            coach.loadTrainExamples()
+            self.assertEqual(len(coach.replayBuffer), 10)
+            boards, _, _ = coach.replayBuffer.arrays(0)
+            np.testing.assert_array_equal(boards, [b for b, _, _ in history[0]])
+            # the first iteration trains on the imported examples, the second adds self-play ones
+            coach.learn()
+            self.assertEqual(coach.replayBuffer.shards(), [0, 1, 2])
+            self.assertGreater(len(coach.replayBuffer), 10)
+
+    def test_batches_across_shards(self):
+        rng = np.random.default_rng(0)
+        with tempfile.TemporaryDirectory() as folder:
+            replayBuffer = ReplayBuffer(folder)
+            for length in (5, 0, 9, 3):
+                replayBuffer.beginShard()
+                # the board holds the index of the example
+                replayBuffer.add([(np.full((2, 2), len(replayBuffer) + i), rng.random(4), float(length))
+                                  for i in range(length)])
+                replayBuffer.endShard()
+            chunks = [replayBuffer.arrays(shard) for shard in replayBuffer.shards()]
+            allPis, allVs = (np.concatenate([chunk[c] for chunk in chunks]) for c in (1, 2))
+
+            def flip(boards, pis, rng):
+                return -boards, pis[:, ::-1]
+
+            batches = ExampleBatches(chunks, 4, augment=flip, seed=0)
+            self.assertEqual(len(batches), 17)
+            epochs = []
+            for _ in range(2):
+                ids = []
+                for boards, (pis, vs) in batches:
+                    self.assertLessEqual(len(boards), 4)
+                    self.assertEqual(boards.dtype, np.float32)
+                    self.assertEqual(vs.shape, (len(boards), 1))
+                    for board, pi, v in zip(boards, pis, vs[:, 0]):
+                        i = int(-board[0, 0])
+                        np.testing.assert_array_equal(pi, allPis[i][::-1])
+                        self.assertEqual(v, allVs[i])
+                        ids.append(i)
+                self.assertEqual(sorted(ids), list(range(17)))
+                epochs.append(ids)
+            self.assertNotEqual(epochs[0], epochs[1])
+
+            # an epoch of examples stored in one symmetry goes over each once per symmetry
+            batches = ExampleBatches(chunks, 4, seed=0, repeat=3)
+            self.assertEqual(batches.steps(), 13)
+            ids = [int(board[0, 0]) for boards, _ in batches for board in boards]
+            self.assertEqual(sorted(ids), sorted(list(range(17)) * 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
 from __future__ import print_function
+import functools
 import sys
 sys.path.append('..')
 from Game import Game
+from utils import symmetryPermutations, xorKeys, zobristList, zobristTable
 from .TicTacToeLogic import Board
 import numpy as np
 
@@ -17,6 +19,7 @@ Based on the OthelloGame by Surag Nair.
 class TicTacToeGame(Game):
     def __init__(self, n=3):
         self.n = n
+        self.permutations = None  # getSymmetryPermutations, computed on first use
 
     def getInitBoard(self):
         # return initial board (numpy board)
@@ -70,10 +73,74 @@ class TicTacToeGame(Game):
         # draw has a very little value 
         return 1e-4
 
+    def getGameEndedAfterMove(self, board, player, action):
+        # only the lines through the square of the last move can have been completed
+        if action is None or action == self.n*self.n:
+            return self.getGameEnded(board, player)
+        b = Board(self.n)
+        b.pieces = board
+        move = (int(action/self.n), action%self.n)
+        color = board[move]
+
+        if b.is_win_through(move, color):
+            return 1 if color == player else -1
+        if b.has_legal_moves():
+            return 0
+        # draw has a very little value 
+        return 1e-4
+
     def getCanonicalForm(self, board, player):
         # return state if player==1, else return -state if player==-1
         return player*board
 
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def winLines(n):
+        """The 2n + 2 lines of an n x n board (rows, columns, both diagonals)
+        as an (L, n) array of indices into board.ravel()."""
+        cells = np.arange(n*n).reshape(n, n)
+        return np.vstack([cells, cells.T, np.diag(cells), np.diag(np.fliplr(cells))])
+
+    def getNextStates(self, boards, players, actions):
+        boards, players, actions = np.asarray(boards), np.asarray(players), np.asarray(actions)
+        nextBoards = boards.reshape(len(boards), -1).copy()
+        moves = np.flatnonzero(actions != self.n*self.n)  # pass leaves the board as it is
+        nextBoards[moves, actions[moves]] = players[moves]
+        return nextBoards.reshape(boards.shape), -players
+
+    def getValidMovesBatch(self, boards, players):
+        empty = np.asarray(boards).reshape(len(boards), -1) == 0
+        # pass only when the board is full, as in getValidMoves
+        return np.hstack([empty, ~empty.any(axis=1, keepdims=True)]).astype(int)
+
+    def getGameEndedBatch(self, boards, players):
+        flat = np.asarray(boards).reshape(len(boards), -1)
+        players = np.asarray(players)[:, np.newaxis]
+        sums = flat[:, self.winLines(self.n)].sum(axis=2)
+        won, lost = (sums == players*self.n).any(axis=1), (sums == -players*self.n).any(axis=1)
+        # draw has a very little value
+        ended = np.where((flat == 0).any(axis=1), 0, 1e-4)
+        return np.where(won, 1, np.where(lost, -1, ended))
+
+    def getCanonicalFormBatch(self, boards, players):
+        return np.asarray(players).reshape((-1,) + (1,)*(np.ndim(boards) - 1)) * boards
+
+    def getZobristKeys(self, board):
+        # table[square, 0] for a piece of player 1, table[square, 1] for player -1;
+        # the flipped key swaps the colors
+        table = zobristTable((self.n*self.n, 2))
+        pieces = np.ravel(board)
+        white, black = np.flatnonzero(pieces == 1), np.flatnonzero(pieces == -1)
+        return (xorKeys(table[white, 0]) ^ xorKeys(table[black, 1]),
+                xorKeys(table[white, 1]) ^ xorKeys(table[black, 0]))
+
+    def getNextZobristKeys(self, board, player, action, keys):
+        if action == self.n*self.n:
+            return keys
+        keys_of_square = zobristList((self.n*self.n, 2))[action]
+        color = 0 if player == 1 else 1
+        return (keys[0] ^ keys_of_square[color], keys[1] ^ keys_of_square[1 - color])
+
     def getSymmetries(self, board, pi):
         # mirror, rotational
         assert(len(pi) == self.n**2+1)  # 1 for pass
@@ -90,6 +157,11 @@ class TicTacToeGame(Game):
                 l += [(newB, list(newPi.ravel()) + [pi[-1]])]
         return l
 
+    def getSymmetryPermutations(self):
+        if self.permutations is None:
+            self.permutations = symmetryPermutations(self)
+        return self.permutations
+
     def stringRepresentation(self, board):
         # 8x8 numpy array (canonical board)
         return board.tostring()
@@ -92,6 +92,22 @@ class Board():
         
         return False
 
+    def is_win_through(self, move, color):
+        """Check whether the given player has collected a triplet in a line through
+        the square move=(x,y), i.e. whether a piece placed there won the game;
+        @param color (1=white,-1=black)
+        """
+        (x,y) = move
+        lines = [[(x,d) for d in range(self.n)], [(d,y) for d in range(self.n)]]
+        if x==y:
+            lines.append([(d,d) for d in range(self.n)])
+        if x+y==self.n-1:
+            lines.append([(d,self.n-d-1) for d in range(self.n)])
+        for line in lines:
+            if all(self[i][j]==color for i, j in line):
+                return True
+        return False
+
     def execute_move(self, move, color):
         """Perform the given move on the board; 
         color gives the color pf the piece to play (1=white,-1=black)
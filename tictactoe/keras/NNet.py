@@ -9,6 +9,10 @@ import sys
 sys.path.append('..')
 from utils import *
 from NeuralNet import NeuralNet
+from KerasPredictor import KerasPredictor
+from ExampleStore import randomSymmetries, symmetryCount, unpackExamples
+from KerasDataset import exampleDataset
+from ReplayBuffer import ReplayBuffer
 
 import argparse
 from .TicTacToeNNet import TicTacToeNNet as onnet
@@ -29,39 +33,43 @@ args = dotdict({
     'batch_size': 64,
     'cuda': False,
     'num_channels': 512,
+    'jit_compile': False,  # compile the inference graph with XLA
+    'tf_data': True,  # stream shuffled batches through tf.data instead of fitting on whole arrays
+    'augment': False,  # train on random symmetries, each example once per symmetry and epoch; needs Coach storeSymmetries False
 })
 
 class NNetWrapper(NeuralNet):
     def __init__(self, game):
         self.nnet = onnet(game, args)
+        self.game = game
         self.board_x, self.board_y = game.getBoardSize()
         self.action_size = game.getActionSize()
+        self.predictor = KerasPredictor(self.nnet.model, game.getBoardSize(), jitCompile=args.jit_compile)
 
     def train(self, examples):
         """
-        examples: list of examples, each example is of form (board, pi, v)
+        examples: ReplayBuffer, ExampleStore or list of examples, each example is of form (board, pi, v)
         """
-        input_boards, target_pis, target_vs = list(zip(*examples))
-        input_boards = np.asarray(input_boards)
-        target_pis = np.asarray(target_pis)
-        target_vs = np.asarray(target_vs)
-        self.nnet.model.fit(x = input_boards, y = [target_pis, target_vs], batch_size = args.batch_size, epochs = args.epochs)
+        if args.tf_data or args.augment or isinstance(examples, ReplayBuffer):
+            augment = randomSymmetries(self.game) if args.augment else None
+            repeat = symmetryCount(self.game) if args.augment else 1
+            dataset = exampleDataset(examples, args.batch_size, augment=augment, repeat=repeat)
+            self.nnet.model.fit(dataset, epochs = args.epochs, shuffle = False)
+        else:
+            input_boards, target_pis, target_vs = unpackExamples(examples)
+            self.nnet.model.fit(x = input_boards, y = [target_pis, target_vs], batch_size = args.batch_size, epochs = args.epochs)
 
     def predict(self, board):
         """
         board: np array with board
         """
-        # timing
-        start = time.time()
-
-        # preparing input
-        board = board[np.newaxis, :, :]
-
-        # run
-        pi, v = self.nnet.model(board, training=False)
+        return self.predictor.predict(board)
 
-        #print('PREDICTION TIME TAKEN : {0:03f}'.format(time.time()-start))
-        return pi[0].numpy(), v[0].numpy()
+    def predict_batch(self, boards):
+        """
+        boards: np array of stacked boards
+        """
+        return self.predictor.predict_batch(boards)
 
     def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
         # change extension
@@ -1,7 +1,10 @@
 from __future__ import print_function
+import functools
+import itertools
 import sys
 sys.path.append('..')
 from Game import Game
+from utils import xorKeys, zobristList, zobristTable
 from .TicTacToeLogic import Board
 import numpy as np
 
@@ -61,12 +64,27 @@ class TicTacToeGame(Game):
         # return 0 if not ended, 1 if player 1 won, -1 if player 1 lost
         # player = 1
         b = Board(self.n)
-        b.pieces = np.copy(board)
+        b.pieces = board
+
+        winner = b.winner()
+        if winner != 0:
+            return winner * player
+        if b.has_legal_moves():
+            return 0
+        # draw has a very little value 
+        return 1e-4
 
-        if b.is_win(player):
-            return 1
-        if b.is_win(-player):
-            return -1
+    def getGameEndedAfterMove(self, board, player, action):
+        # only the lines through the cell of the last move can have been completed
+        if action is None or action == self.n*self.n*self.n:
+            return self.getGameEnded(board, player)
+        b = Board(self.n)
+        b.pieces = board
+        move = (action // (self.n*self.n), action // self.n % self.n, action % self.n)
+        color = board[move]
+
+        if b.is_win_through(move, color):
+            return 1 if color == player else -1
         if b.has_legal_moves():
             return 0
         # draw has a very little value 
@@ -76,27 +94,92 @@ class TicTacToeGame(Game):
         # return state if player==1, else return -state if player==-1
         return player*board
 
+    def getNextStates(self, boards, players, actions):
+        boards, players, actions = np.asarray(boards), np.asarray(players), np.asarray(actions)
+        nextBoards = boards.reshape(len(boards), -1).copy()
+        moves = np.flatnonzero(actions != self.n*self.n*self.n)  # pass leaves the board as it is
+        nextBoards[moves, actions[moves]] = players[moves]
+        return nextBoards.reshape(boards.shape), -players
+
+    def getValidMovesBatch(self, boards, players):
+        empty = np.asarray(boards).reshape(len(boards), -1) == 0
+        # pass only when the board is full, as in getValidMoves
+        return np.hstack([empty, ~empty.any(axis=1, keepdims=True)]).astype(int)
+
+    def getGameEndedBatch(self, boards, players):
+        flat = np.asarray(boards).reshape(len(boards), -1)
+        sums = flat[:, Board.win_lines(self.n)].sum(axis=2)
+        winner = np.where((sums == self.n).any(axis=1), 1, np.where((sums == -self.n).any(axis=1), -1, 0))
+        # draw has a very little value
+        ended = np.where((flat == 0).any(axis=1), 0, 1e-4)
+        return np.where(winner != 0, winner * np.asarray(players), ended)
+
+    def getCanonicalFormBatch(self, boards, players):
+        return np.asarray(players).reshape((-1,) + (1,)*(np.ndim(boards) - 1)) * boards
+
+    def getZobristKeys(self, board):
+        # table[square, 0] for a piece of player 1, table[square, 1] for player -1;
+        # the flipped key swaps the colors
+        table = zobristTable((self.n*self.n*self.n, 2))
+        pieces = np.ravel(board)
+        white, black = np.flatnonzero(pieces == 1), np.flatnonzero(pieces == -1)
+        return (xorKeys(table[white, 0]) ^ xorKeys(table[black, 1]),
+                xorKeys(table[white, 1]) ^ xorKeys(table[black, 0]))
+
+    def getNextZobristKeys(self, board, player, action, keys):
+        if action == self.n*self.n*self.n:
+            return keys
+        keys_of_square = zobristList((self.n*self.n*self.n, 2))[action]
+        color = 0 if player == 1 else 1
+        return (keys[0] ^ keys_of_square[color], keys[1] ^ keys_of_square[1 - color])
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def cubeSymmetries(n):
+        """The 48 symmetries of the n x n x n cube (6 orders of the axes times
+        8 combinations of reversed axes, the identity first) as flat index
+        permutations: boards (48, n^3) into board.ravel(), policies
+        (48, n^3 + 1) into pi, the pass action staying in place. They map
+        win lines onto win lines, so every symmetry of a position has the
+        same outcome. Computed once per board size.
+        """
+        cells = np.arange(n*n*n).reshape(n, n, n)
+        boards = []
+        for axes in itertools.permutations(range(3)):
+            for flips in itertools.product((False, True), repeat=3):
+                flipped = np.transpose(cells, axes)
+                for axis in np.flatnonzero(flips):
+                    flipped = np.flip(flipped, axis)
+                boards.append(flipped.ravel())
+        boards = np.asarray(boards)
+        pis = np.hstack([boards, np.full((len(boards), 1), n*n*n)])
+        return boards, pis
+
     def getSymmetries(self, board, pi):
-        # mirror, rotational
-        pi_board = np.reshape(pi[:-1], (self.n, self.n, self.n))
-        l = []
-        newB = np.reshape(board, (self.n*self.n, self.n))
-        newPi = pi_board
-        for i in range(1,5):
-
-            for z in [True, False]:
-                for j in [True, False]:
-                    if j:
-                        newB = np.fliplr(newB)
-                        newPi = np.fliplr(newPi)
-                    if z:
-                        newB = np.flipud(newB)
-                        newPi = np.flipud(newPi)
-                    
-                    newB = np.reshape(newB, (self.n,self.n,self.n))
-                    newPi = np.reshape(newPi, (self.n,self.n,self.n))
-                    l += [(newB, list(newPi.ravel()) + [pi[-1]])]
-        return l
+        # the 48 rotations and reflections of the cube, one np.take for all boards and one for all policies
+        boards, pis = self.cubeSymmetries(self.n)
+        return list(zip(np.take(board, boards).reshape((len(boards),) + np.shape(board)), np.take(pi, pis)))
+
+    def getSymmetriesBatch(self, boards, pis):
+        """
+        getSymmetries of many positions at once.
+
+        Input:
+            boards: (B, n, n, n) array of boards
+            pis: (B, n^3 + 1) array of their policies
+
+        Returns:
+            symBoards: (B, 48, n, n, n) array, symBoards[i, s] the s-th symmetry of boards[i]
+            symPis: (B, 48, n^3 + 1) array of the corresponding policies
+        """
+        boards, pis = np.asarray(boards), np.asarray(pis)
+        boardPermutations, piPermutations = self.cubeSymmetries(self.n)
+        symBoards = np.take(boards.reshape(len(boards), -1), boardPermutations, axis=1)
+        return (symBoards.reshape((len(boards), len(boardPermutations)) + boards.shape[1:]),
+                np.take(pis, piPermutations, axis=1))
+
+    def getSymmetryPermutations(self):
+        return self.cubeSymmetries(self.n)
 
     def stringRepresentation(self, board):
         # 8x8 numpy array (canonical board)
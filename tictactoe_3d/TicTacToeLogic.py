@@ -1,3 +1,6 @@
+import functools
+import itertools
+
 import numpy as np
 '''
 Board class for the game of TicTacToe.
@@ -55,188 +58,61 @@ class Board():
         return list(moves)
 
     def has_legal_moves(self):
-        for z in range(self.n):
-            for y in range(self.n):
-                for x in range(self.n):
-                    if self.pieces[z][x][y]==0:
-                        return True
-        return False
+        return np.count_nonzero(self.pieces) < self.pieces.size
     
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def win_lines(n):
+        """All lines of n squares on an n x n x n board, as an (L, n) array of
+        indices into pieces.ravel(): 3n^2 rows/columns/pillars, 6n plane
+        diagonals and the 4 space diagonals, ((n+2)^3 - n^3) / 2 in total.
+        Computed once per board size.
+        """
+        # one direction out of each +/- pair: first non-zero component positive
+        directions = [d for d in itertools.product((-1, 0, 1), repeat=3)
+                      if any(d) and d[next(i for i in range(3) if d[i])] > 0]
+        steps = np.arange(n)
+        lines = []
+        for d in directions:
+            for start in itertools.product(range(n), repeat=3):
+                cells = np.array(start)[:, None] + np.outer(d, steps)
+                if cells.min() >= 0 and cells.max() < n:
+                    lines.append(np.ravel_multi_index(cells, (n, n, n)))
+        return np.array(lines)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def cell_lines(n):
+        """For every cell (index into pieces.ravel()) the rows of win_lines(n)
+        passing through it."""
+        lines = Board.win_lines(n)
+        return [lines[(lines == cell).any(axis=1)] for cell in range(n * n * n)]
+
+    def winner(self):
+        """Returns the player (1 or -1) owning a complete line, 0 if there is none."""
+        sums = self.pieces.ravel()[self.win_lines(self.n)].sum(axis=1)
+        if sums.max() == self.n:
+            return 1
+        if sums.min() == -self.n:
+            return -1
+        return 0
+
     def is_win(self, color):
-        """Check whether the given player has collected a triplet in any direction; 
+        """Check whether the given player has collected n in a row in any direction;
         @param color (1=white,-1=black)
         """
-        win = self.n
-        # check z-dimension
-        count = 0
-        for z in range(self.n):
-            count = 0
-            for y in range(self.n):
-                count = 0
-                for x in range(self.n):
-                    if self.pieces[z,x,y]==color:
-                        count += 1
-                if count==win:
-                    return True
-
-        count = 0
-        for z in range(self.n):
-            count = 0
-            for x in range(self.n):
-                count = 0
-                for y in range(self.n):
-                    if self.pieces[z,x,y]==color:
-                        count += 1
-                if count==win:
-                    return True
-        
-        # check x dimension
-        count = 0
-        for x in range(self.n):
-            count = 0
-            for z in range(self.n):
-                count = 0
-                for y in range(self.n):
-                    if self.pieces[z,x,y]==color:
-                        count += 1
-                if count==win:
-                    return True
-
-        count = 0
-        for x in range(self.n):
-            count = 0
-            for y in range(self.n):
-                count = 0
-                for z in range(self.n):
-                    if self.pieces[z,x,y]==color:
-                        count += 1
-                if count==win:
-                    return True
-
-        # check y dimension
-        count = 0
-        for y in range(self.n):
-            count = 0
-            for x in range(self.n):
-                count = 0
-                for z in range(self.n):
-                    if self.pieces[z,x,y]==color:
-                        count += 1
-                if count==win:
-                    return True
-        
-        count = 0
-        for y in range(self.n):
-            count = 0
-            for z in range(self.n):
-                count = 0
-                for x in range(self.n):
-                    if self.pieces[z,x,y]==color:
-                        count += 1
-                if count==win:
-                    return True
-        
-        # check flat diagonals
-        # check z dimension
-        count = 0
-        for z in range(self.n):
-            count = 0
-            for d in range(self.n):
-                if self.pieces[z,d,d]==color:
-                    count += 1
-            if count==win:
-                return True
-        
-        count = 0
-        for z in range(self.n):
-            count = 0
-            for d in range(self.n):
-                if self.pieces[z,d,self.n-d-1]==color:
-                    count += 1
-            if count==win:
-                return True
-
-        # check x dimension
-        count = 0
-        for x in range(self.n):
-            count = 0
-            for d in range(self.n):
-                if self.pieces[d,x,d]==color:
-                    count += 1
-            if count==win:
-                return True
-
-        count = 0
-        for x in range(self.n):
-            count = 0
-            for d in range(self.n):
-                if self.pieces[d,x,self.n-d-1]==color:
-                    count += 1
-            if count==win:
-                return True
-
-        # check y dimension
-        count = 0
-        for y in range(self.n):
-            count = 0
-            for d in range(self.n):
-                if self.pieces[d,d,y]==color:
-                    count += 1
-            if count==win:
-                return True
-
-        count = 0
-        for y in range(self.n):
-            count = 0
-            for d in range(self.n):
-                if self.pieces[self.n-d-1,d,y]==color:
-                    count += 1
-            if count==win:
-                return True
-        
-        # check 4 true diagonals
-        count = 0
-        if self.pieces[0,0,0] == color:
-            count += 1
-            if self.pieces[1,1,1] == color:
-                count += 1
-                if self.pieces[2,2,2] == color:
-                    count += 1
-                    if count == win:
-                        return True
-            
-        count = 0
-        if self.pieces[2,0,0] == color:
-            count += 1
-            if self.pieces[1,1,1] == color:
-                count += 1
-                if self.pieces[0,2,2] == color:
-                    count += 1
-                    if count == win:
-                        return True
-        
-        count = 0
-        if self.pieces[2,2,0] == color:
-            count += 1
-            if self.pieces[1,1,1] == color:
-                count += 1
-                if self.pieces[0,0,2] == color:
-                    count += 1
-                    if count == win:
-                        return True
-        
-        count = 0
-        if self.pieces[0,2,0] == color:
-            count += 1
-            if self.pieces[1,1,1] == color:
-                count += 1
-                if self.pieces[2,0,2] == color:
-                    count += 1
-                    if count == win:
-                        return True
-
-        # return false if no 3 is reached
-        return False
+        sums = self.pieces.ravel()[self.win_lines(self.n)].sum(axis=1)
+        return bool((sums == color * self.n).any())
+
+    def is_win_through(self, move, color):
+        """Check whether the given player has collected n in a row in a line through
+        the cell move=(z,x,y), i.e. whether a piece placed there won the game;
+        @param color (1=white,-1=black)
+        """
+        (z,x,y) = move
+        lines = self.cell_lines(self.n)[(z*self.n + x)*self.n + y]
+        # plain Python for the few lines through one cell, NumPy reductions cost more here
+        return color * self.n in self.pieces.take(lines).sum(axis=1).tolist()
 
     def execute_move(self, move, color):
         """Perform the given move on the board; 
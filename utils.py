@@ -1,3 +1,9 @@
+import functools
+import sys
+
+import numpy as np
+
+
 class AverageMeter(object):
     """From https://github.com/pytorch/examples/blob/master/imagenet/main.py"""
 
@@ -20,3 +26,63 @@ class AverageMeter(object):
 class dotdict(dict):
     def __getattr__(self, name):
         return self[name]
+
+
+@functools.lru_cache(maxsize=None)
+def zobristTable(shape):
+    """
+    Returns a uint64 array of random Zobrist keys of the given shape (a
+    tuple). The seed is fixed, so every process gets the same keys for the
+    same shape.
+    """
+    return np.random.default_rng(0x5EED).integers(0, 2**64, size=shape, dtype=np.uint64)
+
+
+@functools.lru_cache(maxsize=None)
+def zobristList(shape):
+    """zobristTable(shape) as nested lists of Python ints, for incremental updates."""
+    return zobristTable(shape).tolist()
+
+
+def xorKeys(keys):
+    """Returns the XOR of a uint64 array of Zobrist keys as a Python int."""
+    return int(np.bitwise_xor.reduce(keys))
+
+
+def symmetryPermutations(game):
+    """
+    Returns game.getSymmetries as the index permutations of
+    Game.getSymmetryPermutations, distinct ones only, for games whose
+    symmetries only move the squares and the policy entries around: the
+    symmetries of a board of square indices and a policy of action indices.
+    """
+    board = np.arange(np.prod(game.getBoardSize())).reshape(game.getBoardSize())
+    symmetries = game.getSymmetries(board, np.arange(game.getActionSize()))
+    boardPermutations = np.asarray([np.ravel(b) for b, _ in symmetries])
+    piPermutations = np.asarray([np.ravel(p) for _, p in symmetries])
+    _, first = np.unique(np.hstack([boardPermutations, piPermutations]), axis=0, return_index=True)
+    first = np.sort(first)
+    return boardPermutations[first], piPermutations[first]
+
+
+def getNNetArgs(nnetClass):
+    """
+    Returns the module level args dotdict a NNetWrapper class reads its
+    hyper-parameters from (e.g. kirche.keras.NNet.args).
+    """
+    return getattr(sys.modules[nnetClass.__module__], 'args', None)
+
+
+def buildNNet(game, nnetClass, nnetArgs=None, folder=None, filename=None):
+    """
+    Builds a NNetWrapper in a fresh process: restores the module level args
+    (which the training scripts modify after import) and loads the weights
+    from folder/filename if given.
+    """
+    moduleArgs = getNNetArgs(nnetClass)
+    if nnetArgs is not None and moduleArgs is not None:
+        moduleArgs.update(nnetArgs)
+    nnet = nnetClass(game)
+    if filename is not None:
+        nnet.load_checkpoint(folder=folder, filename=filename)
+    return nnet